@@ -141,6 +141,31 @@ in
           options = {
             enter = mkOption { type = str; default = ""; };
             leave = mkOption { type = str; default = ""; };
+            parallel = mkOption {
+              type = bool;
+              default = false;
+              description = ''
+                Allow the commands to run concurrently with the commands of
+                other parallel subsystems. Commands of non-parallel
+                subsystems run alone.
+              '';
+            };
+            after = mkOption {
+              type = listOf str;
+              default = [];
+              description = ''
+                Names of subsystems whose commands must be finished before
+                the commands of this subsystem start.
+              '';
+            };
+            timeout = mkOption {
+              type = nullOr ints.positive;
+              default = null;
+              description = ''
+                Seconds after which the commands are killed. A killed enter
+                command is treated like a temporary failure (EXIT_TEMPFAIL).
+              '';
+            };
           };
         });
         default = {};
@@ -195,6 +220,17 @@ in
         type = types.ints.positive;
       };
 
+      maintenanceRebootSeconds = mkOption {
+        default = 300;
+        description = ''
+          Expected time in seconds for a reboot after maintenance activities.
+          It's added to estimates learned from previous executions of
+          activities that need a reboot because the learned durations don't
+          include the reboot itself.
+        '';
+        type = types.ints.positive;
+      };
+
     };
   };
 
@@ -268,6 +304,8 @@ in
 
          [maintenance]
          preparation_seconds = ${toString cfg.agent.maintenancePreparationSeconds}
+         reboot_seconds = ${toString cfg.agent.maintenanceRebootSeconds}
+         archive_retention_days = ${toString logDaysKeep}
 
          [maintenance-enter]
          ${concatStringsSep "\n" (
@@ -276,6 +314,13 @@ in
          [maintenance-leave]
          ${concatStringsSep "\n" (mapAttrsToList (k: v: "${k} = ${v.leave}")
            cfg.agent.maintenance)}
+
+         [maintenance-hooks]
+         ${concatStringsSep "\n" (flatten (mapAttrsToList (k: v:
+           optional v.parallel "${k}.parallel = true"
+           ++ optional (v.after != []) "${k}.after = ${toString v.after}"
+           ++ optional (v.timeout != null) "${k}.timeout = ${toString v.timeout}")
+           cfg.agent.maintenance))}
       '';
 
       systemd.services.fc-agent = rec {
@@ -365,6 +410,7 @@ in
         "f /etc/nixos/local.nix 644"
         "d /root 0711"
         "d /var/log/fc-agent - - - ${toString logDaysKeep}d"
+        "d /var/cache/fc-agent 0755 root root -"
         "d /var/spool/maintenance/archive - - - ${toString logDaysKeep}d"
         # Remove various obsolete files and directories
         # /var/lib/fc-manage was only used on 15.09.
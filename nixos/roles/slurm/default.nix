@@ -412,6 +412,7 @@ in
         enter = ''
           fc-slurm -v all-nodes drain-and-down --reason "fc-agent: global maintenance"
         '';
+        parallel = true;
       };
     })
 
@@ -471,6 +472,7 @@ in
         enter = ''
           fc-slurm -v drain-and-down --reason "fc-agent: node maintenance"
         '';
+        parallel = true;
       };
     })
 
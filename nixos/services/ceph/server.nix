@@ -29,6 +29,7 @@ in
     flyingcircus.agent.maintenance.ceph = {
       enter = "${pkgs.fc.ceph}/bin/fc-ceph maintenance enter";
       leave = "${pkgs.fc.ceph}/bin/fc-ceph maintenance leave";
+      parallel = true;
     };
 
     # We used to create the admin key directory from the ENC. However,
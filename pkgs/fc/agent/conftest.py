@@ -12,13 +12,26 @@ def pytest_addoption(parser):
             "download and build things. Does not work in isolated environments"
         ),
     )
+    parser.addoption(
+        "--with-benchmarks",
+        action="store_true",
+        default=False,
+        dest="with_benchmarks",
+        help="Run benchmarks. Use with -s to see the results.",
+    )
 
 
 def pytest_collection_modifyitems(config, items):
-    if config.getoption("with_nix_build"):
-        return
-
     skip_nix = pytest.mark.skip(reason="needs --with-nix-build option to run")
+    skip_benchmark = pytest.mark.skip(
+        reason="needs --with-benchmarks option to run"
+    )
     for item in items:
-        if "needs_nix" in item.keywords:
+        if "needs_nix" in item.keywords and not config.getoption(
+            "with_nix_build"
+        ):
             item.add_marker(skip_nix)
+        if "benchmark" in item.keywords and not config.getoption(
+            "with_benchmarks"
+        ):
+            item.add_marker(skip_benchmark)
@@ -2,7 +2,7 @@ import configparser
 import contextlib
 import shutil
 import textwrap
-import unittest
+import unittest.mock
 import uuid
 from pathlib import Path
 
@@ -45,19 +45,21 @@ def agent_configparser(agent_maintenance_config):
 
 
 @fixture
-def reqmanager(tmp_path, logger, agent_maintenance_config):
+def reqmanager(tmp_path, logger, agent_maintenance_config, monkeypatch):
     spooldir = tmp_path / "maintenance"
     spooldir.mkdir()
     enc_path = tmp_path / "enc.json"
     enc_path.write_text("{}")
-    with unittest.mock.patch("fc.util.directory.connect"):
-        with ReqManager(
-            spooldir=spooldir,
-            enc_path=enc_path,
-            config_file=agent_maintenance_config,
-            log=logger,
-        ) as rm:
-            yield rm
+    # Patched with monkeypatch, so patches of the same attribute in tests are
+    # undone in the right order.
+    monkeypatch.setattr("fc.util.directory.connect", unittest.mock.MagicMock())
+    with ReqManager(
+        spooldir=spooldir,
+        enc_path=enc_path,
+        config_file=agent_maintenance_config,
+        log=logger,
+    ) as rm:
+        yield rm
 
 
 @fixture
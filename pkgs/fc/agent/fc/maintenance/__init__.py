@@ -1,2 +1,17 @@
-from .reqmanager import ReqManager
-from .request import Request
+"""Manage maintenance requests.
+
+`ReqManager` and `Request` are imported on first use, so importing small
+modules like `fc.maintenance.state` stays cheap.
+"""
+
+
+def __getattr__(name):
+    if name == "ReqManager":
+        from .reqmanager import ReqManager
+
+        return ReqManager
+    if name == "Request":
+        from .request import Request
+
+        return Request
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
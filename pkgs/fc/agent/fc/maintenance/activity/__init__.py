@@ -13,6 +13,15 @@ class RebootType(str, Enum):
     COLD = "poweroff"
 
 
+# Registry of all known activity types by type name, used for deserializing
+# activities. Subclasses of Activity are added automatically.
+ACTIVITY_TYPES: dict[str, type["Activity"]] = {}
+
+
+def activity_type_name(cls: type["Activity"]) -> str:
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
 class ActivityMergeResult(NamedTuple):
     merged: Optional["Activity"] = None
     is_effective: bool = False
@@ -42,6 +51,10 @@ class Activity:
     reboot_needed: None | RebootType = None
     # Do we predict that this activity will actually change anything?
     is_effective = True
+    # Can this activity run at the same time as other parallel-safe
+    # activities? They must not change shared system state and must not
+    # depend on the current working directory, use `request.dir` instead.
+    parallel_safe = False
     comment = ""
     estimate = Estimate("10m")
     log = None
@@ -51,13 +64,18 @@ class Activity:
         """Creates activity object (add args if you like).
 
         Note that this method gets only called once and the value of
-        __dict__ is serialized using PyYAML between runs.
+        __dict__ is serialized between runs. Attribute values must be
+        supported by `fc.maintenance.serialization`.
         """
         pass
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        ACTIVITY_TYPES[activity_type_name(cls)] = cls
+
     def __getstate__(self):
         state = self.__dict__.copy()
-        # Deserializing loggers breaks, remove them before serializing (to YAML).
+        # Deserializing loggers breaks, remove them before serializing.
         if "log" in state:
             del state["log"]
         if "request" in state:
@@ -88,7 +106,7 @@ class Activity:
         """Executes maintenance activity.
 
         Execution takes place in a request-specific directory as CWD. Do
-        whatever you want here, but do not destruct `request.yaml`.
+        whatever you want here, but do not destruct `request.json`.
         Directory contents is preserved between several attempts.
 
         This method is expected to update `self.stdout`, `self.stderr`, and
@@ -99,20 +117,42 @@ class Activity:
         """
         self.returncode = 0
 
-    def load(self):
+    def release(self):
+        """Frees resources that have been reserved for running the activity
+        later, like GC roots for prepared systems.
+
+        Gets called when the request leaves the queue, also when the
+        activity has never run because the request has been deleted or
+        merged away. May be called more than once.
+        """
+        pass
+
+    def load(self, request_dir: str):
         """Loads external state.
 
         This method gets called every time the Activity object is
         deserialized to perform additional state updating. This should
         be rarely needed, as the contents of self.__dict__ is preserved
-        anyway. CWD is set to the request dir.
+        anyway. `request_dir` is the absolute path of the request dir.
         """
         pass
 
-    def dump(self):
-        """Saves additional state during serialization."""
+    def dump(self, request_dir: str):
+        """Saves additional state during serialization.
+
+        Requests may be saved from several threads at once, so paths must
+        be built from the absolute `request_dir` instead of relying on the
+        current directory.
+        """
         pass
 
+    def duration_key(self) -> Optional[str]:
+        """Distinguishes activities of this type which take different
+        amounts of time, for learning durations. See
+        `fc.maintenance.durations`.
+        """
+        return None
+
     def merge(self, other) -> ActivityMergeResult:
         """Merges in other activity. Settings from other have precedence.
         Returns merge result.
@@ -129,3 +169,6 @@ class Activity:
                 out += " (cold reboot needed)"
 
         return out
+
+
+ACTIVITY_TYPES[activity_type_name(Activity)] = Activity
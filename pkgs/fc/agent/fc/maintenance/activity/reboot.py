@@ -16,6 +16,8 @@ _log = structlog.get_logger()
 
 class RebootActivity(Activity):
     estimate = Estimate("5m")
+    # The reboot itself is done by the ReqManager after all activities.
+    parallel_safe = True
 
     def __init__(
         self, action: Union[str, RebootType] = RebootType.WARM, log=_log
@@ -144,6 +144,22 @@ def activity(logger, nixos_mock):
     return activity
 
 
+def test_update_duration_key(activity):
+    assert activity.duration_key() == "reboot"
+    activity.reboot_needed = None
+    activity.unit_changes = {
+        "start": set(),
+        "stop": set(),
+        "restart": {"nginx.service"},
+        "reload": set(),
+    }
+    assert activity.duration_key() == "restart-few"
+    activity.unit_changes["restart"] = {f"{i}.service" for i in range(6)}
+    assert activity.duration_key() == "restart-many"
+    activity.unit_changes = {"reload": {"nginx.service"}}
+    assert activity.duration_key() == "reload"
+
+
 def test_update_dont_merge_incompatible(activity):
     other = Activity()
     result = activity.merge(other)
@@ -298,7 +314,14 @@ def test_update_activity_prepare(log, logger, tmp_path, activity, nixos_mock):
     activity.prepare()
 
     nixos_mock.build_system.assert_called_once_with(
-        NEXT_CHANNEL_URL, out_link="/run/next-system", log=activity.log
+        NEXT_CHANNEL_URL,
+        out_link="/run/next-system",
+        low_priority=True,
+        structured_log=True,
+        log=activity.log,
+    )
+    nixos_mock.pin_system.assert_called_once_with(
+        NEXT_SYSTEM_PATH, log=activity.log
     )
 
     nixos_mock.dry_activate_system.assert_called_once_with(
@@ -376,7 +399,7 @@ def test_update_activity_run(log, nixos_mock, activity, logger):
         activity.next_channel_url, log=activity.log
     )
     nixos_mock.build_system.assert_called_with(
-        activity.next_channel_url, log=activity.log
+        activity.next_channel_url, structured_log=True, log=activity.log
     )
     nixos_mock.register_system_profile.assert_called_with(
         NEXT_SYSTEM_PATH, log=activity.log
@@ -384,9 +407,20 @@ def test_update_activity_run(log, nixos_mock, activity, logger):
     nixos_mock.switch_to_system.assert_called_with(
         NEXT_SYSTEM_PATH, lazy=False, log=activity.log
     )
+    nixos_mock.unpin_system.assert_called_with(
+        NEXT_SYSTEM_PATH, log=activity.log
+    )
     assert log.has("update-run-succeeded")
 
 
+def test_update_activity_release_unpins_prepared_system(nixos_mock, activity):
+    activity.release()
+
+    nixos_mock.unpin_system.assert_called_once_with(
+        NEXT_SYSTEM_PATH, log=activity.log
+    )
+
+
 def test_update_activity_run_unchanged(log, nixos_mock, activity):
     activity.current_system = activity.next_system
 
@@ -18,9 +18,8 @@ from . import Activity, ActivityMergeResult, RebootType
 
 _log = structlog.get_logger()
 
-# The link goes away after a reboot. It's possible that the new system
-# will be garbage-collected before the switch in that case but the switch
-# will still work.
+# The link goes away after a reboot. The new system is still protected from
+# garbage collection by nixos.NEXT_SYSTEM_GC_ROOT until the switch.
 NEXT_SYSTEM = "/run/next-system"
 
 
@@ -29,7 +28,8 @@ class UpdateActivity(Activity):
     Updates the NixOS system to a different channel URL.
     The new system resulting from the channel URL is already pre-built
     in `UpdateActivity.prepare` which means that a run of this activity usually
-    only has to set the new system link and switch to it.
+    only has to set the new system link and switch to it. The pre-built system
+    is pinned as GC root until the update has been run.
     """
 
     def __init__(
@@ -122,7 +122,7 @@ class UpdateActivity(Activity):
             return False
         return True
 
-    def load(self):
+    def load(self, request_dir):
         # Add attributes after deserialization if needed to stay compatible
         # with older persisted instances of UpdateActivity.
         if not hasattr(self, "current_release"):
@@ -149,8 +149,13 @@ class UpdateActivity(Activity):
             out_link = NEXT_SYSTEM
 
         try:
+            # Building ahead of time, don't slow down the running system.
             self.next_system = nixos.build_system(
-                self.next_channel_url, out_link=out_link, log=self.log
+                self.next_channel_url,
+                out_link=out_link,
+                low_priority=True,
+                structured_log=True,
+                log=self.log,
             )
         except nixos.ChannelException:
             self.log.error(
@@ -164,6 +169,9 @@ class UpdateActivity(Activity):
             )
             raise
 
+        if not dry_run:
+            nixos.pin_system(self.next_system, log=self.log)
+
         self.unit_changes = nixos.dry_activate_system(
             self.next_system, self.log
         )
@@ -183,6 +191,20 @@ class UpdateActivity(Activity):
             # Only reloads or no unit changes, this should not take long
             self.estimate = Estimate("5m")
 
+    def duration_key(self) -> str:
+        """Groups updates by the size of their unit changes."""
+        if self.reboot_needed:
+            return "reboot"
+        changed = sum(
+            len(self.unit_changes.get(category, []))
+            for category in ("start", "stop", "restart")
+        )
+        if not changed:
+            return "reload"
+        if changed <= 5:
+            return "restart-few"
+        return "restart-many"
+
     def update_system_channel(self):
         nixos.update_system_channel(self.next_channel_url, self.log)
 
@@ -269,6 +291,11 @@ class UpdateActivity(Activity):
             next_release=self.next_release,
         )
 
+    def release(self):
+        """Unpins the prepared system if it's still pinned for us."""
+        if self.next_system:
+            nixos.unpin_system(self.next_system, log=self.log)
+
     def resume(self):
         """It's safe to resume an interrupted update, just run it again."""
         self.run()
@@ -278,21 +305,26 @@ class UpdateActivity(Activity):
         try:
             self.update_system_channel()
 
+            prepared_system = self.next_system
+
             if self.identical_to_current_system:
                 # Nothing to do here, always a success.
+                nixos.unpin_system(prepared_system, log=self.log)
                 self.returncode = 0
                 return
 
             init_command_logging(self.log)
 
             system_path = nixos.build_system(
-                self.next_channel_url, log=self.log
+                self.next_channel_url, structured_log=True, log=self.log
             )
             # System path may have changed since preparing the system because of
             # configuration changes, so update it here.
             self.next_system = system_path
             nixos.register_system_profile(system_path, log=self.log)
             nixos.switch_to_system(system_path, lazy=False, log=self.log)
+            # The system profile keeps the new system now.
+            nixos.unpin_system(prepared_system, log=self.log)
 
         except nixos.ChannelException as e:
             self._handle_channel_exception(e)
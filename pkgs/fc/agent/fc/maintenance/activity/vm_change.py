@@ -13,6 +13,10 @@ _log = structlog.get_logger()
 
 
 class VMChangeActivity(Activity):
+    # Only checks the current memory and cores, the reboot is done by the
+    # ReqManager after all activities.
+    parallel_safe = True
+
     def __init__(
         self,
         wanted_memory: Optional[int] = None,
@@ -0,0 +1,360 @@
+"""Compacted storage for archived maintenance requests.
+
+Finished requests are moved to the archive directory by `ReqManager.archive`.
+Keeping one directory per request forever makes every history lookup slower
+over time, so archived requests are compacted after a while:
+
+* Old request directories are rolled into append-only segment files in
+  `archive-segments`, one segment per month of completion. Each compaction
+  run appends a gzip member with one JSON document per line to the segment.
+  Concatenated gzip members are valid gzip files, so segments can be read
+  with standard tools like `zcat`.
+* A SQLite index maps request IDs to the segment and the offset of the gzip
+  member holding the request, together with the completion time. Looking up
+  a request only needs to decompress a single member. The index can be
+  rebuilt from the segments.
+* Segments whose newest request is older than the retention period are
+  deleted as a whole.
+"""
+
+import base64
+import gzip
+import json
+import os
+import sqlite3
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+
+import structlog
+
+_log = structlog.get_logger()
+
+# Bump this when changing the layout of the index database.
+INDEX_SCHEMA_VERSION = 1
+
+# Files larger than this are truncated when compacting a request dir. Their
+# beginning and end are kept, half of this size each.
+MAX_EXTRA_FILE_SIZE = 1024 * 1024
+
+
+class CompactedRequest(NamedTuple):
+    """An archived request stored in a segment file."""
+
+    id: str
+    completed_at: float
+    request: dict
+    # Additional UTF-8 text files found in the request dir, by file name.
+    files: dict[str, str]
+    # Other additional files, base64-encoded. Missing in entries written by
+    # older versions.
+    binary_files: dict[str, str] = {}
+    # Original sizes of files that have been stored truncated, by file name.
+    truncated_files: dict[str, int] = {}
+    # Names of entries that are not regular files and have not been stored.
+    skipped_files: list[str] = []
+
+    def to_json(self) -> str:
+        return json.dumps(self._asdict(), sort_keys=True)
+
+    @classmethod
+    def from_json(cls, line: str) -> "CompactedRequest":
+        return cls(**json.loads(line))
+
+
+class CompactionResult(NamedTuple):
+    compacted: list[str]
+    deleted_segments: list[str]
+
+
+def _segment_name(completed_at: float) -> str:
+    dt = datetime.fromtimestamp(completed_at, tz=timezone.utc)
+    return f"archive-{dt:%Y-%m}.jsonl.gz"
+
+
+def _iter_members(path: Path) -> Iterator[tuple[int, bytes]]:
+    """Yields offset and decompressed content of all gzip members in
+    the file at `path`.
+    """
+    with path.open("rb") as f:
+        data = f.read()
+
+    offset = 0
+    while offset < len(data):
+        decompressor = zlib.decompressobj(wbits=31)
+        content = decompressor.decompress(data[offset:])
+        if not decompressor.eof:
+            # Truncated member, probably from an interrupted append.
+            return
+        yield offset, content
+        offset = len(data) - len(decompressor.unused_data)
+
+
+def _read_member(path: Path, offset: int) -> bytes:
+    decompressor = zlib.decompressobj(wbits=31)
+    chunks = []
+    with path.open("rb") as f:
+        f.seek(offset)
+        while not decompressor.eof:
+            buf = f.read(64 * 1024)
+            if not buf:
+                break
+            chunks.append(decompressor.decompress(buf))
+    return b"".join(chunks)
+
+
+class ArchiveSegments:
+    """Segment files and their index in `segmentdir`."""
+
+    def __init__(self, segmentdir: str | Path, log=_log):
+        self.segmentdir = Path(segmentdir)
+        self.index_path = self.segmentdir / "index.sqlite"
+        self.log = log
+
+    def _connect(self, writable) -> Optional[sqlite3.Connection]:
+        """Connects to the index. A writable index is created or rebuilt
+        from the segment files if it's missing or outdated. Returns None
+        if there's nothing to read.
+        """
+        if not writable:
+            if not self.index_path.exists():
+                return
+            conn = sqlite3.connect(f"file:{self.index_path}?mode=ro", uri=True)
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != INDEX_SCHEMA_VERSION:
+                conn.close()
+                return
+            return conn
+
+        self.segmentdir.mkdir(exist_ok=True)
+        try:
+            conn = sqlite3.connect(self.index_path, isolation_level=None)
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+        except sqlite3.DatabaseError:
+            self.log.warning("archive-index-broken", path=str(self.index_path))
+            self.index_path.unlink(missing_ok=True)
+            conn = sqlite3.connect(self.index_path, isolation_level=None)
+            version = None
+
+        if version != INDEX_SCHEMA_VERSION:
+            conn.execute("DROP TABLE IF EXISTS entries")
+            conn.execute(
+                "CREATE TABLE entries ("
+                "  id TEXT PRIMARY KEY,"
+                "  completed_at REAL NOT NULL,"
+                "  segment TEXT NOT NULL,"
+                "  offset INTEGER NOT NULL"
+                ")"
+            )
+            conn.execute(
+                "CREATE INDEX entries_completed_at ON entries (completed_at)"
+            )
+            conn.execute(f"PRAGMA user_version = {INDEX_SCHEMA_VERSION}")
+            self._rebuild(conn)
+        os.chmod(self.index_path, 0o644)
+        return conn
+
+    def _rebuild(self, conn: sqlite3.Connection):
+        count = 0
+        for segment in sorted(self.segmentdir.glob("archive-*.jsonl.gz")):
+            for offset, content in _iter_members(segment):
+                for line in content.decode().splitlines():
+                    entry = CompactedRequest.from_json(line)
+                    conn.execute(
+                        "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                        (entry.id, entry.completed_at, segment.name, offset),
+                    )
+                    count += 1
+        if count:
+            self.log.info("archive-index-rebuilt", entries=count)
+
+    def append(self, entries: list[CompactedRequest]):
+        """Appends entries to their segments and adds them to the index.
+
+        Segment files are synced before the index is updated. The caller may
+        remove the original request dirs after this method returns.
+        """
+        by_segment: dict[str, list[CompactedRequest]] = {}
+        for entry in entries:
+            by_segment.setdefault(
+                _segment_name(entry.completed_at), []
+            ).append(entry)
+
+        conn = self._connect(writable=True)
+        try:
+            for segment, segment_entries in sorted(by_segment.items()):
+                content = "".join(e.to_json() + "\n" for e in segment_entries)
+                path = self.segmentdir / segment
+                with path.open("ab") as f:
+                    offset = f.tell()
+                    f.write(gzip.compress(content.encode()))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.chmod(path, 0o644)
+                conn.execute("BEGIN")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                    [
+                        (e.id, e.completed_at, segment, offset)
+                        for e in segment_entries
+                    ],
+                )
+                conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def expire(self, cutoff: float) -> list[str]:
+        """Deletes segments which only contain requests completed before
+        `cutoff`. Returns the names of the deleted segments.
+        """
+        if not self.segmentdir.exists():
+            return []
+        conn = self._connect(writable=True)
+        deleted = []
+        try:
+            rows = conn.execute(
+                "SELECT segment FROM entries GROUP BY segment "
+                "HAVING max(completed_at) < ?",
+                (cutoff,),
+            ).fetchall()
+            for (segment,) in rows:
+                conn.execute(
+                    "DELETE FROM entries WHERE segment = ?", (segment,)
+                )
+                (self.segmentdir / segment).unlink(missing_ok=True)
+                deleted.append(segment)
+        finally:
+            conn.close()
+        return deleted
+
+    def find(self, req_id_prefix: str = "") -> list[CompactedRequest]:
+        """Returns compacted requests whose ID starts with `req_id_prefix`."""
+        try:
+            conn = self._connect(writable=False)
+        except sqlite3.Error:
+            self.log.warning("archive-index-read-failed", exc_info=True)
+            return []
+        if conn is None:
+            return []
+
+        try:
+            rows = conn.execute(
+                "SELECT id, segment, offset FROM entries "
+                "WHERE substr(id, 1, ?) = ? ORDER BY completed_at",
+                (len(req_id_prefix), req_id_prefix),
+            ).fetchall()
+        finally:
+            conn.close()
+
+        members: dict[tuple[str, int], dict[str, CompactedRequest]] = {}
+        found = []
+        for req_id, segment, offset in rows:
+            key = (segment, offset)
+            if key not in members:
+                try:
+                    content = _read_member(self.segmentdir / segment, offset)
+                except OSError:
+                    self.log.warning(
+                        "archive-segment-read-failed",
+                        segment=segment,
+                        exc_info=True,
+                    )
+                    content = b""
+                members[key] = {
+                    e.id: e
+                    for e in map(
+                        CompactedRequest.from_json,
+                        content.decode().splitlines(),
+                    )
+                }
+            if entry := members[key].get(req_id):
+                found.append(entry)
+        return found
+
+
+def _read_truncated(path, size) -> bytes:
+    """Reads the beginning and the end of a file that's too large to be
+    stored completely. Cuts at line ends if possible to keep text intact.
+    """
+    keep = MAX_EXTRA_FILE_SIZE // 2
+    with open(path, "rb") as f:
+        head = f.read(keep)
+        f.seek(size - keep)
+        tail = f.read(keep)
+    if (end := head.rfind(b"\n")) >= 0:
+        head = head[: end + 1]
+    if (start := tail.find(b"\n")) >= 0:
+        tail = tail[start + 1 :]
+    skipped = size - len(head) - len(tail)
+    return head + f"[... {skipped} bytes truncated ...]\n".encode() + tail
+
+
+def compacted_request_from_dir(request) -> CompactedRequest:
+    """Creates a segment entry for a loaded archived `request`.
+
+    The completion time is taken from the last attempt or the time the
+    request has been updated. Falls back to the mtime of the request dir.
+
+    Files larger than MAX_EXTRA_FILE_SIZE are stored truncated, entries
+    that are not regular files are only recorded by name.
+    """
+    completed_at = None
+    if request.attempts and request.attempts[-1].finished:
+        completed_at = request.attempts[-1].finished
+    elif request.updated_at:
+        completed_at = request.updated_at
+
+    if completed_at is not None:
+        completed_ts = completed_at.timestamp()
+    else:
+        completed_ts = os.stat(request.dir).st_mtime
+
+    files = {}
+    binary_files = {}
+    truncated_files = {}
+    skipped_files = []
+    for entry in os.scandir(request.dir):
+        if entry.name in ("request.json", "request.yaml"):
+            continue
+        if not entry.is_file(follow_symlinks=False):
+            request.log.warning(
+                "compact-request-file-skipped",
+                _replace_msg=(
+                    "Not keeping {file} of {request} in the archive, it's "
+                    "not a regular file."
+                ),
+                file=entry.name,
+            )
+            skipped_files.append(entry.name)
+            continue
+        size = entry.stat().st_size
+        if size > MAX_EXTRA_FILE_SIZE:
+            request.log.warning(
+                "compact-request-file-truncated",
+                _replace_msg=(
+                    "Keeping only the beginning and end of {file} of "
+                    "{request} in the archive, it has {size} bytes."
+                ),
+                file=entry.name,
+                size=size,
+            )
+            content = _read_truncated(entry.path, size)
+            truncated_files[entry.name] = size
+        else:
+            with open(entry.path, "rb") as f:
+                content = f.read()
+        try:
+            files[entry.name] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            binary_files[entry.name] = base64.b64encode(content).decode()
+
+    return CompactedRequest(
+        id=request.id,
+        completed_at=completed_ts,
+        request=request.to_dict(),
+        files=files,
+        binary_files=binary_files,
+        truncated_files=truncated_files,
+        skipped_files=sorted(skipped_files),
+    )
@@ -1,28 +1,25 @@
+"""fc-maintenance command line interface.
+
+`metrics` and `check` run every minute, so modules which are only needed to
+create requests or talk to the directory are imported by the commands that
+use them. See `fc/util/tests/test_startup.py`.
+"""
+
 import json
 import traceback
 from pathlib import Path
 from typing import NamedTuple, Optional
 
-import fc.util.directory
+import fc.util.logging
 import structlog
 import typer
 from fc.maintenance.activity.reboot import RebootActivity
-from fc.maintenance.lib.shellscript import ShellScriptActivity
-from fc.maintenance.maintenance import (
-    request_reboot_for_cpu,
-    request_reboot_for_kernel,
-    request_reboot_for_kvm_environment,
-    request_reboot_for_memory,
-    request_update,
-)
 from fc.maintenance.reqmanager import DEFAULT_SPOOLDIR, ReqManager
 from fc.maintenance.request import Request
 from fc.maintenance.state import EXIT_POSTPONE, EXIT_TEMPFAIL
-from fc.util import nixos
 from fc.util.constants import DEFAULT_AGENT_CONFIG_FILE
-from fc.util.directory import directory_connection
 from fc.util.enc import load_enc
-from fc.util.lock import locked
+from fc.util.lock import LockTimeout, locked
 from fc.util.logging import (
     drop_cmd_output_logfile,
     init_command_logging,
@@ -40,6 +37,7 @@ class Context(NamedTuple):
     enc_path: Path
     logdir: Path
     lock_dir: Path
+    lock_timeout: Optional[float]
     spooldir: Path
     verbose: bool
     show_caller_info: bool
@@ -81,6 +79,13 @@ def fc_maintenance(
         help="Directory where the lock file for exclusive operations should be "
         "placed.",
     ),
+    lock_timeout: Optional[float] = Option(
+        default=None,
+        help=(
+            "Seconds to wait for the lock for exclusive operations. Exits "
+            f"with EXIT_TEMPFAIL ({EXIT_TEMPFAIL}) when reached."
+        ),
+    ),
     config_file: Path = Option(
         dir_okay=False,
         default=DEFAULT_AGENT_CONFIG_FILE,
@@ -108,13 +113,17 @@ def fc_maintenance(
         enc_path=enc_path,
         logdir=logdir,
         lock_dir=lock_dir,
+        lock_timeout=lock_timeout,
         spooldir=spooldir,
         verbose=verbose,
         show_caller_info=show_caller_info,
     )
 
     init_logging(
-        context.verbose, context.logdir, show_caller_info=show_caller_info
+        context.verbose,
+        context.logdir,
+        show_caller_info=show_caller_info,
+        buffered=True,
     )
 
     rm = ReqManager(
@@ -169,7 +178,8 @@ def run(run_all_now: bool = False, force_run: bool = False):
     After executing all runnable requests, requests that want to be postponed
     are postponed (they get a new execution time) and finished requests
     (successful or failed permanently) moved from the current request to the
-    archive directory.
+    archive directory. Old archived requests are compacted into archive segment
+    files.
     """
     log.info("fc-maintenance-run-start")
     with rm:
@@ -177,6 +187,7 @@ def run(run_all_now: bool = False, force_run: bool = False):
         rm.execute(run_all_now, force_run)
         rm.postpone()
         rm.archive()
+        rm.compact_archive()
     log.info("fc-maintenance-run-finished")
 
 
@@ -207,7 +218,12 @@ def show(
     request_id: Optional[str] = Argument(
         None, help="Full request ID or a prefix to search for."
     ),
-    dump_yaml: bool = False,
+    dump_raw: bool = Option(
+        False,
+        "--dump-raw",
+        "--dump-yaml",
+        help="Show the serialized request as stored on disk.",
+    ),
 ):
     """Show details for a request.
 
@@ -219,7 +235,7 @@ def show(
 
     If no `request_id` is given, the most recently added active request is shown.
     """
-    rm.show_request(request_id, dump_yaml)
+    rm.show_request(request_id, dump_raw)
 
 
 @app.command()
@@ -243,7 +259,11 @@ def check():
 @app.command()
 def metrics():
     """Print metrics in telegraf JSON input format."""
-    jso = json.dumps(rm.get_metrics())
+    from fc.util import nixos
+
+    metrics = rm.get_metrics()
+    metrics.update(nixos.system_build_metrics())
+    jso = json.dumps(metrics)
     print(jso)
 
 
@@ -262,9 +282,24 @@ def request_main():
 
 @request_app.command(name="script")
 @requires_root
-def run_script(comment: str, script: str, estimate: Optional[str] = None):
+def run_script(
+    comment: str,
+    script: str,
+    estimate: Optional[str] = None,
+    parallel_safe: bool = Option(
+        False,
+        help=(
+            "The script doesn't change shared system state and may run at the "
+            "same time as other parallel-safe activities."
+        ),
+    ),
+):
     """[root] Request to run a script."""
-    request = Request(ShellScriptActivity(script), estimate, comment)
+    from fc.maintenance.lib.shellscript import ShellScriptActivity
+
+    request = Request(
+        ShellScriptActivity(script, parallel_safe), estimate, comment
+    )
     with rm:
         rm.add(request)
 
@@ -290,6 +325,13 @@ def system_properties():
     * Virtual: kernel, memory, number of CPUs, qemu version
 
     """
+    from fc.maintenance.maintenance import (
+        request_reboot_for_cpu,
+        request_reboot_for_kernel,
+        request_reboot_for_kvm_environment,
+        request_reboot_for_memory,
+    )
+
     log.info("fc-maintenance-system-properties-start")
     enc = load_enc(log, context.enc_path)
 
@@ -317,6 +359,9 @@ def update():
     with more invocations of the update command or other commands (from
     fc-manage) that potentially modify the system.
     """
+    from fc.maintenance.maintenance import request_update
+    from fc.util import nixos
+
     log.info("fc-maintenance-update-start")
     enc = load_enc(log, context.enc_path)
     init_command_logging(log, context.logdir)
@@ -324,11 +369,18 @@ def update():
     with rm:
         current_requests = rm.requests.values()
 
-    with locked(log, context.lock_dir):
-        try:
+    try:
+        with locked(
+            log,
+            context.lock_dir,
+            timeout=context.lock_timeout,
+            purpose="fc-maintenance request update",
+        ):
             request = request_update(log, enc, rm.config, current_requests)
-        except nixos.ChannelException:
-            raise Exit(2)
+    except nixos.ChannelException:
+        raise Exit(2)
+    except LockTimeout:
+        raise Exit(EXIT_TEMPFAIL)
 
     with rm:
         request = rm.add(request)
@@ -356,28 +408,55 @@ def constraints(
             "Defaults to EXIT_POSTPONE."
         ),
     ),
+    timeout: float = Option(
+        default=60,
+        help=(
+            "Seconds to wait for the directory. Machines that couldn't be "
+            "checked in time count as not in service."
+        ),
+    ),
 ):
     """[root] Check constraints on the state of machines in the same resource
     group.
     """
+    import fc.util.directory
+    from fc.util.directory import directory_connection
+
     log.info("fc-maintenance-constraints")
 
     with directory_connection(context.enc_path) as directory:
-        # Stop action when any required machine is not in-service
-        machines_not_in_service = []
         for machine in in_service:
             log.debug("constraints-check-in-service", machine=machine)
-            if not fc.util.directory.is_node_in_service(directory, machine):
-                machines_not_in_service.append(machine)
 
-        if machines_not_in_service:
-            log.info(
-                "constraints-not-in-service",
+        # Stop action when any required machine is not in-service
+        result = fc.util.directory.check_nodes_in_service(
+            directory, in_service, timeout
+        )
+
+        log.debug(
+            "constraints-directory-metrics",
+            **fc.util.directory.POOL.metrics(),
+        )
+
+        if result.unknown and not result.not_in_service:
+            log.warning(
+                "constraints-timeout",
                 _replace_msg=(
-                    "Required machines not in service: {not_in_service}"
+                    "Could not check machines within {timeout}s: {unknown}"
                 ),
-                not_in_service=machines_not_in_service,
+                timeout=timeout,
+                unknown=result.unknown,
             )
+
+        if result.not_in_service or result.unknown:
+            if result.not_in_service:
+                log.info(
+                    "constraints-not-in-service",
+                    _replace_msg=(
+                        "Required machines not in service: {not_in_service}"
+                    ),
+                    not_in_service=result.not_in_service,
+                )
             log.info(
                 "constraints-failure",
                 _replace_msg="Conditions not met, exiting with code {exit_code}.",
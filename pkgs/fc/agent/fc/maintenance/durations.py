@@ -0,0 +1,149 @@
+"""Learned durations of maintenance activities.
+
+Activities come with fixed estimates which are often much too long for small
+changes. Every successful request execution records the actual duration of
+its attempt. The DurationModel keeps an exponentially weighted moving average
+and mean deviation of these durations per activity kind and derives
+calibrated estimates from them once enough samples have been seen.
+
+The activity kind is the activity type name, refined by
+`Activity.duration_key()`. For example, updates are grouped by the size of
+the unit changes they cause.
+"""
+
+import json
+import os
+import tempfile
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional
+
+import structlog
+
+from .activity import activity_type_name
+from .estimate import Estimate
+from .state import State
+
+_log = structlog.get_logger()
+
+# Bump this when changing the stored fields.
+MODEL_VERSION = 1
+
+# Weight of a new sample for the moving averages.
+ALPHA = 0.3
+
+# Number of samples needed before a learned estimate is used.
+MIN_SAMPLES = 3
+
+# Safety margin on top of the mean duration, in mean deviations.
+DEVIATION_FACTOR = 2
+
+# Learned estimates are never shorter than this, in seconds.
+MIN_LEARNED_ESTIMATE = 60
+
+
+@dataclass
+class DurationStats:
+    samples: int = 0
+    mean: float = 0.0
+    deviation: float = 0.0
+
+    def add(self, duration: float):
+        if not self.samples:
+            self.mean = duration
+        else:
+            self.deviation = (1 - ALPHA) * self.deviation + ALPHA * abs(
+                duration - self.mean
+            )
+            self.mean = (1 - ALPHA) * self.mean + ALPHA * duration
+        self.samples += 1
+
+    @property
+    def estimate(self) -> float:
+        return max(
+            MIN_LEARNED_ESTIMATE,
+            self.mean + DEVIATION_FACTOR * self.deviation,
+        )
+
+
+def duration_key(activity) -> str:
+    key = activity_type_name(type(activity))
+    if sub_key := activity.duration_key():
+        key += ":" + sub_key
+    return key
+
+
+class DurationModel:
+    def __init__(self, path: Path, log=_log):
+        self.path = Path(path)
+        self.log = log
+        self.stats: dict[str, DurationStats] = {}
+        self.changed = False
+
+    @classmethod
+    def load(cls, path: Path, log=_log) -> "DurationModel":
+        """Loads the model. Starts from scratch if the file is missing or
+        cannot be used.
+        """
+        model = cls(path, log)
+        try:
+            with model.path.open() as f:
+                data = json.load(f)
+            if data.get("version") != MODEL_VERSION:
+                return model
+            model.stats = {
+                key: DurationStats(**stats)
+                for key, stats in data["stats"].items()
+            }
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError):
+            log.warning(
+                "duration-model-load-failed", path=str(path), exc_info=True
+            )
+        return model
+
+    def save(self):
+        if not self.changed:
+            return
+        data = {
+            "version": MODEL_VERSION,
+            "stats": {key: asdict(s) for key, s in self.stats.items()},
+        }
+        with tempfile.NamedTemporaryFile(
+            mode="w", dir=self.path.parent, delete=False
+        ) as tf:
+            json.dump(data, tf, indent=2, sort_keys=True)
+            os.chmod(tf.fileno(), 0o644)
+        os.rename(tf.name, self.path)
+        self.changed = False
+
+    def observe(self, request) -> bool:
+        """Learns from the last attempt of a successful request.
+        Returns True if the request has been used.
+        """
+        if request.state != State.success or not request.attempts:
+            return False
+        duration = request.attempts[-1].duration
+        if duration is None:
+            return False
+        key = duration_key(request.activity)
+        self.stats.setdefault(key, DurationStats()).add(float(duration))
+        self.changed = True
+        self.log.debug(
+            "duration-model-observe",
+            request=request.id,
+            key=key,
+            duration=duration,
+            samples=self.stats[key].samples,
+        )
+        return True
+
+    def learned_estimate(self, activity) -> Optional[Estimate]:
+        """Returns the learned estimate for the activity or None if there
+        are not enough samples yet.
+        """
+        stats = self.stats.get(duration_key(activity))
+        if stats is None or stats.samples < MIN_SAMPLES:
+            return
+        return Estimate(stats.estimate)
@@ -0,0 +1,233 @@
+"""Maintenance enter and leave hooks.
+
+Hooks are shell commands from the `[maintenance-enter]` and
+`[maintenance-leave]` sections of the agent config, keyed by subsystem name.
+By default, hooks run one after another in config order. Options for a hook
+can be set in the `[maintenance-hooks]` section, using the subsystem name as
+prefix:
+
+```
+[maintenance-hooks]
+ceph.parallel = true
+slurm-node.parallel = true
+slurm-node.after = other-machines-not-in-maintenance
+slurm-node.timeout = 1800
+```
+
+* `parallel`: the hook may run concurrently with other parallel hooks. A
+  hook that is not parallel waits for all hooks before it and all hooks
+  after it wait for it, like before.
+* `after`: space-separated names of hooks that must be finished before this
+  hook starts. Names of hooks that don't exist are ignored.
+* `timeout`: seconds after which the hook command is killed.
+
+Options apply to the enter and the leave hook of a subsystem.
+"""
+
+import os
+import signal
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from configparser import ConfigParser
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import structlog
+from fc.util.subprocess_helper import communicate_lines
+
+_log = structlog.get_logger()
+
+HOOK_OPTIONS_SECTION = "maintenance-hooks"
+
+# Limits the number of hook commands running at the same time.
+MAX_PARALLEL_HOOKS = 8
+
+
+@dataclass
+class MaintenanceHook:
+    name: str
+    command: str
+    parallel: bool = False
+    after: set[str] = field(default_factory=set)
+    timeout: Optional[float] = None
+
+
+@dataclass
+class HookResult:
+    name: str
+    command: str
+    returncode: int
+    stdout: str
+    timed_out: bool = False
+
+
+def load_hooks(config: ConfigParser, section: str) -> list[MaintenanceHook]:
+    """Reads hooks from `section` of the agent config, in config order.
+    Hooks with empty commands are skipped.
+    """
+    if not config.has_section(section):
+        return []
+
+    options = (
+        config[HOOK_OPTIONS_SECTION]
+        if config.has_section(HOOK_OPTIONS_SECTION)
+        else {}
+    )
+    hooks = []
+    for name, command in config[section].items():
+        if not command.strip():
+            continue
+        timeout = options.get(f"{name}.timeout")
+        hooks.append(
+            MaintenanceHook(
+                name=name,
+                command=command,
+                parallel=options.get(f"{name}.parallel", "false").lower()
+                in ("1", "yes", "true", "on"),
+                after=set(options.get(f"{name}.after", "").split()),
+                timeout=float(timeout) if timeout else None,
+            )
+        )
+    return hooks
+
+
+def _dependencies(hooks: list[MaintenanceHook], log) -> dict[str, set[str]]:
+    """Names of hooks that must be finished before a hook can start."""
+    names = [h.name for h in hooks]
+    deps = {}
+    for pos, hook in enumerate(hooks):
+        unknown = hook.after - set(names)
+        if unknown:
+            log.debug(
+                "maintenance-hook-unknown-dependency",
+                subsystem=hook.name,
+                unknown=sorted(unknown),
+            )
+        hook_deps = hook.after & set(names)
+        for before in hooks[:pos]:
+            if not hook.parallel or not before.parallel:
+                hook_deps.add(before.name)
+        deps[hook.name] = hook_deps
+
+    # Check for cycles by simulating the execution order.
+    finished: set[str] = set()
+    remaining = list(names)
+    while remaining:
+        ready = [n for n in remaining if deps[n] <= finished]
+        if not ready:
+            log.error(
+                "maintenance-hook-dependency-cycle",
+                _replace_msg=(
+                    "Dependencies of maintenance hooks {hooks} form a cycle, "
+                    "running all hooks one after another."
+                ),
+                hooks=remaining,
+            )
+            return {n: set(names[:pos]) for pos, n in enumerate(names)}
+        finished.update(ready)
+        remaining = [n for n in remaining if n not in finished]
+
+    return deps
+
+
+def _run_hook(hook: MaintenanceHook, log, event_prefix: str) -> HookResult:
+    proc = subprocess.Popen(
+        hook.command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        shell=True,
+        text=True,
+        # Own process group so a timeout kills the whole command pipeline.
+        start_new_session=True,
+    )
+    log.info(
+        f"{event_prefix}-cmd",
+        _replace_msg=(
+            "{subsystem}: Maintenance hook command started with PID "
+            "{cmd_pid}: `{command}`"
+        ),
+        command=hook.command,
+        cmd_pid=proc.pid,
+    )
+
+    def kill():
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    result = communicate_lines(
+        proc,
+        log,
+        f"{event_prefix}-out",
+        timeout=hook.timeout or None,
+        kill=kill,
+    )
+
+    if result.timed_out:
+        log.error(
+            f"{event_prefix}-timeout",
+            _replace_msg=(
+                "{subsystem}: Maintenance hook command didn't finish in "
+                "{timeout} seconds and has been killed."
+            ),
+            command=hook.command,
+            timeout=hook.timeout,
+        )
+
+    return HookResult(
+        name=hook.name,
+        command=hook.command,
+        returncode=result.returncode,
+        stdout=result.stdout,
+        timed_out=result.timed_out,
+    )
+
+
+def run_hooks(
+    hooks: list[MaintenanceHook],
+    log=_log,
+    event_prefix="maintenance-hook",
+    stop_on: Callable[[HookResult], bool] = lambda result: False,
+) -> list[HookResult]:
+    """Runs hooks, respecting their ordering constraints.
+
+    Independent parallel hooks run concurrently. When `stop_on` returns True
+    for the result of a hook, no further hooks are started but running hooks
+    are waited for. Results of all hooks that have been run are returned in
+    config order.
+    """
+    if not hooks:
+        return []
+
+    deps = _dependencies(hooks, log)
+    by_name = {h.name: h for h in hooks}
+    pending = [h.name for h in hooks]
+    finished: set[str] = set()
+    results: dict[str, HookResult] = {}
+    running = {}
+    stopped = False
+
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_HOOKS) as executor:
+        while running or (pending and not stopped):
+            ready = [n for n in pending if deps[n] <= finished]
+            for name in [] if stopped else ready:
+                pending.remove(name)
+                hook_log = log.bind(subsystem=name)
+                future = executor.submit(
+                    _run_hook, by_name[name], hook_log, event_prefix
+                )
+                running[future] = name
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+                finished.add(name)
+                if stop_on(results[name]):
+                    stopped = True
+
+    if pending:
+        log.debug(f"{event_prefix}-skipped", subsystems=pending)
+
+    return [results[h.name] for h in hooks if h.name in results]
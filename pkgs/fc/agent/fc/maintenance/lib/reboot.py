@@ -10,7 +10,7 @@ class RebootActivity(fc.maintenance.activity.reboot.RebootActivity):
 
     coldboot: bool
 
-    def load(self):
+    def load(self, request_dir):
         # We only need to determine the reboot type on load. Everything
         # else works like the current RebootActivity.
         self.reboot_needed = (
@@ -16,24 +16,34 @@ from ..activity import Activity
 
 
 class ShellScriptActivity(Activity):
-    def __init__(self, script):
+    def __init__(self, script, parallel_safe=False):
         super().__init__()
         self.script = script
+        # Only the creator of the request knows if the script can run at the
+        # same time as other activities.
+        self.parallel_safe = parallel_safe
 
     def run(self):
-        # assumes that we are in the request scratch directory
-        with open("script", "w") as f:
+        # Don't depend on the working directory if the activity belongs to a
+        # request, the activity may be parallel-safe. The script still runs
+        # in the request directory.
+        if self.request is not None and self.request.dir:
+            workdir = os.path.abspath(self.request.dir)
+        else:
+            workdir = os.getcwd()
+        script = os.path.join(workdir, "script")
+        with open(script, "w") as f:
             if not self.script.startswith("#!"):
                 f.write("#!/bin/sh\n")
             f.write(self.script)
             os.fchmod(f.fileno(), 0o755)
 
-        script = os.path.join(os.getcwd(), "script")
         p = subprocess.Popen(
             [script],
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
+            cwd=workdir,
         )
         (self.stdout, self.stderr) = [s.decode() for s in p.communicate()]
         self.returncode = p.returncode
@@ -328,6 +328,7 @@ def request_update(
             ),
         )
         activity.update_system_channel()
+        activity.release()
         return
 
     if not activity.identical_to_current_system:
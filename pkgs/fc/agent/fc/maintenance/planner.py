@@ -0,0 +1,80 @@
+"""Execution plan for runnable maintenance requests.
+
+Requests are executed in phases. Consecutive requests whose activities are
+`parallel_safe` form a parallel phase and are executed at the same time.
+All other requests get a phase of their own and run alone, in the original
+order of the requests. Reboots are never done by activities themselves: the
+reboot types requested by successful activities are collected and a single
+reboot decision is made after all phases.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, NamedTuple, Optional
+
+from .activity import RebootType
+from .request import Request
+from .state import State
+
+# Limits the number of requests executed at the same time.
+MAX_PARALLEL_REQUESTS = 4
+
+
+class Phase(NamedTuple):
+    requests: list[Request]
+    parallel: bool
+
+
+def plan_phases(requests: Iterable[Request]) -> list[Phase]:
+    """Groups requests into phases, keeping their order."""
+    phases: list[Phase] = []
+    for req in requests:
+        if req.activity.parallel_safe:
+            if phases and phases[-1].parallel:
+                phases[-1].requests.append(req)
+            else:
+                phases.append(Phase([req], parallel=True))
+        else:
+            phases.append(Phase([req], parallel=False))
+
+    # A parallel phase with a single request is just a serial phase.
+    return [
+        Phase(phase.requests, phase.parallel and len(phase.requests) > 1)
+        for phase in phases
+    ]
+
+
+def execute_phases(phases: list[Phase], log):
+    for num, phase in enumerate(phases, 1):
+        log.debug(
+            "execute-phase",
+            phase=num,
+            phases=len(phases),
+            parallel=phase.parallel,
+            requests=[req.id for req in phase.requests],
+        )
+        if not phase.parallel:
+            for req in phase.requests:
+                req.execute()
+            continue
+
+        with ThreadPoolExecutor(
+            max_workers=min(MAX_PARALLEL_REQUESTS, len(phase.requests))
+        ) as executor:
+            # Request.execute handles exceptions from activities itself.
+            list(executor.map(Request.execute, phase.requests))
+
+
+def reboot_decision(requests: Iterable[Request]) -> Optional[RebootType]:
+    """Returns the single reboot needed by all successful requests.
+
+    A cold boot also satisfies requests for a warm reboot.
+    """
+    requested = {
+        req.activity.reboot_needed
+        for req in requests
+        if req.state == State.success
+    }
+    if RebootType.COLD in requested:
+        return RebootType.COLD
+    if RebootType.WARM in requested:
+        return RebootType.WARM
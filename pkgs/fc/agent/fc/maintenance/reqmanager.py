@@ -6,34 +6,51 @@ import glob
 import json
 import os
 import os.path as p
+import shutil
 import socket
 import subprocess
 import sys
+import threading
 import time
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import NamedTuple
 
-import fc.maintenance.state
-import fc.util.directory
 import rich
-import rich.syntax
 import structlog
 from fc.maintenance.activity import RebootType
 from fc.util.checks import CheckResult
-from fc.util.subprocess_helper import get_popen_stdout_lines
+from fc.util.logging import flush_buffered_logs
 from fc.util.time_date import format_datetime, utcnow
 from rich.table import Table
 
 from . import state
+from .archive import (
+    ArchiveSegments,
+    CompactionResult,
+    compacted_request_from_dir,
+)
+from .durations import DurationModel
+from .hooks import load_hooks, run_hooks
+from .planner import execute_phases, plan_phases, reboot_decision
 from .request import Request, RequestMergeResult
+from .spool import Signature, SpoolIndex
 from .state import ARCHIVE, EXIT_POSTPONE, EXIT_TEMPFAIL, State
+from .telemetry import RequestStats
 
 DEFAULT_SPOOLDIR = "/var/spool/maintenance"
 
 _log = structlog.get_logger()
 
 
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 def require_lock(func):
     """Decorator that asserts an open lockfile prior execution."""
 
@@ -53,6 +70,9 @@ def require_directory(func):
             if self.enc_path:
                 with open(self.enc_path) as f:
                     enc_data = json.load(f)
+            # Imported here, most commands don't talk to the directory.
+            import fc.util.directory
+
             self.directory = fc.util.directory.connect(enc_data)
         return func(self, *args, **kwargs)
 
@@ -94,8 +114,8 @@ class ReqManager:
     requests. To use them, requests must be loaded and the global request
     manager lock must be held.
 
-    These methods are typically used like this to handle locking and request
-    loading:
+    These methods are typically used like this to handle locking, request
+    loading and saving of changed requests:
     ```
     rm = ReqManager()
     with rm:
@@ -112,6 +132,7 @@ class ReqManager:
     * execute
     * postpone
     * archive
+    * compact_archive
 
     For non-invasive tasks, ReqManager methods can be used immediately. These
     include:
@@ -126,6 +147,12 @@ class ReqManager:
 
     directory = None
     lockfile = None
+    index: SpoolIndex | None = None
+    _snapshot_stale = False
+    # Request states as recorded in the last metrics snapshot.
+    _snapshot_states: dict[str, State] = {}
+    _committing = False
+    _durations: DurationModel | None = None
     _requests: dict[str, Request] | None
     min_estimate_seconds: int = 900
 
@@ -146,7 +173,13 @@ class ReqManager:
         self.spooldir = Path(spooldir)
         self.requestsdir = self.spooldir / "requests"
         self.archivedir = self.spooldir / "archive"
+        self.archive_segments = ArchiveSegments(
+            self.spooldir / "archive-segments", log=log
+        )
         self.last_run_stats_path = self.spooldir / "last_run.json"
+        self.metrics_snapshot_path = self.spooldir / "metrics_snapshot.json"
+        self._saved_lock = threading.Lock()
+        self.duration_model_path = self.spooldir / "durations.json"
         self.maintenance_marker_path = self.spooldir / "in_maintenance"
         self.enc_path = Path(enc_path)
         self.config_file = Path(config_file)
@@ -166,6 +199,19 @@ class ReqManager:
         self.maintenance_preparation_seconds = int(
             self.config.get("maintenance", "preparation_seconds", fallback=300)
         )
+        self.reboot_seconds = int(
+            self.config.get("maintenance", "reboot_seconds", fallback=300)
+        )
+        self.archive_compact_after_days = int(
+            self.config.get(
+                "maintenance", "archive_compact_after_days", fallback=7
+            )
+        )
+        self.archive_retention_days = int(
+            self.config.get(
+                "maintenance", "archive_retention_days", fallback=180
+            )
+        )
 
     def __enter__(self):
         """
@@ -191,10 +237,18 @@ class ReqManager:
         self.lockfile.seek(0)
         print(os.getpid(), file=self.lockfile)
         self.lockfile.flush()
+        self.index = SpoolIndex.open(
+            self.spooldir, writable=True, log=self.log
+        )
         self.scan()
         return self
 
     def __exit__(self, exc_type, exc_value, exc_tb):
+        if self.lockfile and self._requests is not None:
+            self.commit()
+        if self.index:
+            self.index.close()
+            self.index = None
         if self.lockfile:
             self.lockfile.truncate(0)
             self.lockfile.close()
@@ -261,12 +315,18 @@ class ReqManager:
 
     @require_lock
     def scan(self):
+        """Loads all active requests.
+
+        Requests are restored from the spool index if their request files
+        have not changed since the last scan.
+        """
         self._requests = {}
-        for d in glob.glob(p.join(self.requestsdir, "*")):
-            if not p.isdir(d):
-                continue
+        request_dirs = [
+            d for d in glob.glob(p.join(self.requestsdir, "*")) if p.isdir(d)
+        ]
+        for d in request_dirs:
             try:
-                req = Request.load(d, self.config, self.log)
+                req = Request.load(d, self.config, self.log, self.index)
                 req._reqmanager = self
                 self.requests[req.id] = req
             except Exception as exc:
@@ -283,6 +343,135 @@ class ReqManager:
                 )
                 os.rename(d, p.join(self.archivedir, p.basename(d)))
 
+        if self._load_metrics_snapshot() is None:
+            self._save_metrics_snapshot()
+
+        if self.index:
+            self.index.prune("requests", request_dirs)
+            self.log.debug(
+                "scan-finished",
+                request_count=len(self._requests),
+                index_hits=self.index.hits,
+                index_misses=self.index.misses,
+            )
+
+    @require_lock
+    def commit(self):
+        """Saves all requests whose state has changed.
+
+        Invasive methods change requests in memory and leave saving them to
+        this method which is called when leaving the ReqManager context.
+        Synced temporary request files are written for all changed requests
+        first. Only then, the request files are replaced so each request file
+        is either the old or the new version after a crash. The request
+        directories are synced after that to make the renames durable.
+        """
+        changed = []
+        for req in self.requests.values():
+            if not req.dirty:
+                continue
+            try:
+                changed.append((req, req.prepare_save(sync=True)))
+            except Exception:
+                self.log.error(
+                    "commit-request-failed",
+                    _replace_msg="Saving request {request} failed.",
+                    request=req.id,
+                    exc_info=True,
+                )
+
+        if not changed:
+            self.log.debug("commit-no-changes")
+            self._update_metrics_snapshot()
+            return
+
+        # The metrics snapshot is written once for all requests below.
+        self._committing = True
+        try:
+            for req, pending in changed:
+                try:
+                    req.finish_save(pending)
+                except Exception:
+                    self.log.error(
+                        "commit-request-failed",
+                        _replace_msg="Saving request {request} failed.",
+                        request=req.id,
+                        exc_info=True,
+                    )
+        finally:
+            self._committing = False
+
+        # New request directories also need their parent synced.
+        dirs = {req.dir for req, _ in changed}
+        dirs |= {p.dirname(d) for d in dirs}
+        for d in sorted(dirs):
+            try:
+                _fsync_dir(d)
+            except OSError:
+                self.log.warning(
+                    "commit-sync-dir-failed", dir=str(d), exc_info=True
+                )
+
+        self._update_metrics_snapshot()
+
+        self.log.debug(
+            "commit-finished",
+            saved=len(changed),
+            requests=[req.id for req, _ in changed],
+        )
+
+    def request_saved(self, request: Request, serialized: str):
+        """Called by requests of this ReqManager after they have been saved.
+
+        Updates the spool index. The metrics snapshot is written right away
+        if the state of the request changed, for example when it starts
+        running, so metrics are current while maintenance is running. Other
+        changes are written to the snapshot by the next commit.
+        """
+        # Requests may be executed in parallel threads.
+        with self._saved_lock:
+            if self.index is not None:
+                signature = Signature.from_stat(os.stat(request.filename))
+                self.index.put(request.dir, signature, serialized)
+            self._snapshot_stale = True
+            state_changed = (
+                self._snapshot_states.get(request.id) != request.state
+            )
+            if state_changed and not self._committing:
+                self._save_metrics_snapshot()
+
+    def _update_metrics_snapshot(self):
+        if self._snapshot_stale:
+            self._save_metrics_snapshot()
+
+    def _save_metrics_snapshot(self):
+        """Stores statistics of the active requests for get_metrics."""
+        if self._requests is None:
+            return
+        self._snapshot_stale = False
+        active = [
+            r
+            for r in self._requests.values()
+            if p.dirname(p.realpath(r.dir)) == p.realpath(self.requestsdir)
+        ]
+        self._snapshot_states = {r.id: r.state for r in active}
+        stats = RequestStats.from_requests(active)
+        stats.requests_dir_mtime_ns = self.requestsdir.stat().st_mtime_ns
+        try:
+            stats.save(self.metrics_snapshot_path)
+        except OSError:
+            self.log.warning("metrics-snapshot-save-failed", exc_info=True)
+
+    def _load_metrics_snapshot(self) -> RequestStats | None:
+        if self._snapshot_stale:
+            # Requests of this ReqManager have been saved since.
+            return
+        try:
+            mtime_ns = self.requestsdir.stat().st_mtime_ns
+        except OSError:
+            return
+        return RequestStats.load(self.metrics_snapshot_path, mtime_ns)
+
     def _add_request(self, request: Request):
         self.requests[request.id] = request
         request.dir = self._request_directory(request)
@@ -360,6 +549,8 @@ class ReqManager:
                     merged=existing_request.id,
                 )
                 self.delete(existing_request.id)
+                # Neither the new nor the existing request will run.
+                self._release_activity(request)
 
             case RequestMergeResult.NO_MERGE:
                 self.log.debug(
@@ -410,16 +601,63 @@ class ReqManager:
                 ),
                 request=request.id,
             )
+            self._release_activity(request)
             return
 
         return self._add_request(request)
 
+    @property
+    def durations(self) -> DurationModel:
+        if self._durations is None:
+            self._durations = DurationModel.load(
+                self.duration_model_path, self.log
+            )
+        return self._durations
+
     def _estimated_request_duration(self, request) -> int:
+        """Estimated time in maintenance for the request, in seconds.
+
+        Uses the duration learned from previous executions of similar
+        activities if the request has no explicit estimate. Learned
+        durations don't include the reboot which happens after executing
+        all requests, so the expected reboot time is added for activities
+        that need a reboot.
+        """
+        estimate = int(request.estimate)
+        if request._estimate is None:
+            learned = self.durations.learned_estimate(request.activity)
+            if learned is not None:
+                estimate = int(learned)
+                if request.activity.reboot_needed:
+                    estimate += self.reboot_seconds
+
         return max(
             self.min_estimate_seconds,
-            int(request.estimate) + self.maintenance_preparation_seconds,
+            estimate + self.maintenance_preparation_seconds,
         )
 
+    def _learn_durations(self, requests):
+        for req in requests:
+            self.durations.observe(req)
+        try:
+            self.durations.save()
+        except OSError:
+            self.log.warning("duration-model-save-failed", exc_info=True)
+
+    def _release_activity(self, request: Request):
+        try:
+            request.activity.release()
+        except Exception:
+            self.log.warning(
+                "request-release-failed",
+                _replace_msg=(
+                    "Releasing resources of {request} failed. See exception "
+                    "for details."
+                ),
+                request=request.id,
+                exc_info=True,
+            )
+
     @require_lock
     def delete(self, reqid):
         """
@@ -440,7 +678,6 @@ class ReqManager:
             )
             return
         req.state = State.deleted
-        req.save()
         self.log.info(
             "delete-finished",
             _replace_msg="Marked request {request} as deleted.",
@@ -490,7 +727,6 @@ class ReqManager:
                         at=val["time"],
                     )
                     req.last_scheduled_at = utcnow()
-                    req.save()
             except KeyError:
                 self.log.warning(
                     "schedule-request-disappeared",
@@ -524,7 +760,6 @@ class ReqManager:
         self.log.debug("update-states-start", request_count=len(requests))
         for request in sorted(requests):
             request.update_state(due_dt)
-            request.save()
             if request.state == State.due and request.next_due:
                 delta = timedelta(
                     seconds=self._estimated_request_duration(request) + 60
@@ -558,40 +793,29 @@ class ReqManager:
             self.maintenance_marker_path.write_text(utcnow().isoformat())
         postpone_seen = False
         tempfail_seen = False
-        for name, command in self.config["maintenance-enter"].items():
-            if not command.strip():
-                continue
-
-            log = self.log.bind(
-                subsystem=name,
-            )
-
-            proc = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                shell=True,
-                text=True,
-            )
-            log.info(
-                "enter-maintenance-cmd",
-                _replace_msg=(
-                    "{subsystem}: Maintenance enter command started with PID "
-                    "{cmd_pid}: `{command}`"
-                ),
-                command=command,
-                cmd_pid=proc.pid,
-            )
-
-            stdout_lines = get_popen_stdout_lines(
-                proc, log, "enter-maintenance-out"
-            )
-            stdout = "".join(stdout_lines)
-            proc.wait()
+        failed = []
+        hooks = load_hooks(self.config, "maintenance-enter")
+        # Don't start other hooks after a hook failed hard. The caller
+        # leaves maintenance mode in that case.
+        results = run_hooks(
+            hooks,
+            self.log,
+            "enter-maintenance",
+            stop_on=lambda r: not r.timed_out
+            and r.returncode
+            not in (0, state.EXIT_POSTPONE, state.EXIT_TEMPFAIL),
+        )
+        for result in results:
+            log = self.log.bind(subsystem=result.name)
+            command = result.command
+            stdout = result.stdout
 
-            match proc.returncode:
+            match result.returncode:
                 case 0:
                     log.debug("enter-maintenance-cmd-success")
+                case _ if result.timed_out:
+                    log.debug("enter-maintenance-timeout-out", stdout=stdout)
+                    tempfail_seen = True
                 case state.EXIT_POSTPONE:
                     log.info(
                         "enter-maintenance-postpone",
@@ -620,7 +844,12 @@ class ReqManager:
                         command=command,
                         exit_code=error,
                     )
-                    raise subprocess.CalledProcessError(error, command, stdout)
+                    failed.append(result)
+
+        if failed:
+            raise subprocess.CalledProcessError(
+                failed[0].returncode, failed[0].command, failed[0].stdout
+            )
 
         if postpone_seen:
             raise PostponeMaintenance()
@@ -635,13 +864,25 @@ class ReqManager:
         It's ok to call this method even when the machine is already in service.
         """
         self.log.debug("leave-maintenance")
-        for name, command in self.config["maintenance-leave"].items():
-            if not command.strip():
-                continue
-            self.log.info(
-                "leave-maintenance-subsystem", subsystem=name, command=command
-            )
-            subprocess.run(command, shell=True, check=True)
+        hooks = load_hooks(self.config, "maintenance-leave")
+        results = run_hooks(
+            hooks,
+            self.log,
+            "leave-maintenance",
+            stop_on=lambda r: r.returncode != 0,
+        )
+        for result in results:
+            if result.returncode != 0:
+                self.log.error(
+                    "leave-maintenance-fail",
+                    subsystem=result.name,
+                    command=result.command,
+                    exit_code=result.returncode,
+                    stdout=result.stdout,
+                )
+                raise subprocess.CalledProcessError(
+                    result.returncode, result.command, result.stdout
+                )
         self.log.debug("mark-node-in-service")
         self.directory.mark_node_service_status(socket.gethostname(), True)
         if self.maintenance_marker_path.exists():
@@ -829,6 +1070,11 @@ class ReqManager:
             json.dump(stats, wf, indent=4)
 
     def _reboot_and_exit(self, requested_reboots):
+        if requested_reboots:
+            # Leaving the ReqManager context would be too late, the reboot
+            # may have stopped this process by then.
+            self.commit()
+
         if RebootType.COLD in requested_reboots:
             self.log.info(
                 "maintenance-poweroff",
@@ -838,6 +1084,7 @@ class ReqManager:
                 ),
             )
             time.sleep(5)
+            flush_buffered_logs()
             subprocess.run(
                 "poweroff", check=True, capture_output=True, text=True
             )
@@ -852,6 +1099,7 @@ class ReqManager:
                 ),
             )
             time.sleep(5)
+            flush_buffered_logs()
             subprocess.run(
                 "reboot", check=True, capture_output=True, text=True
             )
@@ -864,7 +1112,9 @@ class ReqManager:
         Enters maintenance mode, executes requests and reboots if activities request it.
 
         In normal operation, due requests are run in the order of their scheduled start
-        time.
+        time. Consecutive requests with parallel-safe activities run at the same
+        time, see `fc.maintenance.planner`. At most one reboot is done after all
+        requests have been executed.
 
         After entering maintenance mode, but before executing requests,
         maintenance enter commands defined in the agent config file are executed.
@@ -926,19 +1176,18 @@ class ReqManager:
                 return
 
         # We are now in maintenance mode, start the action.
-        requested_reboots = set()
+        phases = plan_phases(runnable_requests)
         exec_dt = utcnow()
-        for req in runnable_requests:
-            req.execute()
-            if req.state == State.success:
-                requested_reboots.add(req.activity.reboot_needed)
+        execute_phases(phases, self.log)
+        self._learn_durations(runnable_requests)
+        reboot = reboot_decision(runnable_requests)
 
         self._write_stats_for_execute(
-            prepare_dt, exec_dt, runnable_requests, bool(requested_reboots)
+            prepare_dt, exec_dt, runnable_requests, reboot is not None
         )
 
-        # Execute any reboots while still in maintenance mode.
-        self._reboot_and_exit(requested_reboots)
+        # Execute the reboot while still in maintenance mode.
+        self._reboot_and_exit({reboot})
 
         # When we are still here, no reboot happened. We can leave maintenance now.
         self.log.debug("no-reboot-requested")
@@ -970,7 +1219,6 @@ class ReqManager:
             # Resetting the due datetime also sets the state to pending.
             # Request will be rescheduled on the next run.
             req.update_due(None)
-            req.save()
 
     @require_lock
     @require_directory
@@ -1003,45 +1251,134 @@ class ReqManager:
             os.rename(req.dir, dest)
             req.dir = dest
             req.save()
+            self._release_activity(req)
 
-    def _active_requests(self, req_id_prefix: str = "") -> list[Request]:
+        self._requests = {
+            key: req
+            for key, req in self.requests.items()
+            if req not in archived
+        }
+        self._snapshot_stale = True
+
+    @require_lock
+    def compact_archive(self) -> CompactionResult:
+        """Rolls old archived requests into segment files and deletes
+        segments which are older than the retention period.
+
+        Request dirs are compacted when they haven't been changed for
+        `archive_compact_after_days`. Requests that cannot be loaded stay
+        in the archive dir.
         """
-        Loads active requests. Optionally, a request ID prefix can be passed
-        for filtering.
+        self.log.debug("compact-archive-start")
+        now = time.time()
+        compact_before = now - self.archive_compact_after_days * 86400
+        entries = []
+        compacted_dirs = []
+        remaining_dirs = []
+
+        for d in sorted(self.archivedir.iterdir()):
+            if not d.is_dir() or d.stat().st_mtime >= compact_before:
+                remaining_dirs.append(d)
+                continue
+            try:
+                req = Request.load(d, self.config, self.log, self.index)
+                entries.append(compacted_request_from_dir(req))
+                compacted_dirs.append(d)
+            except Exception:
+                self.log.warning(
+                    "compact-archive-load-failed",
+                    _replace_msg=(
+                        "Cannot compact archived request {request}, keeping "
+                        "its directory."
+                    ),
+                    request=d.name,
+                    exc_info=True,
+                )
+                remaining_dirs.append(d)
+
+        if entries:
+            self.archive_segments.append(entries)
+            for d in compacted_dirs:
+                shutil.rmtree(d)
+            self.log.info(
+                "compact-archive-compacted",
+                _replace_msg="Compacted {count} archived request(s).",
+                count=len(entries),
+            )
+
+        if self.index:
+            self.index.prune("archive", remaining_dirs)
+
+        deleted_segments = self.archive_segments.expire(
+            now - self.archive_retention_days * 86400
+        )
+        for segment in deleted_segments:
+            self.log.info(
+                "compact-archive-expired",
+                _replace_msg="Deleted expired archive segment {segment}.",
+                segment=segment,
+            )
+
+        return CompactionResult([e.id for e in entries], deleted_segments)
+
+    def _load_requests(self, dirs) -> list[Request]:
         """
-        name_matches = self.requestsdir.glob(req_id_prefix + "*")
-        if name_matches:
+        Loads requests from the given directories, sorted by the time they
+        have been added. Uses the spool index if possible. Non-invasive
+        methods use it read-only.
+        """
+        index = self.index
+        if index is None:
+            index = SpoolIndex.open(self.spooldir, log=self.log)
+        try:
             return sorted(
                 [
-                    Request.load(name, self.config, self.log)
-                    for name in name_matches
+                    Request.load(name, self.config, self.log, index)
+                    for name in dirs
                 ],
                 key=lambda r: r.added_at
                 or datetime.fromtimestamp(0, tz=timezone.utc),
             )
-        return []
+        finally:
+            if index is not None and index is not self.index:
+                index.close()
+
+    def _active_requests(self, req_id_prefix: str = "") -> list[Request]:
+        """
+        Loads active requests. Optionally, a request ID prefix can be passed
+        for filtering.
+        """
+        return self._load_requests(self.requestsdir.glob(req_id_prefix + "*"))
 
     def _archived_requests(self, req_id_prefix: str = "") -> list[Request]:
         """
         Loads archived requests by an request ID prefix. Optionally, a request
         ID prefix can be passed for filtering.
+
+        Includes compacted requests from the archive segments.
         """
-        name_matches = self.archivedir.glob(req_id_prefix + "*")
-        if name_matches:
-            return sorted(
-                [
-                    Request.load(name, self.config, self.log)
-                    for name in name_matches
-                ],
-                key=lambda r: r.added_at
-                or datetime.fromtimestamp(0, tz=timezone.utc),
-            )
-        return []
+        requests = self._load_requests(
+            self.archivedir.glob(req_id_prefix + "*")
+        )
+        seen = {req.id for req in requests}
+        for entry in self.archive_segments.find(req_id_prefix):
+            if entry.id in seen:
+                continue
+            req = Request.from_compacted(entry, self.config, self.log)
+            req.dir = p.join(self.archivedir, entry.id)
+            requests.append(req)
+        return sorted(
+            requests,
+            key=lambda r: r.added_at
+            or datetime.fromtimestamp(0, tz=timezone.utc),
+        )
 
     def list_requests(self):
         rich.print(self)
 
-    def show_request(self, request_id=None, dump_yaml=False):
+    def show_request(self, request_id=None, dump_raw=False):
+        import rich.syntax
+
         request_id_prefix = "" if request_id is None else request_id
         active_requests = self._active_requests(request_id_prefix)
 
@@ -1102,10 +1439,20 @@ class ReqManager:
 
         req = requests[-1]
 
-        if dump_yaml:
-            rich.print("\n[bold]Raw YAML serialization:[/bold]")
-            yaml = Path(req.filename).read_text()
-            rich.print(rich.syntax.Syntax(yaml, "yaml"))
+        if dump_raw:
+            rich.print("\n[bold]Raw serialization:[/bold]")
+            if p.exists(req.filename):
+                serialized = Path(req.filename).read_text()
+                rich.print(rich.syntax.Syntax(serialized, "json"))
+            elif req.compacted:
+                serialized = json.dumps(
+                    req.to_dict(), indent=2, sort_keys=True
+                )
+                rich.print(rich.syntax.Syntax(serialized, "json"))
+            else:
+                # Archived request saved by an older agent version.
+                legacy_yaml = Path(req.dir, "request.yaml").read_text()
+                rich.print(rich.syntax.Syntax(legacy_yaml, "yaml"))
         else:
             rich.print(req)
 
@@ -1223,110 +1570,26 @@ class ReqManager:
         return CheckResult(errors, warnings, ok_info)
 
     def get_metrics(self) -> dict:
-        requests = self._active_requests()
-        runnable = [
-            r for r in requests if r.state in (State.due, State.running)
-        ]
+        """
+        Returns metrics for active requests and the last maintenance run.
+
+        Request metrics are calculated from the metrics snapshot which is
+        kept up-to-date by invasive methods. Requests are only loaded if the
+        snapshot is missing or outdated.
+        """
+        stats = self._load_metrics_snapshot()
+        if stats is None:
+            self.log.debug("metrics-snapshot-missing")
+            stats = RequestStats.from_requests(self._active_requests())
+
+        now = utcnow()
 
         metrics = {
             "name": "fc_maintenance",
-            "requests_total": len(requests),
-            "requests_runnable": len(runnable),
-            # Initialize request stats. They will be overwritten if requests exist.
             "in_maintenance_duration": 0,
-            "requests_tempfail": 0,
-            "requests_postpone": 0,
-            "requests_success": 0,
-            "requests_error": 0,
-            "requests_pending": 0,
-            "requests_scheduled": 0,
-            "requests_running": 0,
-            "requests_waiting_for_schedule": 0,
-            "request_longest_in_queue_duration": 0,
-            "request_running_for_seconds": 0,
-            "request_highest_retry_count": 0,
-            "request_next_due_at": 0,
+            **stats.to_metrics(now),
         }
 
-        now = utcnow()
-
-        if requests:
-            requests_tempfail = []
-            requests_error = []
-            requests_postponed = []
-            requests_success = []
-            num_requests_pending = 0
-            num_requests_running = 0
-            num_requests_waiting_for_schedule = 0
-            num_requests_scheduled = 0
-
-            most_retries = 0
-            oldest_added_at = requests[0].added_at
-            oldest_next_due = None
-            longest_running_seconds = 0
-
-            for req in requests:
-                most_retries = max(len(req.attempts), most_retries)
-                oldest_added_at = min(oldest_added_at, req.added_at)
-
-                match req.state:
-                    case State.pending:
-                        num_requests_pending += 1
-                    case State.running:
-                        # There should only be one but it's technically
-                        # possible to have more than one in state 'running'.
-                        num_requests_running += 1
-                        if req.attempts:
-                            longest_running_seconds = max(
-                                longest_running_seconds,
-                                (now - req.attempts[-1].started).seconds,
-                            )
-
-                if req.next_due:
-                    num_requests_scheduled += 1
-                    # Date can be in the past for requests that have already been tried,
-                    # but that's ok.
-                    oldest_next_due = (
-                        min(req.next_due, oldest_next_due)
-                        if oldest_next_due
-                        else req.next_due
-                    )
-                else:
-                    num_requests_waiting_for_schedule += 1
-
-                if req.attempts:
-                    match req.attempts[-1].returncode:
-                        case None:
-                            pass
-                        case fc.maintenance.state.EXIT_TEMPFAIL:
-                            requests_tempfail.append(req)
-                        case fc.maintenance.state.EXIT_POSTPONE:
-                            requests_postponed.append(req)
-                        case 0:
-                            requests_success.append(req)
-                        case _error:
-                            requests_error.append(req)
-
-            metrics["requests_tempfail"] = len(requests_tempfail)
-            metrics["requests_postpone"] = len(requests_postponed)
-            metrics["requests_success"] = len(requests_success)
-            metrics["requests_error"] = len(requests_error)
-            metrics["requests_pending"] = num_requests_pending
-            metrics["requests_running"] = num_requests_running
-            metrics["requests_scheduled"] = num_requests_scheduled
-            metrics[
-                "requests_waiting_for_schedule"
-            ] = num_requests_waiting_for_schedule
-
-            metrics["request_longest_in_queue_duration"] = (
-                now.timestamp() - oldest_added_at.timestamp()
-            )
-            metrics["request_highest_retry_count"] = most_retries
-            metrics["request_running_for_seconds"] = longest_running_seconds
-
-            if oldest_next_due:
-                metrics["request_next_due_at"] = oldest_next_due.timestamp()
-
         # We expect the last run stats file to be present at all times except on
         # new machines that haven't run execute() yet.
         if self.last_run_stats_path.exists():
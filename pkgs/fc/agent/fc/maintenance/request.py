@@ -1,24 +1,25 @@
 import contextlib
-import copy
 import datetime
+import hashlib
+import json
 import os
 import os.path as p
 import tempfile
 from configparser import ConfigParser
 from enum import Enum
 from pathlib import Path
-from typing import Optional
+from typing import NamedTuple, Optional
 
 import iso8601
 import rich.table
 import shortuuid
 import structlog
-import yaml
-from fc.maintenance import state
+from fc.maintenance import serialization, state
 from fc.util.time_date import ensure_timezone_present, format_datetime, utcnow
 
 from .activity import Activity, ActivityMergeResult
 from .estimate import Estimate
+from .spool import read_signature
 from .state import State, evaluate_state
 
 _log = structlog.get_logger()
@@ -34,6 +35,28 @@ def cd(newdir):
         os.chdir(oldcwd)
 
 
+def _format_iso(dt: datetime.datetime | None) -> str | None:
+    return dt.isoformat() if dt else None
+
+
+def _parse_iso(value: str | None) -> datetime.datetime | None:
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+def _import_activity_types():
+    """Activities must be registered before they can be deserialized."""
+    import fc.maintenance.activity.reboot
+    import fc.maintenance.activity.update
+    import fc.maintenance.activity.vm_change
+    import fc.maintenance.lib.reboot
+    import fc.maintenance.lib.shellscript
+
+
+class PendingSave(NamedTuple):
+    tempfile_name: str
+    serialized: str
+
+
 class RequestMergeResult(Enum):
     NO_MERGE = 0
     REMOVE = 1
@@ -53,6 +76,30 @@ class Attempt:
     def __init__(self):
         self.started = utcnow()
 
+    def to_dict(self) -> dict:
+        duration = self.duration
+        if isinstance(duration, datetime.timedelta):
+            duration = duration.total_seconds()
+        return {
+            "started": _format_iso(self.started),
+            "finished": _format_iso(self.finished),
+            "duration": duration,
+            "returncode": self.returncode,
+            "stdout": self.stdout,
+            "stderr": self.stderr,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Attempt":
+        attempt = cls.__new__(cls)
+        attempt.started = _parse_iso(data["started"])
+        attempt.finished = _parse_iso(data["finished"])
+        attempt.duration = data["duration"]
+        attempt.returncode = data["returncode"]
+        attempt.stdout = data["stdout"]
+        attempt.stderr = data["stderr"]
+        return attempt
+
     def record(self, activity):
         """Logs activity outcomes so they may be overwritten later."""
         self.finished = utcnow()
@@ -90,10 +137,13 @@ class Attempt:
 
 class Request:
     MAX_RETRIES = 48
+    # Set for archived requests loaded from an archive segment.
+    compacted = False
 
     _comment: str | None
     _estimate: Estimate | None
     _reqid: str | None
+    _saved_digest: bytes | None
     attempts: list[Attempt]
     activity: Activity
     added_at: datetime.datetime | None
@@ -120,6 +170,7 @@ class Request:
         self.next_due = None
         self.state = State.pending
         self.updated_at = None
+        self._saved_digest = None
 
     @property
     def comment(self):
@@ -198,8 +249,8 @@ class Request:
 
     @property
     def filename(self):
-        """Full path to request.yaml."""
-        return p.join(self.dir, "request.yaml")
+        """Full path to request.json."""
+        return p.join(self.dir, "request.json")
 
     @property
     def not_after(self) -> Optional[datetime.datetime]:
@@ -217,14 +268,115 @@ class Request:
     def tempfail(self):
         return self.state not in state.ARCHIVE and self.attempts
 
+    def to_dict(self) -> dict:
+        """Returns the JSON-compatible representation of this request."""
+        return {
+            "version": serialization.FORMAT_VERSION,
+            "id": self.id,
+            "state": self.state.value,
+            "comment": self._comment,
+            "estimate": self._estimate.value if self._estimate else None,
+            "added_at": _format_iso(self.added_at),
+            "updated_at": _format_iso(self.updated_at),
+            "last_scheduled_at": _format_iso(self.last_scheduled_at),
+            "next_due": _format_iso(self.next_due),
+            "attempts": [a.to_dict() for a in self.attempts],
+            "activity": serialization.dump_activity(self.activity),
+        }
+
     @classmethod
-    def load(cls, dir: str | Path, config: ConfigParser, log):
-        # need imports because such objects may be loaded via YAML
-        import fc.maintenance.activity.reboot
-        import fc.maintenance.activity.update
-        import fc.maintenance.activity.vm_change
-        import fc.maintenance.lib.reboot
-        import fc.maintenance.lib.shellscript
+    def from_dict(cls, data: dict) -> "Request":
+        if data.get("version") != serialization.FORMAT_VERSION:
+            raise serialization.SerializationError(
+                f"Unsupported request format version: {data.get('version')}"
+            )
+        instance = cls(
+            serialization.load_activity(data["activity"]),
+            data["estimate"],
+            data["comment"],
+        )
+        instance._reqid = data["id"]
+        instance.state = State(data["state"])
+        instance.added_at = _parse_iso(data["added_at"])
+        instance.updated_at = _parse_iso(data["updated_at"])
+        instance.last_scheduled_at = _parse_iso(data["last_scheduled_at"])
+        instance.next_due = _parse_iso(data["next_due"])
+        instance.attempts = [Attempt.from_dict(a) for a in data["attempts"]]
+        return instance
+
+    def serialize(self) -> str:
+        return json.dumps(self.to_dict(), indent=2, sort_keys=True) + "\n"
+
+    @classmethod
+    def load(cls, dir: str | Path, config: ConfigParser, log, index=None):
+        """Loads a request from its directory.
+
+        If a spool `index` is given, the request is restored from the index
+        when the request file hasn't changed since it has been indexed.
+        Freshly read requests are added to the index.
+
+        Requests saved by older agent versions are read from `request.yaml`.
+        They are considered changed after loading so they are migrated to
+        the JSON format on the next save.
+        """
+        _import_activity_types()
+        try:
+            instance, saved_digest = cls._load_json(dir, index)
+        except FileNotFoundError:
+            instance = cls._load_legacy_yaml(dir)
+            saved_digest = None
+
+        instance.config = config
+        instance.dir = dir
+        instance.set_up_logging(log)
+
+        instance.activity.load(p.abspath(dir))
+        instance.activity.request = instance
+
+        instance._saved_digest = saved_digest
+        return instance
+
+    @classmethod
+    def from_compacted(cls, entry, config: ConfigParser, log) -> "Request":
+        """Restores an archived request from an archive segment entry.
+
+        Compacted requests don't have a directory anymore. They are only
+        meant for displaying and must not be saved.
+        """
+        _import_activity_types()
+        instance = cls.from_dict(entry.request)
+        instance.config = config
+        instance.compacted = True
+        instance.set_up_logging(log)
+        instance.activity.request = instance
+        instance._saved_digest = instance._digest()
+        return instance
+
+    @classmethod
+    def _load_json(cls, dir, index=None) -> tuple["Request", bytes]:
+        """Returns the request and the digest of its saved state.
+
+        The digest is computed from the file content, which is what
+        `serialize` produces for an unchanged request. This saves
+        serializing every request again just to detect changes later.
+        """
+        filename = p.join(dir, "request.json")
+        serialized = None
+        if index is not None:
+            signature = read_signature(filename)
+            serialized = index.get(dir, signature)
+        if serialized is None:
+            with open(filename) as f:
+                serialized = f.read()
+            if index is not None:
+                index.put(dir, signature, serialized)
+
+        instance = cls.from_dict(json.loads(serialized))
+        return instance, hashlib.sha256(serialized.encode()).digest()
+
+    @classmethod
+    def _load_legacy_yaml(cls, dir) -> "Request":
+        import yaml
 
         with open(p.join(dir, "request.yaml")) as f:
             instance = yaml.load(f, Loader=yaml.UnsafeLoader)
@@ -258,29 +410,73 @@ class Request:
         if not hasattr(instance, "state"):
             instance.state = State.pending
 
-        instance.config = config
-        instance.dir = dir
-        instance.set_up_logging(log)
+        # Attributes that have been serialized by accident in the past.
+        for attr in ("comment", "estimate", "config", "_reqmanager"):
+            instance.__dict__.pop(attr, None)
 
-        with cd(dir):
-            instance.activity.load()
-            instance.activity.request = instance
+        instance._reqmanager = None
         return instance
 
-    def save(self):
+    def _digest(self) -> bytes:
+        return hashlib.sha256(self.serialize().encode()).digest()
+
+    @property
+    def dirty(self) -> bool:
+        """True if the request state differs from the saved state."""
+        if self._saved_digest is None:
+            return True
+        try:
+            return self._digest() != self._saved_digest
+        except Exception:
+            # Not serializable at the moment, let saving fail loudly.
+            return True
+
+    def save(self, force=False) -> bool:
+        """Saves the request if its state changed since it has been loaded
+        or saved the last time. The request file is synced to disk.
+
+        Returns True if the request file has been written.
+        """
+        if not force and not self.dirty:
+            return False
+        self.finish_save(self.prepare_save(sync=True))
+        return True
+
+    def prepare_save(self, sync=True) -> "PendingSave":
+        """Writes the request state to a temporary file in the request
+        directory. Call `finish_save` with the result to replace the
+        request file with it.
+
+        Use `sync=False` to skip syncing the file to disk when saving a batch
+        of requests. The caller is responsible for syncing before calling
+        `finish_save` then.
+        """
         assert self.dir, "request directory not set"
         if not p.isdir(self.dir):
             os.mkdir(self.dir)
+        serialized = self.serialize()
         with tempfile.NamedTemporaryFile(
             mode="w", dir=self.dir, delete=False
         ) as tf:
-            yaml.dump(self, tf)
+            tf.write(serialized)
             tf.flush()
-            os.fsync(tf.fileno())
+            if sync:
+                os.fsync(tf.fileno())
             os.chmod(tf.fileno(), 0o644)
-            os.rename(tf.name, self.filename)
-        with cd(self.dir):
-            self.activity.dump()
+        return PendingSave(tf.name, serialized)
+
+    def finish_save(self, pending: "PendingSave"):
+        os.rename(pending.tempfile_name, self.filename)
+        self._saved_digest = hashlib.sha256(
+            pending.serialized.encode()
+        ).digest()
+        if self._reqmanager is not None:
+            self._reqmanager.request_saved(self, pending.serialized)
+        # Request has been migrated from the legacy format.
+        legacy_filename = p.join(self.dir, "request.yaml")
+        if p.exists(legacy_filename):
+            os.unlink(legacy_filename)
+        self.activity.dump(p.abspath(self.dir))
 
     def execute(self):
         """Executes associated activity.
@@ -303,7 +499,14 @@ class Request:
             self.state = State.running
             self.attempts.append(attempt)
             self.save()
-            with cd(self.dir):
+            # Changing the working directory would affect other requests
+            # running at the same time.
+            workdir = (
+                contextlib.nullcontext()
+                if self.activity.parallel_safe
+                else cd(self.dir)
+            )
+            with workdir:
                 try:
                     if resuming:
                         self.activity.resume()
@@ -456,18 +659,3 @@ class Request:
             for r in self._reqmanager.requests.values()
             if r._reqid != self._reqid
         ]
-
-
-def request_representer(dumper, data):
-    # remove backlink before dumping a Request object
-    d = copy.copy(data)
-    if hasattr(d, "_reqmanager"):
-        d._reqmanager = None
-
-    if hasattr(d, "log"):
-        del d.log
-
-    return dumper.represent_object(d)
-
-
-yaml.add_representer(Request, request_representer)
@@ -0,0 +1,129 @@
+"""JSON serialization for maintenance requests.
+
+Requests are stored as versioned JSON documents in `request.json`. Older
+agent versions used PyYAML with Python object tags which is slow to load and
+can construct arbitrary objects. The JSON format only restores types known to
+this module:
+
+* Activities are looked up by their type name in `ACTIVITY_TYPES`. Their
+  state is the (encoded) result of `Activity.__getstate__`. Activity modules
+  below `fc.maintenance` which haven't been imported yet are imported on
+  demand, CLIs only import the activities they create themselves.
+* Values which are not supported by JSON directly (datetimes, estimates,
+  enums, ...) are encoded as tagged objects like
+  `{"$type": "datetime", "value": "2023-01-01T00:00:00+00:00"}`.
+"""
+
+import datetime
+import enum
+import importlib
+
+from fc.maintenance.activity import (
+    ACTIVITY_TYPES,
+    Activity,
+    RebootType,
+    activity_type_name,
+)
+from fc.maintenance.estimate import Estimate
+from fc.maintenance.state import State
+
+# Bump this when making incompatible changes to the format.
+FORMAT_VERSION = 1
+
+ENUM_TYPES: dict[str, type[enum.Enum]] = {
+    "RebootType": RebootType,
+    "State": State,
+}
+
+
+class SerializationError(Exception):
+    pass
+
+
+def encode(value):
+    """Converts `value` to something that can be passed to `json.dumps`."""
+    match value:
+        case None | bool() | int() | float() | str() if not isinstance(
+            value, enum.Enum
+        ):
+            return value
+        case enum.Enum() if type(value).__name__ in ENUM_TYPES:
+            return {
+                "$type": "enum",
+                "class": type(value).__name__,
+                "value": value.value,
+            }
+        case datetime.datetime():
+            return {"$type": "datetime", "value": value.isoformat()}
+        case datetime.timedelta():
+            return {"$type": "timedelta", "value": value.total_seconds()}
+        case Estimate():
+            return {"$type": "estimate", "value": value.value}
+        case set() | frozenset():
+            return {"$type": "set", "value": [encode(v) for v in value]}
+        case list() | tuple():
+            return [encode(v) for v in value]
+        case dict() if all(isinstance(k, str) for k in value):
+            return {k: encode(v) for k, v in value.items()}
+
+    raise SerializationError(f"Cannot serialize value: {value!r}")
+
+
+def decode(value):
+    """Reverses `encode` for values returned by `json.loads`."""
+    match value:
+        case list():
+            return [decode(v) for v in value]
+        case {"$type": "enum", "class": cls_name, "value": val}:
+            try:
+                return ENUM_TYPES[cls_name](val)
+            except (KeyError, ValueError):
+                raise SerializationError(f"Unknown enum value: {value!r}")
+        case {"$type": "datetime", "value": val}:
+            return datetime.datetime.fromisoformat(val)
+        case {"$type": "timedelta", "value": val}:
+            return datetime.timedelta(seconds=val)
+        case {"$type": "estimate", "value": val}:
+            return Estimate(val)
+        case {"$type": "set", "value": val}:
+            return set(decode(v) for v in val)
+        case {"$type": _}:
+            raise SerializationError(f"Unknown tagged value: {value!r}")
+        case dict():
+            return {k: decode(v) for k, v in value.items()}
+
+    return value
+
+
+def dump_activity(activity: Activity) -> dict:
+    return {
+        "type": activity_type_name(type(activity)),
+        "state": encode(activity.__getstate__()),
+    }
+
+
+def activity_type(type_name: str) -> type[Activity]:
+    if type_name not in ACTIVITY_TYPES and type_name.startswith(
+        "fc.maintenance."
+    ):
+        module_name = type_name.rpartition(".")[0]
+        try:
+            importlib.import_module(module_name)
+        except ImportError:
+            pass
+    return ACTIVITY_TYPES[type_name]
+
+
+def load_activity(data: dict) -> Activity:
+    """Creates an activity object from serialized data.
+
+    Like unpickling, this doesn't call `__init__`. The activity's `load`
+    method is responsible for upgrading the state of older activities.
+    """
+    try:
+        cls = activity_type(data["type"])
+    except KeyError:
+        raise SerializationError(f"Unknown activity type: {data.get('type')}")
+    activity = cls.__new__(cls)
+    activity.__dict__.update(decode(data["state"]))
+    return activity
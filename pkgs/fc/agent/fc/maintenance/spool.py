@@ -0,0 +1,193 @@
+"""Index for the maintenance request spool.
+
+Reading every request file is the most expensive part of loading requests.
+The index is a small SQLite database in the spool directory which remembers
+the stat signature (mtime, inode, size) of each request file together with
+its serialized content. As long as the signature of a request file matches,
+the request is restored from the index without opening the file. Checking
+the signature only needs a stat() call.
+
+The index is only a cache. It's always safe to delete it, it will be
+rebuilt on the next run. Only invasive ReqManager operations (holding the
+request manager lock) write to the index, non-invasive ones open it
+read-only.
+"""
+
+import os
+import os.path as p
+import sqlite3
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import structlog
+
+_log = structlog.get_logger()
+
+# Bump this when the layout of the database or the serialized objects
+# changes in an incompatible way. Old indexes are discarded.
+SCHEMA_VERSION = 2
+
+
+class Signature(NamedTuple):
+    mtime_ns: int
+    inode: int
+    size: int
+
+    @classmethod
+    def from_stat(cls, st: os.stat_result) -> "Signature":
+        return cls(st.st_mtime_ns, st.st_ino, st.st_size)
+
+
+class SpoolIndex:
+    """Maps request directories below `spooldir` to serialized requests."""
+
+    def __init__(self, spooldir, conn: sqlite3.Connection, writable, log):
+        # Request dirs are always below the spool dir the ReqManager uses,
+        # so keys can be computed without resolving symlinks.
+        self.spooldir = p.abspath(spooldir)
+        self.conn = conn
+        self.writable = writable
+        self.log = log
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def open(
+        cls, spooldir: str | Path, writable=False, log=_log
+    ) -> Optional["SpoolIndex"]:
+        """Opens the index in `spooldir`.
+
+        A writable index is created if it doesn't exist. A broken or outdated
+        index is discarded and created again. Returns None if the index
+        cannot be used, for example because it doesn't exist yet and should
+        be opened read-only.
+        """
+        path = Path(spooldir) / "index.sqlite"
+        try:
+            if writable:
+                conn = cls._connect_writable(path)
+            elif path.exists():
+                conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version != SCHEMA_VERSION:
+                    conn.close()
+                    return
+            else:
+                return
+        except sqlite3.Error:
+            log.warning(
+                "spool-index-open-failed", path=str(path), exc_info=True
+            )
+            return
+
+        return cls(spooldir, conn, writable, log)
+
+    @staticmethod
+    def _connect_writable(path: Path) -> sqlite3.Connection:
+        for attempt in range(2):
+            try:
+                # Requests executed in parallel threads save themselves,
+                # calls are serialized by the ReqManager.
+                conn = sqlite3.connect(
+                    path, isolation_level=None, check_same_thread=False
+                )
+                # The index can be rebuilt from the request files at any time.
+                # There's no need to wait for the disk.
+                conn.execute("PRAGMA synchronous = OFF")
+                conn.execute("PRAGMA journal_mode = MEMORY")
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version != SCHEMA_VERSION:
+                    conn.execute("DROP TABLE IF EXISTS requests")
+                    conn.execute(
+                        "CREATE TABLE requests ("
+                        "  path TEXT PRIMARY KEY,"
+                        "  mtime_ns INTEGER NOT NULL,"
+                        "  inode INTEGER NOT NULL,"
+                        "  size INTEGER NOT NULL,"
+                        "  data TEXT NOT NULL"
+                        ")"
+                    )
+                    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                os.chmod(path, 0o644)
+                return conn
+            except sqlite3.DatabaseError:
+                if attempt:
+                    raise
+                # Database file is corrupted, start from scratch.
+                path.unlink(missing_ok=True)
+
+    def close(self):
+        self.conn.close()
+
+    def _key(self, request_dir) -> Optional[str]:
+        """Index key for a request dir, relative to the spool dir.
+
+        Returns None for directories outside the spool dir.
+        """
+        rel = p.relpath(p.abspath(request_dir), self.spooldir)
+        if rel.startswith(os.pardir):
+            return
+        return rel
+
+    def get(self, request_dir, signature: Signature) -> Optional[str]:
+        """Returns the serialized request for `request_dir` if the
+        signature of its request file is unchanged, None otherwise.
+        """
+        key = self._key(request_dir)
+        if key is None:
+            return
+        try:
+            row = self.conn.execute(
+                "SELECT mtime_ns, inode, size, data FROM requests "
+                "WHERE path = ?",
+                (key,),
+            ).fetchone()
+        except sqlite3.Error:
+            self.log.debug("spool-index-get-failed", key=key, exc_info=True)
+            row = None
+
+        if row is None or Signature(*row[:3]) != signature:
+            self.misses += 1
+            return
+
+        self.hits += 1
+        return row[3]
+
+    def put(self, request_dir, signature: Signature, serialized: str):
+        """Caches the serialized request for `request_dir` under the given
+        signature of its request file. Does nothing on a read-only index.
+        """
+        if not self.writable:
+            return
+        key = self._key(request_dir)
+        if key is None:
+            return
+        try:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO requests VALUES (?, ?, ?, ?, ?)",
+                (key, *signature, serialized),
+            )
+        except sqlite3.Error:
+            self.log.debug("spool-index-put-failed", key=key, exc_info=True)
+
+    def prune(self, subdir: str, existing_dirs):
+        """Removes entries in `subdir` which are not in `existing_dirs`."""
+        if not self.writable:
+            return
+        keep = {self._key(d) for d in existing_dirs}
+        try:
+            rows = self.conn.execute(
+                "SELECT path FROM requests WHERE path LIKE ?",
+                (subdir + os.sep + "%",),
+            ).fetchall()
+            stale = [(key,) for (key,) in rows if key not in keep]
+            if stale:
+                self.conn.executemany(
+                    "DELETE FROM requests WHERE path = ?", stale
+                )
+        except sqlite3.Error:
+            self.log.debug("spool-index-prune-failed", exc_info=True)
+
+
+def read_signature(path) -> Signature:
+    return Signature.from_stat(os.stat(path))
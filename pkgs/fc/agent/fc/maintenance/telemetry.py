@@ -0,0 +1,183 @@
+"""Aggregated statistics about active maintenance requests.
+
+`fc-maintenance metrics` and `check` run every few minutes. Instead of
+loading all requests each time, the ReqManager keeps a snapshot of the
+time-independent request statistics in the spool dir. The snapshot is
+updated when the ReqManager commits changed or archived requests and right
+away when a request changes its state, for example during execution.
+Time-dependent metrics are derived from the snapshot when reading it.
+"""
+
+import json
+import os
+import tempfile
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Optional
+
+import fc.maintenance.state
+from fc.maintenance.state import State
+
+# Bump this when changing the fields of RequestStats.
+SNAPSHOT_VERSION = 1
+
+
+def _timestamp(dt: datetime | None) -> float | None:
+    return dt.timestamp() if dt else None
+
+
+def _min(a: float | None, b: float | None) -> float | None:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a, b)
+
+
+@dataclass
+class RequestStats:
+    requests_total: int = 0
+    requests_runnable: int = 0
+    requests_tempfail: int = 0
+    requests_postpone: int = 0
+    requests_success: int = 0
+    requests_error: int = 0
+    requests_scheduled: int = 0
+    requests_waiting_for_schedule: int = 0
+    requests_estimate_seconds: float = 0.0
+    request_highest_retry_count: int = 0
+    state_counts: dict[str, int] = field(default_factory=dict)
+    # Timestamps, time-dependent metrics are calculated from them.
+    oldest_added_at: float | None = None
+    oldest_next_due: float | None = None
+    oldest_running_started_at: float | None = None
+    # mtime of the requests dir when the snapshot has been taken. Adding or
+    # removing request directories changes it and invalidates the snapshot.
+    requests_dir_mtime_ns: int | None = None
+
+    @classmethod
+    def from_requests(cls, requests: Iterable) -> "RequestStats":
+        stats = cls()
+
+        for req in requests:
+            stats.requests_total += 1
+            stats.requests_estimate_seconds += float(req.estimate)
+            stats.request_highest_retry_count = max(
+                len(req.attempts), stats.request_highest_retry_count
+            )
+            stats.oldest_added_at = _min(
+                stats.oldest_added_at, _timestamp(req.added_at)
+            )
+            state_name = str(req.state)
+            stats.state_counts[state_name] = (
+                stats.state_counts.get(state_name, 0) + 1
+            )
+
+            if req.state in (State.due, State.running):
+                stats.requests_runnable += 1
+
+            if req.state == State.running and req.attempts:
+                # There should only be one but it's technically
+                # possible to have more than one in state 'running'.
+                stats.oldest_running_started_at = _min(
+                    stats.oldest_running_started_at,
+                    _timestamp(req.attempts[-1].started),
+                )
+
+            if req.next_due:
+                stats.requests_scheduled += 1
+                # Date can be in the past for requests that have already been
+                # tried, but that's ok.
+                stats.oldest_next_due = _min(
+                    stats.oldest_next_due, _timestamp(req.next_due)
+                )
+            else:
+                stats.requests_waiting_for_schedule += 1
+
+            if req.attempts:
+                match req.attempts[-1].returncode:
+                    case None:
+                        pass
+                    case fc.maintenance.state.EXIT_TEMPFAIL:
+                        stats.requests_tempfail += 1
+                    case fc.maintenance.state.EXIT_POSTPONE:
+                        stats.requests_postpone += 1
+                    case 0:
+                        stats.requests_success += 1
+                    case _:
+                        stats.requests_error += 1
+
+        return stats
+
+    def to_metrics(self, now: datetime) -> dict:
+        """Request metrics in the format used by ReqManager.get_metrics."""
+        now_ts = now.timestamp()
+        metrics = {
+            "requests_total": self.requests_total,
+            "requests_runnable": self.requests_runnable,
+            "requests_tempfail": self.requests_tempfail,
+            "requests_postpone": self.requests_postpone,
+            "requests_success": self.requests_success,
+            "requests_error": self.requests_error,
+            "requests_pending": self.state_counts.get(str(State.pending), 0),
+            "requests_scheduled": self.requests_scheduled,
+            "requests_running": self.state_counts.get(str(State.running), 0),
+            "requests_waiting_for_schedule": (
+                self.requests_waiting_for_schedule
+            ),
+            "requests_estimate_seconds": self.requests_estimate_seconds,
+            "request_longest_in_queue_duration": 0,
+            "request_running_for_seconds": 0,
+            "request_highest_retry_count": self.request_highest_retry_count,
+            "request_next_due_at": self.oldest_next_due or 0,
+        }
+
+        if self.oldest_added_at is not None:
+            metrics["request_longest_in_queue_duration"] = (
+                now_ts - self.oldest_added_at
+            )
+
+        if self.oldest_running_started_at is not None:
+            # Like timedelta.seconds, ignoring full days.
+            metrics["request_running_for_seconds"] = (
+                int(now_ts - self.oldest_running_started_at) % 86400
+            )
+
+        return metrics
+
+    def save(self, path: Path):
+        """Writes the snapshot atomically. Readers never see partial files."""
+        data = {"version": SNAPSHOT_VERSION, **asdict(self)}
+        with tempfile.NamedTemporaryFile(
+            mode="w", dir=path.parent, delete=False
+        ) as tf:
+            json.dump(data, tf)
+            os.chmod(tf.fileno(), 0o644)
+        os.rename(tf.name, path)
+
+    @classmethod
+    def load(
+        cls, path: Path, requests_dir_mtime_ns: int
+    ) -> Optional["RequestStats"]:
+        """Reads the snapshot. Returns None if it is missing, outdated or
+        doesn't match the given mtime of the requests dir.
+        """
+        try:
+            with path.open() as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if data.pop("version", None) != SNAPSHOT_VERSION:
+            return
+
+        try:
+            stats = cls(**data)
+        except TypeError:
+            return
+
+        if stats.requests_dir_mtime_ns != requests_dir_mtime_ns:
+            return
+
+        return stats
@@ -27,3 +27,6 @@ class MergeableActivity(Activity):
         return ActivityMergeResult(
             self, is_effective=True, is_significant=self.significant
         )
+
+    def release(self):
+        self.released = True
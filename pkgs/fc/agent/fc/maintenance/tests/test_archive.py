@@ -0,0 +1,185 @@
+import base64
+import gzip
+import json
+import os
+import time
+import unittest.mock
+
+from fc.maintenance.activity import Activity
+from fc.maintenance.archive import (
+    ArchiveSegments,
+    CompactedRequest,
+    compacted_request_from_dir,
+)
+from fc.maintenance.request import Attempt, Request
+from fc.maintenance.state import State
+
+DAY = 86400
+
+
+def archive_requests(rm, count, age_days=30):
+    """Moves `count` new requests to the archive, `age_days` old."""
+    requests = []
+    for i in range(count):
+        req = Request(Activity(), comment=f"archived {i}")
+        rm.add(req)
+        req.state = State.success
+        attempt = Attempt()
+        attempt.finished = attempt.started
+        attempt.returncode = 0
+        req.attempts.append(attempt)
+        requests.append(req)
+
+    with unittest.mock.patch("fc.util.directory.connect"):
+        rm.archive()
+
+    timestamp = time.time() - age_days * DAY
+    for req in requests:
+        with open(os.path.join(req.dir, "stdout.log"), "w") as f:
+            f.write(f"output of {req.id}")
+        os.utime(req.dir, (timestamp, timestamp))
+    return requests
+
+
+def test_compact_archive_moves_old_requests_to_segments(reqmanager):
+    old = archive_requests(reqmanager, 2)
+    new = archive_requests(reqmanager, 1, age_days=0)
+
+    result = reqmanager.compact_archive()
+
+    assert sorted(result.compacted) == sorted(r.id for r in old)
+    assert result.deleted_segments == []
+    assert sorted(os.listdir(reqmanager.archivedir)) == [new[0].id]
+    segments = list(reqmanager.archive_segments.segmentdir.glob("*.gz"))
+    assert len(segments) == 1
+    with gzip.open(segments[0], "rt") as f:
+        entries = [json.loads(line) for line in f]
+    assert sorted(e["id"] for e in entries) == sorted(r.id for r in old)
+    assert entries[0]["files"] == {
+        "stdout.log": f"output of {entries[0]['id']}"
+    }
+    assert entries[0]["binary_files"] == {}
+
+
+def test_compact_archive_keeps_non_utf8_files(reqmanager):
+    (req,) = archive_requests(reqmanager, 1)
+    content = b"latin-1 \xe4\xf6\xfc \x00"
+    mtime = os.stat(req.dir).st_mtime
+    with open(os.path.join(req.dir, "output.bin"), "wb") as f:
+        f.write(content)
+    os.utime(req.dir, (mtime, mtime))
+
+    reqmanager.compact_archive()
+
+    (segment,) = reqmanager.archive_segments.segmentdir.glob("*.gz")
+    with gzip.open(segment, "rt") as f:
+        entry = CompactedRequest.from_json(f.readline())
+    assert "output.bin" not in entry.files
+    assert base64.b64decode(entry.binary_files["output.bin"]) == content
+
+
+def test_compact_archive_truncates_large_files(reqmanager, log, monkeypatch):
+    monkeypatch.setattr("fc.maintenance.archive.MAX_EXTRA_FILE_SIZE", 100)
+    (req,) = archive_requests(reqmanager, 1)
+    lines = [f"line {i:03}\n" for i in range(100)]
+    mtime = os.stat(req.dir).st_mtime
+    with open(os.path.join(req.dir, "run.log"), "w") as f:
+        f.writelines(lines)
+    os.mkdir(os.path.join(req.dir, "subdir"))
+    os.utime(req.dir, (mtime, mtime))
+
+    reqmanager.compact_archive()
+
+    (segment,) = reqmanager.archive_segments.segmentdir.glob("*.gz")
+    with gzip.open(segment, "rt") as f:
+        entry = CompactedRequest.from_json(f.readline())
+    content = entry.files["run.log"]
+    # Only complete lines from the beginning and the end are kept.
+    assert content.startswith("".join(lines[:5]))
+    assert content.endswith("".join(lines[-5:]))
+    assert "[... 810 bytes truncated ...]\n" in content
+    assert entry.truncated_files == {"run.log": 900}
+    assert entry.skipped_files == ["subdir"]
+    assert log.has("compact-request-file-truncated", file="run.log", size=900)
+    assert log.has("compact-request-file-skipped", file="subdir")
+
+
+def test_archived_requests_include_compacted(reqmanager):
+    old = archive_requests(reqmanager, 2)
+    new = archive_requests(reqmanager, 1, age_days=0)
+    reqmanager.compact_archive()
+    # Append another member to the same segment.
+    newer_old = archive_requests(reqmanager, 1)
+    reqmanager.compact_archive()
+
+    # Sorted by the time the requests have been added.
+    archived = reqmanager._archived_requests()
+    assert archived == old + new + newer_old
+    assert [r.compacted for r in archived] == [True, True, False, True]
+    assert archived[0].comment == "archived 0"
+    assert archived[0].state == State.success
+    assert archived[0].attempts[0].returncode == 0
+
+    assert reqmanager._archived_requests(old[1].id[:6]) == [old[1]]
+
+
+def test_show_request_finds_compacted_request(reqmanager, capsys):
+    (req,) = archive_requests(reqmanager, 1)
+    reqmanager.compact_archive()
+
+    reqmanager.show_request(req.id[:5])
+    out = capsys.readouterr().out
+    assert "Found one archived request" in out
+    assert "archived 0" in out
+
+    reqmanager.show_request(req.id, dump_raw=True)
+    out = capsys.readouterr().out
+    assert f'"id": "{req.id}"' in out
+
+
+def test_compact_archive_expires_old_segments(reqmanager):
+    archive_requests(reqmanager, 1, age_days=400)
+    (recent,) = archive_requests(reqmanager, 1)
+    # Completion time decides about the segment and retention.
+    compacted = reqmanager.archive_segments
+    with unittest.mock.patch(
+        "fc.maintenance.reqmanager.compacted_request_from_dir",
+        side_effect=lambda req: compacted_request_from_dir(req)._replace(
+            completed_at=os.stat(req.dir).st_mtime
+        ),
+    ):
+        result = reqmanager.compact_archive()
+
+    assert len(result.compacted) == 2
+    assert len(result.deleted_segments) == 1
+    assert [e.id for e in compacted.find()] == [recent.id]
+
+
+def test_compact_archive_keeps_broken_requests(reqmanager):
+    broken = reqmanager.archivedir / "broken"
+    broken.mkdir()
+    (broken / "request.json").write_text("{")
+    os.utime(broken, (0, 0))
+
+    result = reqmanager.compact_archive()
+
+    assert result.compacted == []
+    assert broken.exists()
+
+
+def test_segment_index_is_rebuilt(tmp_path):
+    segments = ArchiveSegments(tmp_path / "segments")
+    now = time.time()
+    entries = [
+        CompactedRequest(f"req{i}", now, {"id": f"req{i}"}, {})
+        for i in range(3)
+    ]
+    segments.append(entries[:2])
+    segments.append(entries[2:])
+
+    segments.index_path.unlink()
+    assert segments.find() == []
+    # Writing operations rebuild the index from the segments.
+    assert segments.expire(0) == []
+    assert segments.find("req") == entries
+    assert segments.find("req2") == entries[2:]
@@ -0,0 +1,154 @@
+"""Benchmarks for the request lifecycle hot path.
+
+Run with `pytest --with-benchmarks -s fc/maintenance/tests/test_benchmark.py`.
+
+Each ReqManager operation runs in its own ReqManager context like the
+fc-maintenance commands do, against a synthetic spool and a local directory
+stand-in. Reported per operation:
+
+* wall time
+* number of fsync/fdatasync/sync calls
+* growth of the peak RSS of the test process (only increases are visible)
+"""
+
+import contextlib
+import json
+import os
+import resource
+import time
+import unittest.mock
+
+import pytest
+import rich
+from fc.maintenance.activity import Activity
+from fc.maintenance.reqmanager import ReqManager
+from fc.maintenance.request import Request
+from fc.maintenance.state import State
+from fc.util.tests.directory_standin import DirectoryStandIn
+from fc.util.time_date import utcnow
+from rich.table import Table
+
+
+class Measurements:
+    def __init__(self):
+        self.rows = []
+        self.sync_calls = 0
+
+    @contextlib.contextmanager
+    def patch_sync(self):
+        def counting(func):
+            def wrapper(*args):
+                self.sync_calls += 1
+                return func(*args)
+
+            return wrapper
+
+        with contextlib.ExitStack() as stack:
+            for name in ("fsync", "fdatasync", "sync"):
+                stack.enter_context(
+                    unittest.mock.patch(
+                        f"os.{name}", counting(getattr(os, name))
+                    )
+                )
+            yield
+
+    @contextlib.contextmanager
+    def measure(self, operation):
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        syncs_before = self.sync_calls
+        started = time.perf_counter()
+        yield
+        wall = time.perf_counter() - started
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.rows.append(
+            (
+                operation,
+                wall,
+                self.sync_calls - syncs_before,
+                rss_after - rss_before,
+            )
+        )
+
+    def print(self, title):
+        table = Table(title=title)
+        table.add_column("operation")
+        table.add_column("wall (ms)", justify="right")
+        table.add_column("syncs", justify="right")
+        table.add_column("peak RSS growth (KiB)", justify="right")
+        for operation, wall, syncs, rss in self.rows:
+            table.add_row(
+                operation, f"{wall * 1000:.1f}", str(syncs), str(rss)
+            )
+        rich.print(table)
+
+
+def populate_spool(spooldir, count):
+    """Writes `count` pending requests without going through the
+    ReqManager to keep setup fast.
+    """
+    requestsdir = spooldir / "requests"
+    os.makedirs(requestsdir)
+    for i in range(count):
+        req = Request(Activity(), comment=f"benchmark {i}")
+        req.dir = str(requestsdir / req.id)
+        os.mkdir(req.dir)
+        req.added_at = utcnow()
+        req.finish_save(req.prepare_save(sync=False))
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("count", [10, 100, 1000])
+def test_benchmark_request_lifecycle(
+    count, tmp_path, agent_maintenance_config, log, logger, monkeypatch
+):
+    spooldir = tmp_path / "maintenance"
+    populate_spool(spooldir, count)
+    # Don't actually sleep between directory retries or before reboots.
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    measurements = Measurements()
+
+    with DirectoryStandIn() as directory, measurements.patch_sync():
+        enc_path = tmp_path / "enc.json"
+        enc_path.write_text(json.dumps(directory.enc()))
+
+        def reqmanager():
+            return ReqManager(
+                spooldir, enc_path, agent_maintenance_config, log=logger
+            )
+
+        rm = reqmanager()
+        with measurements.measure("scan (cold index)"):
+            with rm:
+                pass
+
+        with measurements.measure("scan (warm index)"):
+            with rm:
+                pass
+
+        with measurements.measure("schedule"):
+            with rm:
+                rm.schedule()
+
+        with measurements.measure("update_states"):
+            with rm:
+                rm.update_states()
+                assert all(r.state == State.due for r in rm.requests.values())
+
+        with measurements.measure("get_metrics"):
+            reqmanager().get_metrics()
+
+        with measurements.measure("execute"):
+            with rm:
+                rm.execute()
+
+        with measurements.measure("archive"):
+            with rm:
+                rm.archive()
+                assert not rm.requests
+
+        with measurements.measure("check"):
+            reqmanager().check()
+
+    measurements.print(f"Request lifecycle, {count} requests")
+    assert directory.calls["schedule_maintenance"] == 1
+    assert directory.calls["end_maintenance"] == 1
@@ -5,6 +5,7 @@ from unittest.mock import MagicMock
 import fc.maintenance.cli
 import pytest
 import typer.testing
+from fc.util.directory import ServiceCheckResult
 
 CHANNEL_URL = (
     "https://hydra.flyingcircus.io/build/138288/download/1/nixexprs" ".tar.xz"
@@ -154,10 +155,12 @@ def test_invoke_request_cold_reboot(activity, invoke_app_as_root):
     fc.maintenance.cli.rm.add.assert_called_once()
 
 
-@unittest.mock.patch("fc.maintenance.cli.request_reboot_for_kernel")
-@unittest.mock.patch("fc.maintenance.cli.request_reboot_for_kvm_environment")
-@unittest.mock.patch("fc.maintenance.cli.request_reboot_for_cpu")
-@unittest.mock.patch("fc.maintenance.cli.request_reboot_for_memory")
+@unittest.mock.patch("fc.maintenance.maintenance.request_reboot_for_kernel")
+@unittest.mock.patch(
+    "fc.maintenance.maintenance.request_reboot_for_kvm_environment"
+)
+@unittest.mock.patch("fc.maintenance.maintenance.request_reboot_for_cpu")
+@unittest.mock.patch("fc.maintenance.maintenance.request_reboot_for_memory")
 def test_invoke_request_system_properties_virtual(
     memory, cpu, qemu, kernel, invoke_app_as_root
 ):
@@ -168,10 +171,12 @@ def test_invoke_request_system_properties_virtual(
     kernel.assert_called_once()
 
 
-@unittest.mock.patch("fc.maintenance.cli.request_reboot_for_kernel")
-@unittest.mock.patch("fc.maintenance.cli.request_reboot_for_kvm_environment")
-@unittest.mock.patch("fc.maintenance.cli.request_reboot_for_cpu")
-@unittest.mock.patch("fc.maintenance.cli.request_reboot_for_memory")
+@unittest.mock.patch("fc.maintenance.maintenance.request_reboot_for_kernel")
+@unittest.mock.patch(
+    "fc.maintenance.maintenance.request_reboot_for_kvm_environment"
+)
+@unittest.mock.patch("fc.maintenance.maintenance.request_reboot_for_cpu")
+@unittest.mock.patch("fc.maintenance.maintenance.request_reboot_for_memory")
 def test_invoke_request_system_properties_physical(
     memory, cpu, qemu, kernel, tmpdir, invoke_app_as_root
 ):
@@ -187,7 +192,7 @@ def test_invoke_request_system_properties_physical(
     kernel.assert_called_once()
 
 
-@unittest.mock.patch("fc.maintenance.cli.request_update")
+@unittest.mock.patch("fc.maintenance.maintenance.request_update")
 @unittest.mock.patch("fc.maintenance.cli.load_enc")
 def test_invoke_request_update(load_enc, request_update, invoke_app_as_root):
     invoke_app_as_root("request", "update")
@@ -217,6 +222,19 @@ def test_invoke_constraints_not_met(
     assert log.info("constraints-failure")
 
 
+@unittest.mock.patch("fc.util.directory.check_nodes_in_service")
+def test_invoke_constraints_timeout(
+    check_nodes_in_service, monkeypatch, invoke_app_as_root, log
+):
+    monkeypatch.setattr("fc.util.directory.connect", MagicMock())
+    check_nodes_in_service.return_value = ServiceCheckResult([], ["test01"])
+    invoke_app_as_root(
+        "constraints", "--in-service", "test01", "--timeout", "1", exit_code=69
+    )
+    assert log.has("constraints-timeout", unknown=["test01"], timeout=1)
+    assert log.info("constraints-failure")
+
+
 def test_invoke_metrics(app_main_args):
     runner = typer.testing.CliRunner()
     with unittest.mock.patch("fc.maintenance.cli.ReqManager") as rm:
@@ -0,0 +1,148 @@
+import json
+import unittest.mock
+
+from fc.maintenance.activity import Activity, RebootType
+from fc.maintenance.durations import (
+    MIN_LEARNED_ESTIMATE,
+    DurationModel,
+    DurationStats,
+    duration_key,
+)
+from fc.maintenance.estimate import Estimate
+from fc.maintenance.request import Attempt, Request
+from fc.maintenance.state import State
+
+
+class KeyedActivity(Activity):
+    def __init__(self, key):
+        super().__init__()
+        self.key = key
+
+    def duration_key(self):
+        return self.key
+
+
+def executed_request(activity, duration, state=State.success):
+    req = Request(activity)
+    req.state = state
+    attempt = Attempt()
+    attempt.duration = duration
+    req.attempts.append(attempt)
+    return req
+
+
+def test_duration_stats_moving_average():
+    stats = DurationStats()
+    stats.add(100)
+    assert (stats.mean, stats.deviation) == (100, 0)
+    stats.add(200)
+    assert stats.mean == 130
+    assert stats.deviation == 30
+    assert stats.estimate == 190
+
+
+def test_duration_stats_minimum_estimate():
+    stats = DurationStats()
+    stats.add(1)
+    assert stats.estimate == MIN_LEARNED_ESTIMATE
+
+
+def test_duration_key():
+    assert duration_key(Activity()) == "fc.maintenance.activity.Activity"
+    assert duration_key(KeyedActivity("small")).endswith("KeyedActivity:small")
+
+
+def test_learned_estimate_needs_enough_samples(tmp_path):
+    model = DurationModel(tmp_path / "durations.json")
+    for i in range(2):
+        assert model.observe(executed_request(Activity(), 120))
+        assert model.learned_estimate(Activity()) is None
+
+    model.observe(executed_request(Activity(), 120))
+    assert model.learned_estimate(Activity()) == Estimate(120)
+    # Other keys are learned separately.
+    assert model.learned_estimate(KeyedActivity("other")) is None
+
+
+def test_observe_ignores_unsuccessful_requests(tmp_path):
+    model = DurationModel(tmp_path / "durations.json")
+    assert not model.observe(executed_request(Activity(), 10, State.error))
+    assert not model.observe(executed_request(Activity(), None))
+    assert not model.stats
+
+
+def test_save_and_load(tmp_path):
+    path = tmp_path / "durations.json"
+    model = DurationModel(path)
+    model.observe(executed_request(Activity(), 100))
+    model.save()
+
+    loaded = DurationModel.load(path)
+    assert loaded.stats == model.stats
+
+    path.write_text(json.dumps({"version": 0}))
+    assert DurationModel.load(path).stats == {}
+    path.write_text("{")
+    assert DurationModel.load(path).stats == {}
+
+
+@unittest.mock.patch("fc.util.directory.connect")
+def test_schedule_uses_learned_estimate(connect, reqmanager):
+    for _ in range(3):
+        reqmanager.durations.observe(
+            executed_request(KeyedActivity("long"), 1200)
+        )
+    learned = reqmanager.add(Request(KeyedActivity("long"), comment="long"))
+    explicit = reqmanager.add(
+        Request(KeyedActivity("long"), 30, comment="explicit")
+    )
+    unknown = reqmanager.add(Request(KeyedActivity("new"), comment="new"))
+    rpccall = connect().schedule_maintenance
+    rpccall.return_value = {}
+
+    reqmanager.schedule()
+
+    prep = reqmanager.maintenance_preparation_seconds
+    rpccall.assert_called_once_with(
+        {
+            learned.id: {"estimate": 1200 + prep, "comment": "long"},
+            explicit.id: {"estimate": 900, "comment": "explicit"},
+            unknown.id: {"estimate": 900, "comment": "new"},
+        }
+    )
+
+
+def test_learned_estimate_keeps_minimum(reqmanager):
+    for _ in range(3):
+        reqmanager.durations.observe(
+            executed_request(KeyedActivity("tiny"), 30)
+        )
+    req = Request(KeyedActivity("tiny"))
+    assert reqmanager._estimated_request_duration(req) == 900
+
+
+def test_learned_estimate_adds_reboot_time(reqmanager):
+    reqmanager.reboot_seconds = 400
+    for _ in range(3):
+        reqmanager.durations.observe(
+            executed_request(KeyedActivity("reboot"), 600)
+        )
+    activity = KeyedActivity("reboot")
+    activity.reboot_needed = RebootType.WARM
+    req = Request(activity)
+
+    prep = reqmanager.maintenance_preparation_seconds
+    assert reqmanager._estimated_request_duration(req) == 600 + 400 + prep
+
+
+def test_execute_learns_durations(reqmanager, monkeypatch):
+    reqmanager._enter_maintenance = unittest.mock.Mock()
+    reqmanager._leave_maintenance = unittest.mock.Mock()
+    monkeypatch.setattr("fc.util.directory.connect", unittest.mock.Mock())
+    req = reqmanager.add(Request(KeyedActivity("exec"), 1))
+    reqmanager._runnable = lambda run_all_now, force_run: [req]
+
+    reqmanager.execute()
+
+    model = DurationModel.load(reqmanager.duration_model_path)
+    assert model.stats[duration_key(req.activity)].samples == 1
@@ -0,0 +1,131 @@
+import configparser
+import subprocess
+import time
+from unittest.mock import MagicMock
+
+import pytest
+from fc.maintenance.hooks import MaintenanceHook, load_hooks, run_hooks
+from fc.maintenance.reqmanager import PostponeMaintenance, TempfailMaintenance
+
+
+def make_config(text):
+    config = configparser.ConfigParser()
+    config.read_string(text)
+    return config
+
+
+def test_load_hooks():
+    config = make_config(
+        """
+        [maintenance-enter]
+        a = echo a
+        b = echo b
+        empty =
+
+        [maintenance-hooks]
+        a.parallel = true
+        a.after = b c
+        a.timeout = 10
+        """
+    )
+    hooks = load_hooks(config, "maintenance-enter")
+    assert hooks == [
+        MaintenanceHook("a", "echo a", True, {"b", "c"}, 10.0),
+        MaintenanceHook("b", "echo b"),
+    ]
+    assert load_hooks(config, "maintenance-leave") == []
+
+
+def test_parallel_hooks_run_concurrently(logger):
+    hooks = [
+        MaintenanceHook(name, "sleep 0.5", parallel=True)
+        for name in ("a", "b", "c")
+    ]
+    started = time.monotonic()
+    results = run_hooks(hooks, logger)
+    assert time.monotonic() - started < 1.2
+    assert [r.name for r in results] == ["a", "b", "c"]
+    assert all(r.returncode == 0 for r in results)
+
+
+def test_serial_and_dependent_hooks_keep_order(tmp_path, logger):
+    out = tmp_path / "out"
+    hooks = [
+        MaintenanceHook("a", f"sleep 0.2; echo a >> {out}", parallel=True),
+        MaintenanceHook("b", f"echo b >> {out}", parallel=True, after={"c"}),
+        MaintenanceHook("c", f"sleep 0.1; echo c >> {out}", parallel=True),
+        MaintenanceHook("d", f"echo d >> {out}"),
+    ]
+    run_hooks(hooks, logger)
+    lines = out.read_text().split()
+    assert lines.index("c") < lines.index("b")
+    assert lines[-1] == "d"
+
+
+def test_dependency_cycle_runs_hooks_serially(tmp_path, log, logger):
+    out = tmp_path / "out"
+    hooks = [
+        MaintenanceHook("a", f"echo a >> {out}", parallel=True, after={"b"}),
+        MaintenanceHook("b", f"echo b >> {out}", parallel=True, after={"a"}),
+    ]
+    run_hooks(hooks, logger)
+    assert out.read_text().split() == ["a", "b"]
+    assert log.has("maintenance-hook-dependency-cycle")
+
+
+def test_stop_on_doesnt_start_more_hooks(logger):
+    hooks = [
+        MaintenanceHook("fail", "exit 1"),
+        MaintenanceHook("never", "echo never"),
+    ]
+    results = run_hooks(hooks, logger, stop_on=lambda r: r.returncode != 0)
+    assert [r.name for r in results] == ["fail"]
+
+
+def test_timeout_kills_hook(logger):
+    hooks = [MaintenanceHook("slow", "sleep 10", timeout=0.2)]
+    started = time.monotonic()
+    (result,) = run_hooks(hooks, logger)
+    assert time.monotonic() - started < 5
+    assert result.timed_out
+    assert result.returncode != 0
+
+
+@pytest.fixture
+def enter_hooks(reqmanager, monkeypatch):
+    monkeypatch.setattr("fc.util.directory.connect", MagicMock())
+    reqmanager.config.remove_section("maintenance-enter")
+    reqmanager.config.add_section("maintenance-enter")
+    reqmanager.config.add_section("maintenance-hooks")
+
+    def _enter_hooks(**hooks):
+        for name, command in hooks.items():
+            reqmanager.config["maintenance-enter"][name] = command
+            reqmanager.config["maintenance-hooks"][f"{name}.parallel"] = "true"
+        reqmanager._enter_maintenance()
+
+    return _enter_hooks
+
+
+def test_enter_maintenance_parallel_postpone_wins(enter_hooks):
+    with pytest.raises(PostponeMaintenance):
+        enter_hooks(tempfail="exit 75", postpone="exit 69", ok="true")
+
+
+def test_enter_maintenance_timeout_is_tempfail(enter_hooks, reqmanager, log):
+    reqmanager.config["maintenance-hooks"]["slow.timeout"] = "0.2"
+    with pytest.raises(TempfailMaintenance):
+        enter_hooks(slow="sleep 10")
+    assert log.has("enter-maintenance-timeout", subsystem="slow")
+
+
+def test_enter_maintenance_error_wins(enter_hooks):
+    with pytest.raises(subprocess.CalledProcessError):
+        enter_hooks(postpone="exit 69", error="exit 1")
+
+
+def test_leave_maintenance_error(log, reqmanager, monkeypatch):
+    monkeypatch.setattr("fc.util.directory.connect", MagicMock())
+    reqmanager.config["maintenance-leave"]["broken"] = "exit 2"
+    with pytest.raises(subprocess.CalledProcessError):
+        reqmanager._leave_maintenance()
@@ -0,0 +1,99 @@
+import os
+import time
+from unittest.mock import Mock
+
+import pytest
+from fc.maintenance.activity import Activity, RebootType
+from fc.maintenance.activity.reboot import RebootActivity
+from fc.maintenance.activity.vm_change import VMChangeActivity
+from fc.maintenance.lib.shellscript import ShellScriptActivity
+from fc.maintenance.planner import execute_phases, plan_phases, reboot_decision
+from fc.maintenance.request import Request
+from fc.maintenance.state import State
+
+
+class RebootingActivity(Activity):
+    parallel_safe = True
+
+    def __init__(self, reboot_needed):
+        super().__init__()
+        self.reboot_needed = reboot_needed
+
+
+def test_plan_phases_groups_consecutive_parallel_safe_requests():
+    update = Request(Activity())
+    vm_change = Request(VMChangeActivity(wanted_memory=1024))
+    reboot = Request(RebootActivity())
+    script = Request(ShellScriptActivity("true"))
+    safe_script = Request(ShellScriptActivity("true", parallel_safe=True))
+
+    phases = plan_phases([update, vm_change, reboot, script, safe_script])
+
+    assert [(p.requests, p.parallel) for p in phases] == [
+        ([update], False),
+        ([vm_change, reboot], True),
+        ([script], False),
+        ([safe_script], False),
+    ]
+
+
+def test_reboot_decision():
+    def req(reboot_needed, state=State.success):
+        activity = Activity()
+        activity.reboot_needed = reboot_needed
+        request = Request(activity)
+        request.state = state
+        return request
+
+    assert reboot_decision([req(None)]) is None
+    assert reboot_decision([req(None), req(RebootType.WARM)]) == (
+        RebootType.WARM
+    )
+    assert (
+        reboot_decision(
+            [req(RebootType.WARM), req(RebootType.COLD), req(None)]
+        )
+        == RebootType.COLD
+    )
+    assert reboot_decision([req(RebootType.COLD, State.error)]) is None
+
+
+def test_execute_phases_runs_parallel_safe_scripts_concurrently(
+    reqmanager, log
+):
+    requests = [
+        reqmanager.add(
+            Request(ShellScriptActivity("sleep 0.5", parallel_safe=True), 1)
+        )
+        for _ in range(3)
+    ]
+    cwd = os.getcwd()
+    started = time.monotonic()
+    execute_phases(plan_phases(requests), reqmanager.log)
+    assert time.monotonic() - started < 1.4
+    assert all(req.state == State.success for req in requests)
+    assert all(os.path.exists(os.path.join(r.dir, "script")) for r in requests)
+    assert os.getcwd() == cwd
+
+
+def test_execute_reboots_once_for_multiple_requests(
+    reqmanager, log, monkeypatch
+):
+    monkeypatch.setattr("time.sleep", Mock())
+    monkeypatch.setattr("subprocess.run", run := Mock())
+    reqmanager._enter_maintenance = Mock()
+    reqmanager._leave_maintenance = Mock()
+
+    requests = [
+        reqmanager.add(Request(RebootingActivity(reboot), 1))
+        for reboot in (RebootType.WARM, None, RebootType.COLD)
+    ]
+    reqmanager._runnable = lambda run_all_now, force_run: requests
+
+    with pytest.raises(SystemExit):
+        reqmanager.execute()
+
+    assert all(req.state == State.success for req in requests)
+    run.assert_called_once()
+    assert run.call_args.args[0] == "poweroff"
+    assert log.has("execute-phase", parallel=True)
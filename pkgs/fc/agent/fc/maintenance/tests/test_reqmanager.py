@@ -66,8 +66,8 @@ def test_lockfile(reqmanager):
 def test_req_save(request_population):
     with request_population(1) as (rm, requests):
         req = requests[0]
-        assert p.isfile(p.join(req.dir, "request.yaml"))
-        print(open(p.join(req.dir, "request.yaml")).read())
+        assert p.isfile(p.join(req.dir, "request.json"))
+        print(open(p.join(req.dir, "request.json")).read())
 
 
 class FunnyActivity(Activity):
@@ -86,6 +86,44 @@ def test_scan(request_population):
         assert set(rm.requests.values()) == set(requests)
 
 
+def test_update_states_does_not_write_unchanged_requests(
+    request_population, monkeypatch
+):
+    with request_population(2) as (rm, requests):
+        pass
+
+    with rm:
+        monkeypatch.setattr("os.fsync", fsync := Mock())
+        monkeypatch.setattr(
+            "fc.maintenance.request.Request.prepare_save",
+            prepare_save := Mock(),
+        )
+        rm.update_states()
+
+    fsync.assert_not_called()
+    prepare_save.assert_not_called()
+
+
+def test_commit_syncs_only_changed_requests(request_population, monkeypatch):
+    with request_population(3) as (rm, requests):
+        pass
+
+    with rm:
+        monkeypatch.setattr("os.sync", sync := Mock())
+        monkeypatch.setattr("os.fsync", fsync := Mock())
+        rm.requests[requests[0].id].state = State.postpone
+        rm.requests[requests[1].id].state = State.due
+
+    sync.assert_not_called()
+    # Two request files, their directories and the requests directory.
+    assert fsync.call_count == 5
+
+    with rm:
+        assert rm.requests[requests[0].id].state == State.postpone
+        assert rm.requests[requests[1].id].state == State.due
+        assert rm.requests[requests[2].id].state == State.pending
+
+
 def test_scan_invalid(reqmanager):
     os.makedirs(str(reqmanager.requestsdir / "emptydir"))
     open(str(reqmanager.requestsdir / "foo"), "w").close()
@@ -153,6 +191,10 @@ def test_add_should_remove_no_op_request(reqmanager):
         assert rm.add(first_request) is first_request
         assert rm.add(second_request) is None
         assert len(rm.requests) == 1
+        # Prepared resources of both requests are not needed anymore.
+        assert second_activity.released
+        rm.archive()
+        assert first_activity.released
 
 
 def test_add_do_not_merge_incompatible_request(reqmanager):
@@ -327,13 +369,23 @@ def test_execute_activity_no_reboot(reqmanager, log):
 
 def test_execute_activity_with_reboot(reqmanager, log, monkeypatch):
     monkeypatch.setattr("time.sleep", sleep := Mock())
-    monkeypatch.setattr("subprocess.run", run := Mock())
+    unsaved_at_reboot = []
+
+    def fake_run(*args, **kwargs):
+        unsaved_at_reboot.extend(
+            r.id for r in reqmanager.requests.values() if r.dirty
+        )
+
+    monkeypatch.setattr("subprocess.run", run := Mock(side_effect=fake_run))
     reqmanager._enter_maintenance = Mock()
     reqmanager._leave_maintenance = Mock()
 
     activity = Activity()
     activity.reboot_needed = RebootType.WARM
     req = reqmanager.add(Request(activity, 1))
+    # Changed by an earlier step, like update_states, but not executed.
+    other = reqmanager.add(Request(Activity(), 1))
+    other._comment = "changed"
     reqmanager._runnable = lambda run_all_now, force_run: [req]
 
     with pytest.raises(SystemExit) as e:
@@ -345,11 +397,29 @@ def test_execute_activity_with_reboot(reqmanager, log, monkeypatch):
 
     sleep.assert_called_once_with(5)
     run.assert_called_once()
+    # Request state must be on disk before rebooting.
+    assert unsaved_at_reboot == []
     # Should stay in maintenance mode during the reboot.
     reqmanager._leave_maintenance.assert_not_called()
     assert log.has("maintenance-reboot")
 
 
+@unittest.mock.patch("subprocess.run")
+@unittest.mock.patch("time.sleep")
+def test_reboot_flushes_logs_first(sleep, run, reqmanager, monkeypatch):
+    flush = unittest.mock.Mock()
+    monkeypatch.setattr("fc.maintenance.reqmanager.flush_buffered_logs", flush)
+    flushed_at_reboot = []
+    run.side_effect = lambda *args, **kw: flushed_at_reboot.append(
+        flush.called
+    )
+
+    with pytest.raises(SystemExit):
+        reqmanager._reboot_and_exit({RebootType.WARM})
+
+    assert flushed_at_reboot == [True]
+
+
 @unittest.mock.patch("subprocess.run")
 @unittest.mock.patch("time.sleep")
 def test_reboot_cold_reboot_has_precedence(sleep, run, reqmanager, log):
@@ -373,14 +443,6 @@ class PostponeActivity(Activity):
 @freezegun.freeze_time("2016-04-20 12:00:00")
 @unittest.mock.patch("fc.util.directory.connect")
 def test_schedule_run_end_to_end(connect, request_population):
-    import yaml
-    from freezegun.api import FakeDatetime
-
-    def yaml_represent_fake_datetime(dumper, data):
-        return dumper.represent_datetime(data)
-
-    yaml.add_representer(FakeDatetime, yaml_represent_fake_datetime)
-
     with request_population(3) as (rm, reqs):
         # 0: due, exec, archive
         # 1: due, exec, postpone
@@ -584,6 +646,25 @@ def test_delete(request_population):
         assert req.state == State.deleted
 
 
+@unittest.mock.patch("fc.util.directory.connect")
+def test_archive_releases_deleted_request(connect, reqmanager):
+    activity = MergeableActivity()
+    with reqmanager as rm:
+        req = rm.add(Request(activity))
+        rm.delete(req.id)
+        assert not hasattr(activity, "released")
+        rm.archive()
+    assert activity.released
+
+
+def test_add_releases_ineffective_request(reqmanager):
+    activity = MergeableActivity()
+    activity.is_effective = False
+    with reqmanager as rm:
+        assert rm.add(Request(activity)) is None
+    assert activity.released
+
+
 def test_list_empty(reqmanager):
     console = Console(file=StringIO())
     console.print(reqmanager.__rich__())
@@ -1,5 +1,7 @@
 import configparser
 import datetime
+import json
+import os
 import unittest.mock
 from io import StringIO
 from unittest.mock import MagicMock
@@ -11,6 +13,7 @@ import structlog
 from fc.maintenance.activity import Activity, RebootType
 from fc.maintenance.estimate import Estimate
 from fc.maintenance.request import Attempt, Request, RequestMergeResult
+from fc.maintenance.serialization import SerializationError
 from fc.maintenance.state import ARCHIVE, EXIT_TEMPFAIL, State
 from fc.maintenance.tests import MergeableActivity
 from rich.console import Console
@@ -90,22 +93,65 @@ def test_duration_from_activity_duration(tmpdir):
     assert r.duration == 90
 
 
-def test_save_yaml(tmp_path):
+def test_save_json(tmp_path):
     r = Request(Activity(), 10, "my comment", dir=str(tmp_path))
     assert r.id is not None
     r.save()
-    saved_yaml = (tmp_path / "request.yaml").read_text()
+    saved_json = (tmp_path / "request.json").read_text()
     expected = f"""\
+{{
+  "activity": {{
+    "state": {{}},
+    "type": "fc.maintenance.activity.Activity"
+  }},
+  "added_at": null,
+  "attempts": [],
+  "comment": "my comment",
+  "estimate": 10.0,
+  "id": "{r.id}",
+  "last_scheduled_at": null,
+  "next_due": null,
+  "state": "-",
+  "updated_at": null,
+  "version": 1
+}}
+"""
+
+    assert saved_json == expected
+
+
+def test_save_load_roundtrip(tmp_path, agent_configparser, logger):
+    activity = Activity()
+    activity.reboot_needed = RebootType.COLD
+    r = Request(activity, "5m", "comment", dir=tmp_path)
+    r.state = State.due
+    r.added_at = datetime.datetime(2016, 4, 20, 11, tzinfo=pytz.UTC)
+    r.next_due = datetime.datetime(2016, 4, 20, 12, tzinfo=pytz.UTC)
+    attempt = Attempt()
+    attempt.returncode = 75
+    attempt.duration = 1.5
+    attempt.stdout = "out"
+    r.attempts.append(attempt)
+    r.save()
+
+    loaded = Request.load(tmp_path, agent_configparser, logger)
+    assert loaded.to_dict() == r.to_dict()
+    assert loaded.activity.reboot_needed is RebootType.COLD
+    assert loaded.attempts[0].started == attempt.started
+    assert loaded.activity.request is loaded
+
+
+LEGACY_SERIALIZED_REQUEST = """\
 !!python/object:fc.maintenance.request.Request
 _comment: my comment
 _estimate: !!python/object:fc.maintenance.estimate.Estimate
   value: 10.0
-_reqid: {r.id}
+_reqid: legacy
 _reqmanager: null
-activity: !!python/object:fc.maintenance.activity.Activity {{}}
-added_at: null
+activity: !!python/object:fc.maintenance.activity.Activity {}
+added_at: 2016-04-20 11:00:00+00:00
 attempts: []
-dir: {tmp_path}
+dir: /var/spool/maintenance/requests/legacy
 last_scheduled_at: null
 next_due: null
 state: !!python/object/apply:fc.maintenance.state.State
@@ -113,7 +159,30 @@ state: !!python/object/apply:fc.maintenance.state.State
 updated_at: null
 """
 
-    assert saved_yaml == expected
+
+def test_load_legacy_yaml_and_migrate(tmp_path, agent_configparser, logger):
+    (tmp_path / "request.yaml").write_text(LEGACY_SERIALIZED_REQUEST)
+    r = Request.load(tmp_path, agent_configparser, logger)
+    assert r.id == "legacy"
+    assert r.comment == "my comment"
+    assert r.dirty, "legacy requests should be migrated on the next save"
+
+    assert r.save()
+    assert not (tmp_path / "request.yaml").exists()
+    migrated = Request.load(tmp_path, agent_configparser, logger)
+    assert migrated.to_dict() == r.to_dict()
+    assert not migrated.dirty
+
+
+def test_load_unknown_activity_type_fails(
+    tmp_path, agent_configparser, logger
+):
+    r = Request(Activity(), dir=tmp_path)
+    data = r.to_dict()
+    data["activity"]["type"] = "os.system"
+    (tmp_path / "request.json").write_text(json.dumps(data))
+    with pytest.raises(SerializationError):
+        Request.load(tmp_path, agent_configparser, logger)
 
 
 class TempfailActivity(Activity):
@@ -150,18 +219,24 @@ def test_execute_catches_errors(tmpdir):
 
 
 class ExternalStateActivity(Activity):
-    def load(self):
-        with open("external_state") as f:
+    def load(self, request_dir):
+        with open(os.path.join(request_dir, "external_state")) as f:
             self.external = f.read()
 
-    def dump(self):
-        with open("external_state", "w") as f:
+    def dump(self, request_dir):
+        with open(os.path.join(request_dir, "external_state"), "w") as f:
             print("foo", file=f)
 
 
-def test_external_activity_state(tmpdir, agent_configparser, logger):
+def test_external_activity_state(
+    tmpdir, monkeypatch, agent_configparser, logger
+):
+    # External state must not depend on the current directory.
+    elsewhere = tmpdir.mkdir("elsewhere")
+    monkeypatch.chdir(elsewhere)
     r = Request(ExternalStateActivity(), 1, dir=str(tmpdir))
     r.save()
+    assert not (elsewhere / "external_state").exists()
     extstate = str(tmpdir / "external_state")
     with open(extstate) as f:
         assert "foo\n" == f.read()
@@ -277,3 +352,28 @@ def test_merge_missing_comment_and_estimate_on_original_request(monkeypatch):
     r.merge(other)
     assert r._comment == "Other request"
     assert r._estimate == other.estimate
+
+
+def test_dirty_tracking(tmp_path, agent_configparser, logger):
+    r = Request(Activity(), 1, dir=tmp_path)
+    assert r.dirty
+    assert r.save()
+    assert not r.dirty
+    assert not r.save()
+
+    r.state = State.due
+    assert r.dirty
+    assert r.save()
+
+    loaded = Request.load(tmp_path, agent_configparser, logger)
+    assert not loaded.dirty
+    loaded.attempts.append(Attempt())
+    assert loaded.dirty
+
+
+def test_save_force_writes_unchanged_request(tmp_path):
+    r = Request(Activity(), 1, dir=tmp_path)
+    r.save()
+    (tmp_path / "request.json").unlink()
+    assert r.save(force=True)
+    assert (tmp_path / "request.json").exists()
@@ -0,0 +1,82 @@
+import datetime
+
+import pytest
+import pytz
+from fc.maintenance.activity import Activity, RebootType
+from fc.maintenance.activity.reboot import RebootActivity
+from fc.maintenance.activity.vm_change import VMChangeActivity
+from fc.maintenance.estimate import Estimate
+from fc.maintenance.serialization import (
+    SerializationError,
+    decode,
+    dump_activity,
+    encode,
+    load_activity,
+)
+from fc.maintenance.state import State
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        None,
+        True,
+        1,
+        1.5,
+        "text",
+        ["a", 1],
+        {"start": ["a.service"], "stop": []},
+        {"nested": {"estimate": Estimate("5m")}},
+        datetime.datetime(2016, 4, 20, 11, tzinfo=pytz.UTC),
+        datetime.timedelta(seconds=75),
+        RebootType.COLD,
+        State.due,
+        {"a", "b"},
+    ],
+)
+def test_encode_decode_roundtrip(value):
+    assert decode(encode(value)) == value
+
+
+def test_encode_keeps_enum_type():
+    assert decode(encode(RebootType.WARM)) is RebootType.WARM
+
+
+def test_encode_unsupported_value_fails():
+    with pytest.raises(SerializationError):
+        encode(object())
+
+
+def test_decode_unknown_tag_fails():
+    with pytest.raises(SerializationError):
+        decode({"$type": "object", "value": "os.system"})
+
+
+def test_reboot_activity_roundtrip():
+    activity = RebootActivity(RebootType.COLD)
+    loaded = load_activity(dump_activity(activity))
+    assert type(loaded) is RebootActivity
+    assert loaded.reboot_needed is RebootType.COLD
+    assert loaded.__getstate__() == activity.__getstate__()
+
+
+def test_vm_change_activity_roundtrip():
+    activity = VMChangeActivity(wanted_memory=4096, wanted_cores=2)
+    loaded = load_activity(dump_activity(activity))
+    assert type(loaded) is VMChangeActivity
+    assert loaded.estimate == Estimate("5m")
+    assert loaded.__getstate__() == activity.__getstate__()
+
+
+def test_load_activity_unknown_type_fails():
+    with pytest.raises(SerializationError):
+        load_activity({"type": "builtins.object", "state": {}})
+
+
+def test_activity_subclasses_are_registered():
+    class CustomActivity(Activity):
+        pass
+
+    data = dump_activity(CustomActivity())
+    assert data["type"].endswith("CustomActivity")
+    assert type(load_activity(data)) is CustomActivity
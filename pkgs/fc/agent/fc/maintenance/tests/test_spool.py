@@ -0,0 +1,112 @@
+import shutil
+import unittest.mock
+
+from fc.maintenance.activity import Activity
+from fc.maintenance.request import Request
+from fc.maintenance.spool import SpoolIndex
+from fc.maintenance.state import State
+
+
+def test_scan_restores_unchanged_requests_from_index(request_population):
+    with request_population(3) as (rm, requests):
+        pass
+
+    with rm:
+        assert rm.index.hits == 3
+        assert rm.index.misses == 0
+        assert set(rm.requests.values()) == set(requests)
+        assert all(r.config is rm.config for r in rm.requests.values())
+        assert all(r._reqmanager is rm for r in rm.requests.values())
+
+
+def test_index_hits_dont_open_request_files(request_population, monkeypatch):
+    with request_population(2) as (rm, requests):
+        pass
+
+    opened = []
+    real_open = open
+
+    def recording_open(file, *args, **kwargs):
+        opened.append(str(file))
+        return real_open(file, *args, **kwargs)
+
+    monkeypatch.setattr("builtins.open", recording_open)
+    with rm:
+        assert rm.index.hits == 2
+        assert not any(r.dirty for r in rm.requests.values())
+
+    assert not [f for f in opened if f.endswith("request.json")]
+
+
+def test_scan_parses_changed_requests(request_population, logger):
+    with request_population(2) as (rm, requests):
+        pass
+
+    # Change a request behind the back of the ReqManager.
+    changed = Request.load(requests[0].dir, rm.config, logger)
+    changed._comment = "changed"
+    changed.save()
+
+    with rm:
+        assert rm.index.hits == 1
+        assert rm.index.misses == 1
+        assert rm.requests[requests[0].id].comment == "changed"
+
+    with rm:
+        assert rm.index.hits == 2
+        assert rm.requests[requests[0].id].comment == "changed"
+
+
+def test_scan_prunes_removed_requests(request_population):
+    with request_population(2) as (rm, requests):
+        pass
+
+    shutil.rmtree(requests[0].dir)
+
+    with rm:
+        rows = rm.index.conn.execute("SELECT path FROM requests").fetchall()
+        assert rows == [(f"requests/{requests[1].id}",)]
+
+
+def test_non_invasive_methods_use_index_read_only(request_population):
+    with request_population(1) as (rm, requests):
+        pass
+
+    index = SpoolIndex.open(rm.spooldir)
+    assert not index.writable
+    index.put(requests[0].dir, (0, 0, 0), Request(Activity()).serialize())
+    assert index.conn.execute("SELECT count(*) FROM requests").fetchone() == (
+        1,
+    )
+    index.close()
+
+    assert rm._active_requests() == requests
+
+
+@unittest.mock.patch("fc.util.directory.connect")
+def test_archived_requests_are_indexed(connect, request_population):
+    with request_population(1) as (rm, requests):
+        requests[0].state = State.success
+        rm.archive()
+
+    index = SpoolIndex.open(rm.spooldir)
+    rm.index = index
+    assert rm._archived_requests() == requests
+    assert index.hits == 1
+    index.close()
+    rm.index = None
+
+
+def test_broken_index_is_rebuilt(request_population):
+    with request_population(1) as (rm, requests):
+        pass
+
+    (rm.spooldir / "index.sqlite").write_text("garbage")
+    assert SpoolIndex.open(rm.spooldir) is None
+
+    with rm:
+        assert rm.index.misses == 1
+        assert set(rm.requests.values()) == set(requests)
+
+    with rm:
+        assert rm.index.hits == 1
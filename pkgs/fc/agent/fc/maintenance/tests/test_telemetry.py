@@ -0,0 +1,175 @@
+import datetime
+import os
+import time
+import unittest.mock
+
+import pytest
+from fc.maintenance.activity import Activity
+from fc.maintenance.estimate import Estimate
+from fc.maintenance.reqmanager import ReqManager
+from fc.maintenance.request import Attempt, Request
+from fc.maintenance.state import EXIT_TEMPFAIL, State
+from fc.maintenance.telemetry import RequestStats
+
+NOW = datetime.datetime(2026, 1, 1, 12, tzinfo=datetime.timezone.utc)
+
+
+def make_request(state, added_minutes_ago=0, returncodes=()):
+    req = Request(Activity(), estimate=600)
+    req.state = state
+    req.added_at = NOW - datetime.timedelta(minutes=added_minutes_ago)
+    for returncode in returncodes:
+        attempt = Attempt()
+        attempt.returncode = returncode
+        req.attempts.append(attempt)
+    return req
+
+
+def test_request_stats_to_metrics():
+    due = make_request(State.due, added_minutes_ago=60, returncodes=[None])
+    due.next_due = NOW - datetime.timedelta(minutes=1)
+    pending = make_request(State.pending, returncodes=[EXIT_TEMPFAIL, 1])
+
+    stats = RequestStats.from_requests([due, pending])
+    metrics = stats.to_metrics(NOW)
+
+    assert metrics["requests_total"] == 2
+    assert metrics["requests_runnable"] == 1
+    assert metrics["requests_pending"] == 1
+    assert metrics["requests_error"] == 1
+    assert metrics["requests_tempfail"] == 0
+    assert metrics["requests_scheduled"] == 1
+    assert metrics["requests_waiting_for_schedule"] == 1
+    assert metrics["requests_estimate_seconds"] == 1200
+    assert metrics["request_highest_retry_count"] == 2
+    assert metrics["request_longest_in_queue_duration"] == 3600
+    assert metrics["request_next_due_at"] == due.next_due.timestamp()
+
+
+def test_request_stats_empty():
+    metrics = RequestStats().to_metrics(NOW)
+    assert metrics["requests_total"] == 0
+    assert metrics["request_longest_in_queue_duration"] == 0
+    assert metrics["request_next_due_at"] == 0
+
+
+def test_request_stats_save_load(tmp_path):
+    path = tmp_path / "snapshot.json"
+    stats = RequestStats.from_requests([make_request(State.running)])
+    stats.requests_dir_mtime_ns = 42
+    stats.save(path)
+
+    assert RequestStats.load(path, 42) == stats
+    assert RequestStats.load(path, 43) is None
+    assert RequestStats.load(tmp_path / "missing.json", 42) is None
+    path.write_text("{broken")
+    assert RequestStats.load(path, 42) is None
+
+
+def test_get_metrics_uses_snapshot(request_population):
+    with request_population(3) as (rm, requests):
+        requests[0].state = State.due
+
+    assert rm.metrics_snapshot_path.exists()
+    with unittest.mock.patch.object(rm, "_active_requests") as active:
+        metrics = rm.get_metrics()
+        active.assert_not_called()
+
+    assert metrics["requests_total"] == 3
+    assert metrics["requests_runnable"] == 1
+    assert metrics["requests_pending"] == 2
+
+
+def test_snapshot_is_written_once_per_commit(request_population):
+    with request_population(3) as (rm, requests):
+        pass
+
+    with unittest.mock.patch.object(RequestStats, "save") as save:
+        with rm:
+            for req in rm.requests.values():
+                req._comment = "changed"
+                # Saves without state changes wait for the commit.
+                req.save()
+                req.state = State.due
+            save.assert_not_called()
+
+    save.assert_called_once()
+
+
+def test_snapshot_is_updated_when_request_starts_running(
+    request_population, agent_maintenance_config, logger
+):
+    with request_population(2) as (rm, requests):
+        pass
+
+    with rm:
+        req = rm.requests[requests[0].id]
+        req.state = State.running
+        req.attempts.append(Attempt())
+        # Like a request saving itself when execution starts.
+        req.save()
+
+        # Metrics are read by another process while maintenance runs.
+        other = ReqManager(
+            spooldir=rm.spooldir,
+            enc_path=rm.enc_path,
+            config_file=agent_maintenance_config,
+            log=logger,
+        )
+        with unittest.mock.patch.object(other, "_active_requests") as active:
+            metrics = other.get_metrics()
+            active.assert_not_called()
+
+        assert metrics["requests_running"] == 1
+        assert metrics["requests_pending"] == 1
+
+
+def test_get_metrics_recomputes_outdated_snapshot(request_population):
+    with request_population(2) as (rm, requests):
+        pass
+
+    # A request has been removed without using the ReqManager.
+    os.rename(requests[0].dir, rm.archivedir / requests[0].id)
+    os.utime(rm.requestsdir, ns=(0, 0))
+
+    metrics = rm.get_metrics()
+    assert metrics["requests_total"] == 1
+
+
+def test_snapshot_is_updated_on_add(request_population):
+    with request_population(1) as (rm, requests):
+        rm.add(Request(Activity(), estimate=Estimate("10m")))
+
+    assert rm.get_metrics()["requests_total"] == 2
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("count", [10, 100, 1000])
+def test_benchmark_get_metrics(count, reqmanager):
+    rm = reqmanager
+    for i in range(count):
+        for dest in (rm.requestsdir, rm.archivedir):
+            req = Request(Activity(), comment=str(i))
+            req.dir = str(dest / req.id)
+            os.mkdir(req.dir)
+            req.finish_save(req.prepare_save(sync=False))
+    rm.scan()
+
+    def measure(fn, rounds=10):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            fn()
+        return (time.perf_counter() - started) / rounds
+
+    snapshot = measure(rm.get_metrics)
+    full = measure(
+        lambda: RequestStats.from_requests(rm._active_requests()).to_metrics(
+            NOW
+        )
+    )
+    print(
+        f"\n{count} active + {count} archived requests: "
+        f"snapshot {snapshot * 1000:.2f} ms, "
+        f"full scan {full * 1000:.2f} ms"
+    )
+    assert rm.get_metrics()["requests_total"] == count
@@ -64,7 +64,7 @@ def dry_activate(
     Does not affect the running system.
     """
     fc.util.logging.init_logging(
-        context.verbose, context.logdir, log_cmd_output=True
+        context.verbose, context.logdir, log_cmd_output=True, buffered=True
     )
     log = structlog.get_logger()
     unit_changes = fc.manage.manage.dry_activate(
@@ -114,14 +114,14 @@ def switch_cmd(
 ):
     """Builds the system configuration and switches to it."""
     fc.util.logging.init_logging(
-        context.verbose, context.logdir, log_cmd_output=True
+        context.verbose, context.logdir, log_cmd_output=True, buffered=True
     )
     log = structlog.get_logger()
     log.info(
         "fc-manage-start", _replace_msg="fc-manage started with PID: {pid}"
     )
 
-    with locked(log, context.lock_dir):
+    with locked(log, context.lock_dir, purpose="fc-manage switch"):
         if update_enc_data:
             fc.util.enc.update_enc(log, context.tmpdir, context.enc_path)
 
@@ -166,7 +166,7 @@ def update_enc_cmd():
         "fc-manage-start", _replace_msg="fc-manage started with PID: {pid}"
     )
 
-    with locked(log, context.lock_dir):
+    with locked(log, context.lock_dir, purpose="fc-manage update-enc"):
         fc.util.enc.update_enc(log, context.tmpdir, context.enc_path)
 
     log.info("fc-manage-succeeded")
@@ -265,7 +265,10 @@ def fc_manage(
 
     # legacy call
     fc.util.logging.init_logging(
-        verbose, logdir, log_cmd_output=switch or switch_with_update
+        verbose,
+        logdir,
+        log_cmd_output=switch or switch_with_update,
+        buffered=True,
     )
     log = structlog.get_logger()
 
@@ -275,7 +278,7 @@ def fc_manage(
         legacy_call=True,
     )
 
-    with locked(log, lock_dir):
+    with locked(log, lock_dir, purpose="fc-manage"):
         if update_enc_data:
             fc.util.enc.update_enc(log, tmpdir, enc_path)
 
@@ -1,13 +1,18 @@
 import datetime
+import functools
 import os
 import pwd
 import subprocess
+import time
+from enum import Enum
 from pathlib import Path
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
 
 import fc.util.lock
 import structlog
+from fc.manage.userscan_journal import UserscanJournal
 from fc.util.logging import init_logging
+from fc.util.subprocess_helper import poll_with_rusage
 from typer import Exit, Option, Typer
 
 app = Typer()
@@ -24,8 +29,174 @@ This runs in two phases:
 
 If something goes wrong in step 1, garbage collection will not run to protect
 Nix store paths that may be still referenced from home dirs.
+
+With --incremental, users are skipped if no directory in their home has
+changed since their last successful scan. Files changed in place are not
+noticed, so users are scanned anyway every --full-scan-interval days.
 """
 
+# Interval for checking running fc-userscan processes.
+POLL_INTERVAL = 0.5
+
+# fc-userscan registers GC roots below <GC_ROOTS_DIR>/<user name>.
+GC_ROOTS_DIR = Path("/nix/var/nix/gcroots/per-user")
+
+
+class IOClass(str, Enum):
+    idle = "idle"
+    best_effort = "best-effort"
+    inherit = "inherit"
+
+
+IONICE = {
+    IOClass.idle: ["ionice", "--class", "idle"],
+    IOClass.best_effort: [
+        "ionice",
+        "--class",
+        "best-effort",
+        "--classdata",
+        "7",
+    ],
+    IOClass.inherit: [],
+}
+
+
+class UserscanResult(NamedTuple):
+    name: str
+    returncode: int
+    duration: float
+    timed_out: bool = False
+    # Read from block devices, not from the page cache.
+    read_bytes: int = 0
+
+
+def userscan_command(user, exclude_file, io_class: IOClass) -> list:
+    return IONICE[io_class] + [
+        "fc-userscan",
+        "--register",
+        "--cache",
+        user.pw_dir + "/.cache/fc-userscan.cache",
+        "--cache-limit",
+        "10000000",
+        "--unzip=*.egg",
+        "--excludefrom",
+        exclude_file,
+        user.pw_dir,
+    ]
+
+
+def count_gc_roots(user_name) -> int:
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(GC_ROOTS_DIR / user_name):
+        # Symlinks to directories show up in dirnames.
+        for name in dirnames + filenames:
+            if os.path.islink(os.path.join(dirpath, name)):
+                count += 1
+    return count
+
+
+def scan_users(
+    log,
+    users,
+    exclude_file,
+    jobs: int = 1,
+    timeout: Optional[float] = None,
+    io_class: IOClass = IOClass.inherit,
+) -> list[UserscanResult]:
+    """Runs fc-userscan for the users, at most `jobs` at the same time.
+    Scans running longer than `timeout` seconds are killed.
+
+    All processes are started and polled from the calling thread because
+    switching the real UID needs a preexec_fn which isn't safe to use with
+    threads.
+    """
+    pending = list(users)
+    running = {}
+    results = []
+
+    while pending or running:
+        while pending and len(running) < jobs:
+            user = pending.pop(0)
+            log.debug(
+                "userscan-user",
+                _replace_msg="Scanning {homedir} as {name}",
+                homedir=user.pw_dir,
+                name=user.pw_name,
+            )
+            proc = subprocess.Popen(
+                userscan_command(user, exclude_file, io_class),
+                stdin=subprocess.DEVNULL,
+                preexec_fn=functools.partial(os.setresuid, user.pw_uid, 0, 0),
+            )
+            running[proc] = (user, time.monotonic())
+
+        for proc, (user, started) in list(running.items()):
+            duration = time.monotonic() - started
+            rc, rusage = poll_with_rusage(proc)
+            timed_out = False
+            if rc is None:
+                if not timeout or duration < timeout:
+                    continue
+                proc.kill()
+                rc = proc.wait()
+                timed_out = True
+                log.error(
+                    "userscan-timeout",
+                    _replace_msg=(
+                        "Scanning {homedir} took longer than {timeout}s, "
+                        "killed fc-userscan."
+                    ),
+                    homedir=user.pw_dir,
+                    name=user.pw_name,
+                    timeout=timeout,
+                )
+            del running[proc]
+            # ru_inblock is counted in 512 byte blocks.
+            read_bytes = rusage.ru_inblock * 512 if rusage else 0
+            log.debug(
+                "userscan-result",
+                name=user.pw_name,
+                rc=rc,
+                duration=round(duration, 1),
+                read_bytes=read_bytes,
+            )
+            results.append(
+                UserscanResult(
+                    user.pw_name, rc, duration, timed_out, read_bytes
+                )
+            )
+
+        if running:
+            time.sleep(POLL_INTERVAL)
+
+    return results
+
+
+def plan_incremental_scans(log, users, state_dir, full_scan_interval):
+    """Decides which users have to be scanned.
+
+    Returns the journals and scan plans by user name for users which have to
+    be scanned. Users without changes since their last scan are left out.
+    """
+    journals = {}
+    plans = {}
+    for user in users:
+        journal = UserscanJournal(state_dir, user.pw_name, full_scan_interval)
+        plan = journal.plan(user.pw_dir)
+        log.debug(
+            "userscan-plan",
+            name=user.pw_name,
+            full=plan.full,
+            skip=plan.skip,
+        )
+        if plan.skip:
+            # Nothing changed, but the next scan must still look at changes
+            # since the last one that actually ran.
+            continue
+        journals[user.pw_name] = journal
+        plans[user.pw_name] = plan
+    return journals, plans
+
 
 @app.command(help=HELP)
 def collect_garbage(
@@ -57,6 +228,13 @@ def collect_garbage(
         default="/run/lock",
         help="Where the lock file for exclusive operations should be placed.",
     ),
+    lock_timeout: Optional[float] = Option(
+        default=None,
+        help=(
+            "Seconds to wait for other management commands before "
+            "running nix-collect-garbage. Waits forever by default."
+        ),
+    ),
     ignore_users_file: Path = Option(
         exists=True,
         file_okay=True,
@@ -65,14 +243,43 @@ def collect_garbage(
         default="/etc/userscan/ignore-users",
         help="File with names of users to ignore for fc-userscan",
     ),
+    jobs: int = Option(
+        default=4,
+        min=1,
+        help="Number of users to scan at the same time.",
+    ),
+    user_timeout: Optional[float] = Option(
+        default=None,
+        help=(
+            "Kill fc-userscan for a user after that many seconds. Garbage "
+            "collection doesn't run if a scan has been killed."
+        ),
+    ),
+    io_class: IOClass = Option(
+        default=IOClass.idle,
+        help="I/O scheduling class for fc-userscan (see ionice).",
+    ),
+    incremental: bool = Option(
+        False,
+        "--incremental",
+        help="Skip users whose home hasn't changed since the last scan.",
+    ),
+    full_scan_interval: float = Option(
+        default=7,
+        min=0,
+        help="Days after which --incremental scans unchanged users again.",
+    ),
+    state_dir: Path = Option(
+        file_okay=False,
+        default="/var/lib/fc-collect-garbage",
+        help="Where --incremental keeps the time of the last scan per user.",
+    ),
 ):
     init_logging(verbose, syslog_identifier="fc-collect-garbage")
     log = structlog.get_logger()
 
     log.debug("collect-garbage-start")
 
-    return_codes = []
-
     with ignore_users_file.open("r") as f:
         ignore_users = set([x.strip() for x in f])
     users_to_scan = [
@@ -88,35 +295,53 @@ def collect_garbage(
         user_count=len(users_to_scan),
     )
 
-    for user in users_to_scan:
-        log.debug(
-            "userscan-user",
-            _replace_msg="Scanning {homedir} as {name}",
-            homedir=user.pw_dir,
-            name=user.pw_name,
+    started = time.monotonic()
+    if incremental:
+        state_dir.mkdir(parents=True, exist_ok=True)
+        journals, plans = plan_incremental_scans(
+            log, users_to_scan, state_dir, full_scan_interval * 86400
         )
+        skipped = [u.pw_name for u in users_to_scan if u.pw_name not in plans]
+        users_to_scan = [u for u in users_to_scan if u.pw_name in plans]
+    else:
+        skipped = []
 
-        p = subprocess.Popen(
-            [
-                "fc-userscan",
-                "--register",
-                "--cache",
-                user.pw_dir + "/.cache/fc-userscan.cache",
-                "--cache-limit",
-                "10000000",
-                "--unzip=*.egg",
-                "--excludefrom",
-                exclude_file,
-                user.pw_dir,
-            ],
-            stdin=subprocess.DEVNULL,
-            preexec_fn=lambda: os.setresuid(user.pw_uid, 0, 0),
-        )
-        rc = p.wait()
-        log.debug("userscan-result", rc=rc)
-        return_codes.append(rc)
+    results = scan_users(
+        log, users_to_scan, exclude_file, jobs, user_timeout, io_class
+    )
+
+    if incremental:
+        for result in results:
+            if not result.returncode:
+                journals[result.name].record(plans[result.name])
 
-    status = max(return_codes)
+    failed = [r.name for r in results if r.returncode]
+    slowest = max(results, key=lambda r: r.duration, default=None)
+    log.info(
+        "userscan-finished",
+        _replace_msg=(
+            "Scanned {user_count} users in {duration}s, {failed_count} "
+            "failed, {skipped_count} unchanged. Read {read_bytes} bytes, "
+            "{gc_roots} GC roots registered."
+        ),
+        user_count=len(results),
+        duration=round(time.monotonic() - started, 1),
+        failed_count=len(failed),
+        failed=failed,
+        timed_out=[r.name for r in results if r.timed_out],
+        slowest=slowest.name if slowest else None,
+        slowest_duration=round(slowest.duration, 1) if slowest else None,
+        skipped_count=len(skipped),
+        incremental=incremental,
+        read_bytes=sum(r.read_bytes for r in results),
+        gc_roots=sum(count_gc_roots(r.name) for r in results),
+    )
+
+    # Killed scans have negative return codes.
+    status = max(
+        (r.returncode if r.returncode >= 0 else 1 for r in results),
+        default=0,
+    )
     log.debug(
         "userscan-max-status",
         status=status,
@@ -141,12 +366,20 @@ def collect_garbage(
     # This should avoid situations where nix-collect-garbage cannot lock the
     # Nix DB which can cause store paths that remain in the Nix DB despite being
     # deleted from the Nix store.
-    with fc.util.lock.locked(log, lock_dir):
-        rc = subprocess.run(
-            ["nix-collect-garbage", "--delete-older-than", "3d"],
-            check=True,
-            stdin=subprocess.DEVNULL,
-        ).returncode
+    try:
+        with fc.util.lock.locked(
+            log,
+            lock_dir,
+            timeout=lock_timeout,
+            purpose="fc-collect-garbage",
+        ):
+            rc = subprocess.run(
+                ["nix-collect-garbage", "--delete-older-than", "3d"],
+                check=True,
+                stdin=subprocess.DEVNULL,
+            ).returncode
+    except fc.util.lock.LockTimeout:
+        raise Exit(3)
 
     if rc > 0:
         log.error(
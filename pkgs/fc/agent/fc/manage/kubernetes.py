@@ -6,7 +6,6 @@ from typing import NamedTuple, Optional
 import fc.util.kubernetes
 import structlog
 from fc.maintenance.state import EXIT_TEMPFAIL
-from fc.util.directory import directory_connection
 from fc.util.logging import init_logging
 from fc.util.typer_utils import FCTyperApp
 from rich import print
@@ -52,7 +51,9 @@ def fc_kubernetes(
         enc_path=enc_path,
     )
 
-    init_logging(verbose, logdir, syslog_identifier="fc-kubernetes")
+    init_logging(
+        verbose, logdir, syslog_identifier="fc-kubernetes", buffered=True
+    )
 
 
 @app.command(
@@ -120,6 +121,8 @@ def ready_all(
         help="Check maintenance state of nodes and skip when not in service.",
     ),
 ):
+    from fc.util.directory import directory_connection
+
     log = structlog.get_logger()
     node_names = fc.util.kubernetes.get_all_agent_node_names()
     with directory_connection(context.enc_path) as directory:
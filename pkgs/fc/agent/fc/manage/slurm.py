@@ -10,7 +10,6 @@ import fc.util.slurm
 import rich
 import rich.syntax
 import structlog
-from fc.util.directory import directory_connection
 from fc.util.logging import init_logging
 from typer import Exit, Option, Typer
 
@@ -79,7 +78,14 @@ def drain(
 ):
     log = structlog.get_logger()
     hostname = socket.gethostname()
-    fc.util.slurm.drain(log, hostname, timeout, reason, strict_state_check)
+    fc.util.slurm.drain(
+        log,
+        hostname,
+        timeout,
+        reason,
+        strict_state_check,
+        fc.util.slurm.LocalJobEvents(),
+    )
 
 
 @app.command(
@@ -97,7 +103,14 @@ def drain_and_down(
 ):
     log = structlog.get_logger()
     hostname = socket.gethostname()
-    fc.util.slurm.drain(log, hostname, timeout, reason, strict_state_check)
+    fc.util.slurm.drain(
+        log,
+        hostname,
+        timeout,
+        reason,
+        strict_state_check,
+        fc.util.slurm.LocalJobEvents(),
+    )
     fc.util.slurm.down(log, hostname, reason, strict_state_check)
 
 
@@ -207,6 +220,9 @@ def ready_all(
         help="Check maintenance state of nodes and skip when not in service.",
     ),
 ):
+    import fc.util.directory
+    from fc.util.directory import directory_connection
+
     log = structlog.get_logger()
     node_names = fc.util.slurm.get_all_node_names()
     if required_in_service:
@@ -251,7 +267,7 @@ def ready_all(
 @all_nodes_app.command()
 def state(as_json: bool = True):
     node_names = fc.util.slurm.get_all_node_names()
-    node_info = [fc.util.slurm.get_node_info(name) for name in node_names]
+    node_info = list(fc.util.slurm.get_node_infos(node_names).values())
     if as_json:
         output = json.dumps(node_info, indent=2)
     else:
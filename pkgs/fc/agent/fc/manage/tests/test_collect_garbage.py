@@ -23,7 +23,7 @@ def test_invoke(locked, getpwall: Mock, run, popen, tmpdir, log, logger):
         PwUserEntry("/var/empty", 1002, "emptyhomedir"),
         PwUserEntry("/home/normal", 1001, "normal"),
     ]
-    popen.return_value.wait.return_value = 0
+    popen.return_value.returncode = 0
     run.return_value.returncode = 0
     runner = typer.testing.CliRunner()
     exclude_file = tmpdir / "fc-userscan.exclude"
@@ -54,3 +54,125 @@ def test_invoke(locked, getpwall: Mock, run, popen, tmpdir, log, logger):
     assert log.has("collect-garbage-succeeded")
     #  Should ignore users system, emptyhome and just scan /home/normal
     assert log.has("userscan-start", user_count=1)
+
+
+class FakeUserscan:
+    running = 0
+    max_running = 0
+    # Not a child of the test process, os.wait4 raises ChildProcessError.
+    pid = 2**30
+
+    def __init__(self, cmd, **kwargs):
+        self.cmd = cmd
+        self.polls = 0 if "/home/slow" in cmd else 2
+        self.returncode = None
+        FakeUserscan.running += 1
+        FakeUserscan.max_running = max(
+            FakeUserscan.running, FakeUserscan.max_running
+        )
+
+    def poll(self):
+        if self.returncode is None and self.polls:
+            self.polls -= 1
+            if not self.polls:
+                self._exit(0)
+        return self.returncode
+
+    def kill(self):
+        self._exit(-9)
+
+    def wait(self):
+        return self.returncode
+
+    def _exit(self, returncode):
+        self.returncode = returncode
+        FakeUserscan.running -= 1
+
+
+def test_scan_users_parallel_with_timeout(log, logger, monkeypatch):
+    monkeypatch.setattr("subprocess.Popen", FakeUserscan)
+    monkeypatch.setattr("fc.manage.collect_garbage.POLL_INTERVAL", 0.01)
+    users = [PwUserEntry("/home/slow", 1000, "slow")] + [
+        PwUserEntry(f"/home/u{i}", 1001 + i, f"u{i}") for i in range(5)
+    ]
+
+    results = fc.manage.collect_garbage.scan_users(
+        logger,
+        users,
+        "exclude",
+        jobs=3,
+        timeout=0.2,
+        io_class=fc.manage.collect_garbage.IOClass.idle,
+    )
+
+    assert FakeUserscan.max_running == 3
+    assert FakeUserscan.running == 0
+    by_name = {r.name: r for r in results}
+    assert by_name.keys() == {"slow", "u0", "u1", "u2", "u3", "u4"}
+    assert by_name["slow"].timed_out
+    assert by_name["slow"].returncode == -9
+    assert not any(r.returncode for n, r in by_name.items() if n != "slow")
+    # The slow scan doesn't block the others, it finishes last.
+    assert results[-1].name == "slow"
+    assert log.has("userscan-timeout", name="slow")
+
+
+def test_invoke_incremental_skips_unchanged_users(
+    tmp_path, log, logger, monkeypatch
+):
+    home = tmp_path / "home" / "u0"
+    (home / "a").mkdir(parents=True)
+    (home / "b").mkdir()
+    monkeypatch.setattr(
+        "pwd.getpwall", lambda: [PwUserEntry(str(home), 1000, "u0")]
+    )
+    monkeypatch.setattr("subprocess.Popen", FakeUserscan)
+    monkeypatch.setattr("fc.manage.collect_garbage.POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(
+        "fc.manage.collect_garbage.GC_ROOTS_DIR", tmp_path / "gcroots"
+    )
+    monkeypatch.setattr(
+        "subprocess.run", Mock(return_value=Mock(returncode=0))
+    )
+    monkeypatch.setattr("fc.util.lock.locked", unittest.mock.MagicMock())
+    exclude_file = tmp_path / "exclude"
+    exclude_file.write_text("**/.cache/nix/\n")
+    ignore_users_file = tmp_path / "ignore-users"
+    ignore_users_file.write_text("")
+    args = (
+        "--stamp-dir",
+        tmp_path,
+        "--lock-dir",
+        tmp_path,
+        "--exclude-file",
+        exclude_file,
+        "--ignore-users-file",
+        ignore_users_file,
+        "--incremental",
+        "--state-dir",
+        tmp_path / "state",
+    )
+    runner = typer.testing.CliRunner()
+
+    result = runner.invoke(fc.manage.collect_garbage.app, args)
+    assert result.exit_code == 0, result.output
+    assert log.has("userscan-plan", name="u0", full=True)
+    assert log.has("userscan-finished", user_count=1, skipped_count=0)
+    assert (tmp_path / "state" / "u0.json").exists()
+
+    result = runner.invoke(fc.manage.collect_garbage.app, args)
+    assert result.exit_code == 0, result.output
+    assert log.has("userscan-plan", name="u0", full=False, skip=True)
+    assert log.has("userscan-finished", user_count=0, skipped_count=1)
+
+    (home / "a" / "new-file").write_text("")
+    popen = Mock(wraps=FakeUserscan)
+    monkeypatch.setattr("subprocess.Popen", popen)
+    result = runner.invoke(fc.manage.collect_garbage.app, args)
+    assert result.exit_code == 0, result.output
+    assert log.has("userscan-plan", name="u0", full=False, skip=False)
+    assert log.has("userscan-finished", user_count=1, skipped_count=0)
+    # Changed users are scanned completely.
+    cmd = popen.call_args.args[0]
+    assert cmd[cmd.index("--excludefrom") + 1] == exclude_file
+    assert cmd[-1] == str(home)
@@ -0,0 +1,59 @@
+import time
+
+from fc.manage.userscan_journal import UserscanJournal
+
+
+def test_first_scan_is_full(tmp_path):
+    journal = UserscanJournal(tmp_path / "state", "u0", 86400)
+    plan = journal.plan(tmp_path)
+    assert plan.full
+    assert not plan.skip
+
+
+def make_tree(home):
+    for path in ["a/a1/a11", "a/a2", "b/b1", "c"]:
+        (home / path).mkdir(parents=True)
+
+
+def test_incremental_scan_notices_changes_deep_in_the_tree(tmp_path):
+    home = tmp_path / "home"
+    make_tree(home)
+    (tmp_path / "state").mkdir()
+    journal = UserscanJournal(tmp_path / "state", "u0", 86400)
+    journal.record(journal.plan(home))
+    time.sleep(0.01)
+
+    (home / "a" / "a1" / "a11" / "new-file").write_text("")
+
+    journal = UserscanJournal(tmp_path / "state", "u0", 86400)
+    plan = journal.plan(home)
+    assert not plan.full
+    assert not plan.skip
+
+
+def test_incremental_scan_skips_unchanged_home(tmp_path):
+    home = tmp_path / "home"
+    make_tree(home)
+    (tmp_path / "state").mkdir()
+    journal = UserscanJournal(tmp_path / "state", "u0", 86400)
+    journal.record(journal.plan(home))
+
+    plan = UserscanJournal(tmp_path / "state", "u0", 86400).plan(home)
+    assert plan.skip
+    assert not plan.full
+
+
+def test_full_scan_after_interval(tmp_path):
+    (tmp_path / "state").mkdir()
+    journal = UserscanJournal(tmp_path / "state", "u0", 0)
+    journal.record(journal.plan(tmp_path))
+
+    plan = UserscanJournal(tmp_path / "state", "u0", 0).plan(tmp_path)
+    assert plan.full
+
+
+def test_broken_journal_means_full_scan(tmp_path, log):
+    (tmp_path / "u0.json").write_text("{")
+    journal = UserscanJournal(tmp_path, "u0", 86400)
+    assert journal.plan(tmp_path).full
+    assert log.has("userscan-journal-load-failed")
@@ -0,0 +1,117 @@
+"""Change tracking for incremental fc-userscan runs.
+
+fc-userscan walks the whole home directory of a user on every run. Its
+cache avoids reading files again, but stat-ing millions of unchanged files
+still costs a lot of I/O on storage-heavy machines.
+
+The journal records when the last successful scan of a user started.
+Before the next scan, only the directories below the home directory are
+checked: the ctime of a directory changes when entries are created,
+removed or renamed in it. If no directory has changed, fc-userscan isn't
+run for the user at all and the GC roots registered by the last scan stay
+in place. Users with changes are scanned completely.
+
+Files modified in place don't change their directory, so users are
+scanned anyway when their last scan is older than `full_scan_interval`
+seconds.
+"""
+
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import structlog
+
+_log = structlog.get_logger()
+
+# Bump this when changing the stored fields.
+JOURNAL_VERSION = 1
+
+
+class ScanPlan(NamedTuple):
+    # Start of the scan in ns since the epoch, as recorded after success.
+    started_ns: int
+    # Scanned without looking for changes as the last scan is too old.
+    full: bool
+    # Nothing changed at all, the scan can be skipped.
+    skip: bool = False
+
+
+def _tree_changed(home, since_ns) -> bool:
+    """Returns True if the directory or a directory below it has changed
+    since `since_ns`. Stops looking at the first change.
+    """
+    pending = [home]
+    while pending:
+        path = pending.pop()
+        try:
+            if os.stat(path, follow_symlinks=False).st_ctime_ns >= since_ns:
+                return True
+            with os.scandir(path) as entries:
+                pending.extend(
+                    e.path for e in entries if e.is_dir(follow_symlinks=False)
+                )
+        except OSError:
+            # Let fc-userscan deal with it.
+            return True
+    return False
+
+
+class UserscanJournal:
+    def __init__(
+        self, state_dir: Path, user_name: str, full_scan_interval: float
+    ):
+        self.path = Path(state_dir) / f"{user_name}.json"
+        self.full_scan_interval = full_scan_interval
+        self.last_started_ns: Optional[int] = None
+        self.load()
+
+    def load(self):
+        try:
+            data = json.loads(self.path.read_text())
+            if data.get("version") != JOURNAL_VERSION:
+                return
+            self.last_started_ns = data["last_started_ns"]
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError):
+            _log.warning(
+                "userscan-journal-load-failed",
+                path=str(self.path),
+                exc_info=True,
+            )
+
+    def plan(self, home) -> ScanPlan:
+        started_ns = time.time_ns()
+        if (
+            self.last_started_ns is None
+            or started_ns - self.last_started_ns
+            > self.full_scan_interval * 1e9
+        ):
+            return ScanPlan(started_ns, full=True)
+
+        changed = _tree_changed(home, self.last_started_ns)
+        return ScanPlan(started_ns, full=False, skip=not changed)
+
+    def record(self, plan: ScanPlan):
+        """Remembers a successful scan."""
+        self.last_started_ns = plan.started_ns
+        data = {
+            "version": JOURNAL_VERSION,
+            "last_started_ns": self.last_started_ns,
+        }
+        try:
+            with tempfile.NamedTemporaryFile(
+                mode="w", dir=self.path.parent, delete=False
+            ) as tf:
+                json.dump(data, tf, sort_keys=True)
+            os.rename(tf.name, self.path)
+        except OSError:
+            _log.warning(
+                "userscan-journal-save-failed",
+                path=str(self.path),
+                exc_info=True,
+            )
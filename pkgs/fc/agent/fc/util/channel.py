@@ -133,7 +133,11 @@ class Channel:
         if self.is_local:
             self.check_local_channel()
         system_path = nixos.build_system(
-            self.resolved_url, build_options, out_link, self.log
+            self.resolved_url,
+            build_options,
+            out_link,
+            self.log,
+            structured_log=True,
         )
         self.system_path = system_path
 
@@ -0,0 +1,137 @@
+"""Persistent cache for channel metadata.
+
+Getting the version of a channel needs a `nix-instantiate` run and resolving
+a channel URL needs a HTTP request. Both happen on every fc-manage run and
+every `fc-maintenance request update` even if nothing has changed.
+
+Resolved Hydra build URLs are immutable, so their versions are cached
+without expiry. Redirect targets of channel URLs change when new releases
+are published, so they are only cached for a short time and dropped when
+the system channel is updated.
+
+The cache directory is created by systemd-tmpfiles. Without it, nothing is
+cached.
+"""
+
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import structlog
+from fc.util import nixos
+
+_log = structlog.get_logger()
+
+CACHE_FILE = Path("/var/cache/fc-agent/channels.json")
+
+# Bump this when changing the stored fields.
+CACHE_VERSION = 1
+
+# Seconds a resolved redirect target is used without asking again.
+REDIRECT_TTL = 300
+
+
+def is_immutable_channel_url(url: str) -> bool:
+    return nixos.RE_FC_CHANNEL.fullmatch(url) is not None
+
+
+class ChannelMetadataCache:
+    def __init__(self, path: Path, log=_log):
+        self.path = Path(path)
+        self.log = log
+        self.versions: dict[str, str] = {}
+        self.redirects: dict[str, dict] = {}
+        self._mtime_ns = None
+
+    @property
+    def enabled(self):
+        return self.path.parent.is_dir()
+
+    def _refresh(self):
+        """(Re-)loads the cache file if it has been changed on disk."""
+        try:
+            mtime_ns = self.path.stat().st_mtime_ns
+        except OSError:
+            return
+        if mtime_ns == self._mtime_ns:
+            return
+        try:
+            with self.path.open() as f:
+                data = json.load(f)
+            if data.get("version") != CACHE_VERSION:
+                return
+            self.versions = dict(data["versions"])
+            self.redirects = dict(data["redirects"])
+            self._mtime_ns = mtime_ns
+        except (OSError, ValueError, KeyError, TypeError):
+            self.log.warning(
+                "channel-cache-load-failed", path=str(self.path), exc_info=True
+            )
+
+    def _save(self):
+        data = {
+            "version": CACHE_VERSION,
+            "versions": self.versions,
+            "redirects": self.redirects,
+        }
+        try:
+            with tempfile.NamedTemporaryFile(
+                mode="w", dir=self.path.parent, delete=False
+            ) as tf:
+                json.dump(data, tf, indent=2, sort_keys=True)
+                os.chmod(tf.fileno(), 0o644)
+            os.rename(tf.name, self.path)
+            self._mtime_ns = self.path.stat().st_mtime_ns
+        except OSError:
+            self.log.warning(
+                "channel-cache-save-failed", path=str(self.path), exc_info=True
+            )
+
+    def version(self, url):
+        if not self.enabled or not is_immutable_channel_url(url):
+            return
+        self._refresh()
+        return self.versions.get(url)
+
+    def set_version(self, url, version):
+        if not self.enabled or not is_immutable_channel_url(url):
+            return
+        self._refresh()
+        self.versions[url] = version
+        self._save()
+
+    def redirect(self, url):
+        if not self.enabled:
+            return
+        self._refresh()
+        entry = self.redirects.get(url)
+        if entry and time.time() - entry["resolved_at"] < REDIRECT_TTL:
+            return entry["target"]
+
+    def set_redirect(self, url, target):
+        if not self.enabled:
+            return
+        self._refresh()
+        self.redirects[url] = {"target": target, "resolved_at": time.time()}
+        self._save()
+
+    def invalidate_redirects(self):
+        if not self.enabled:
+            return
+        self._refresh()
+        if self.redirects:
+            self.log.debug("channel-cache-invalidate-redirects")
+            self.redirects = {}
+            self._save()
+
+
+_cache = None
+
+
+def get_cache() -> ChannelMetadataCache:
+    global _cache
+    if _cache is None or _cache.path != CACHE_FILE:
+        _cache = ChannelMetadataCache(CACHE_FILE)
+    return _cache
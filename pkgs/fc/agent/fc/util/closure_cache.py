@@ -0,0 +1,109 @@
+"""Persistent cache for closure sizes of store paths.
+
+Store paths are immutable, so their sizes never become stale. The cache
+keeps the NAR size of each store path seen in a closure and the resulting
+closure sizes of systems. Closures of different systems share most of their
+store paths which means that computing the size of a new system only has to
+query the sizes of the paths which are new.
+
+Entries for store paths which have been garbage-collected are dropped when
+the cache is saved. Like the channel cache, it's only used if the cache
+directory exists and is only written by users with write access to it.
+"""
+
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Iterable, Optional
+
+import structlog
+
+_log = structlog.get_logger()
+
+CACHE_FILE = Path("/var/cache/fc-agent/closure-sizes.json")
+
+# Bump this when changing the stored fields.
+CACHE_VERSION = 1
+
+
+class ClosureSizeCache:
+    def __init__(self, path: Path, log=_log):
+        self.path = Path(path)
+        self.log = log
+        # Closure size per top-level store path.
+        self.closures: dict[str, int] = {}
+        # NAR size per store path.
+        self.paths: dict[str, int] = {}
+        self.load()
+
+    @property
+    def enabled(self):
+        return self.path.parent.is_dir()
+
+    def load(self):
+        if not self.enabled:
+            return
+        try:
+            with self.path.open() as f:
+                data = json.load(f)
+            if data.get("version") != CACHE_VERSION:
+                return
+            self.closures = dict(data["closures"])
+            self.paths = dict(data["paths"])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError):
+            self.log.warning(
+                "closure-cache-load-failed", path=str(self.path), exc_info=True
+            )
+
+    def save(self):
+        if not self.enabled:
+            return
+        self.closures = {
+            p: size for p, size in self.closures.items() if os.path.exists(p)
+        }
+        self.paths = {
+            p: size for p, size in self.paths.items() if os.path.exists(p)
+        }
+        data = {
+            "version": CACHE_VERSION,
+            "closures": self.closures,
+            "paths": self.paths,
+        }
+        try:
+            with tempfile.NamedTemporaryFile(
+                mode="w", dir=self.path.parent, delete=False
+            ) as tf:
+                json.dump(data, tf, sort_keys=True)
+                os.chmod(tf.fileno(), 0o644)
+            os.rename(tf.name, self.path)
+        except OSError:
+            # Expected when running unprivileged, for example from checks.
+            self.log.debug(
+                "closure-cache-save-failed", path=str(self.path), exc_info=True
+            )
+
+    def closure_size(self, store_path: str) -> Optional[int]:
+        return self.closures.get(store_path)
+
+    def unknown_paths(self, store_paths: Iterable[str]) -> list[str]:
+        return [p for p in store_paths if p not in self.paths]
+
+    def add_closure(
+        self,
+        store_path: str,
+        requisites: Iterable[str],
+        new_path_sizes: dict[str, int],
+    ) -> int:
+        """Records the sizes of new paths and returns the closure size."""
+        self.paths.update(new_path_sizes)
+        size = sum(self.paths[p] for p in requisites)
+        self.closures[store_path] = size
+        self.save()
+        return size
+
+
+def get_cache() -> ClosureSizeCache:
+    return ClosureSizeCache(CACHE_FILE)
@@ -1,10 +1,17 @@
 """Unified client access to fc.directory."""
+import collections
 import contextlib
-import functools
+import http.client
 import json
+import queue
 import re
+import ssl
+import threading
+import time
 import urllib.parse
 import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
 
 import stamina
 
@@ -28,6 +35,235 @@ RETRY_EXCEPTIONS = (
     OSError,
 )
 
+# Returned instead of results when the directory answers a conditional
+# request with "304 Not Modified".
+NOT_MODIFIED = object()
+
+# Maximum number of connections used when batched calls fall back to
+# individual calls.
+MAX_PARALLEL_CALLS = 8
+
+# Maximum number of idle connections kept per directory host.
+MAX_IDLE_CONNECTIONS = 4
+
+_METHOD_NAME = re.compile(rb"<methodName>([^<]+)</methodName>")
+
+
+class CallStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration, error):
+        self.count += 1
+        self.errors += error
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": round(self.total / self.count * 1000, 1),
+            "max_ms": round(self.max * 1000, 1),
+        }
+
+
+class _TLSSessionHTTPSConnection(http.client.HTTPSConnection):
+    """Resumes the TLS session of a previous connection to the same host."""
+
+    def __init__(self, host, pool, **kw):
+        self.pool = pool
+        super().__init__(host, **kw)
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(
+            self.sock,
+            server_hostname=self.host,
+            session=self.pool.tls_session(self.host),
+        )
+        if self.sock.session_reused:
+            self.pool.record("tls_sessions_resumed")
+
+
+class DirectoryConnectionPool:
+    """HTTP(S) connections to the directory shared by all DirectoryAPI
+    instances of a process.
+
+    Connections are kept alive and handed out again after a response has
+    been read completely. At most `max_idle` idle connections per host are
+    kept, the rest is closed. HTTPS connections share one SSL context and
+    resume TLS sessions. Call latencies are recorded per API method.
+    """
+
+    def __init__(self, max_idle=MAX_IDLE_CONNECTIONS):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = collections.defaultdict(list)
+        self._tls_sessions = {}
+        self._ssl_context = None
+        self.counters = collections.Counter()
+        self.calls = collections.defaultdict(CallStats)
+
+    @property
+    def ssl_context(self):
+        with self._lock:
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            return self._ssl_context
+
+    def tls_session(self, host):
+        with self._lock:
+            return self._tls_sessions.get(host)
+
+    def record(self, counter):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def record_call(self, method, duration, error=False):
+        with self._lock:
+            self.calls[method].add(duration, error)
+
+    def acquire(self, scheme, host):
+        """Returns an idle connection or a new one."""
+        with self._lock:
+            idle = self._idle[scheme, host]
+            if idle:
+                self.counters["connections_reused"] += 1
+                return idle.pop()
+            self.counters["connections_opened"] += 1
+        if scheme == "https":
+            return _TLSSessionHTTPSConnection(
+                host, self, context=self.ssl_context
+            )
+        return http.client.HTTPConnection(host)
+
+    def release(self, scheme, host, connection):
+        """Takes back a connection whose last response has been read."""
+        sock = connection.sock
+        with self._lock:
+            if isinstance(sock, ssl.SSLSocket) and sock.session:
+                self._tls_sessions[host] = sock.session
+            idle = self._idle[scheme, host]
+            if sock is not None and len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def clear(self):
+        """Closes all idle connections."""
+        with self._lock:
+            connections = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "connections_opened": self.counters["connections_opened"],
+                "connections_reused": self.counters["connections_reused"],
+                "tls_sessions_resumed": self.counters["tls_sessions_resumed"],
+                "calls": {
+                    method: stats.to_dict()
+                    for method, stats in sorted(self.calls.items())
+                },
+            }
+
+
+POOL = DirectoryConnectionPool()
+
+
+class PooledConnectionMixin:
+    """Makes XML-RPC transports use connections from the shared POOL."""
+
+    scheme = "http"
+    _pool_host = None
+
+    def make_connection(self, host):
+        if self._connection and host == self._connection[0]:
+            return self._connection[1]
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        self._pool_host = chost
+        self._connection = host, POOL.acquire(self.scheme, chost)
+        return self._connection[1]
+
+    def single_request(self, host, handler, request_body, verbose=False):
+        match = _METHOD_NAME.search(request_body[:512])
+        method = match.group(1).decode() if match else "unknown"
+        started = time.perf_counter()
+        try:
+            result = super().single_request(
+                host, handler, request_body, verbose
+            )
+        except xmlrpc.client.Fault:
+            # The response has been read completely, keep the connection.
+            POOL.record_call(method, time.perf_counter() - started, True)
+            self._release()
+            raise
+        except Exception:
+            POOL.record_call(method, time.perf_counter() - started, True)
+            self.close()
+            raise
+        POOL.record_call(method, time.perf_counter() - started)
+        self._release()
+        return result
+
+    def _release(self):
+        if self._connection[1] is not None:
+            POOL.release(self.scheme, self._pool_host, self._connection[1])
+            self._connection = (None, None)
+
+
+class ConditionalRequestMixin:
+    """Adds ETag-based conditional requests to XML-RPC transports.
+
+    Set `if_none_match` to send the ETag of a previous response. The ETag of
+    the last response is available as `etag`.
+    """
+
+    if_none_match = None
+    etag = None
+
+    def send_headers(self, connection, headers):
+        if self.if_none_match:
+            headers = [*headers, ("If-None-Match", self.if_none_match)]
+        super().send_headers(connection, headers)
+
+    def parse_response(self, response):
+        self.etag = response.getheader("ETag")
+        return super().parse_response(response)
+
+    def single_request(self, host, handler, request_body, verbose=False):
+        self.etag = None
+        try:
+            return super().single_request(host, handler, request_body, verbose)
+        except xmlrpc.client.ProtocolError as e:
+            if e.errcode != 304:
+                raise
+            self.etag = e.headers.get("ETag", self.if_none_match)
+            # Transport leaves body-less responses unread which makes the
+            # connection unusable for further requests.
+            self.close()
+            return (NOT_MODIFIED,)
+
+
+class DirectoryTransport(
+    PooledConnectionMixin, ConditionalRequestMixin, xmlrpc.client.Transport
+):
+    pass
+
+
+class DirectorySafeTransport(
+    PooledConnectionMixin,
+    ConditionalRequestMixin,
+    xmlrpc.client.SafeTransport,
+):
+    scheme = "https"
+
 
 class DirectoryAPI(xmlrpc.client.ServerProxy):
     def __init__(self, url, retry=False):
@@ -35,29 +271,128 @@ class DirectoryAPI(xmlrpc.client.ServerProxy):
         url: directory API URL to connect to
         retry: retry failed API requests automatically using exponential backoff.
         """
+        self.url = url
         self.retry = retry
-        super().__init__(url, allow_none=True, use_datetime=True)
+        # Unknown until the first batch call.
+        self.multicall_supported = None
+        if urllib.parse.urlsplit(url).scheme == "https":
+            self.transport = DirectorySafeTransport(use_datetime=True)
+        else:
+            self.transport = DirectoryTransport(use_datetime=True)
+        super().__init__(url, self.transport, allow_none=True)
 
-    def __getattr__(self, name):
-        """Magic method dispatcher from ServerProxy with added retry logic."""
-        method = super().__getattr__(name)
+    def clone(self):
+        """Returns a new proxy for the same URL.
 
+        ServerProxy instances are not thread-safe, threads need their own.
+        Connections are still shared through the POOL.
+        """
+        return DirectoryAPI(self.url, self.retry)
+
+    @property
+    def etag(self):
+        """ETag of the last response, if the directory sent one."""
+        return self.transport.etag
+
+    def _with_retry(self, name, func, on=RETRY_EXCEPTIONS):
         if not self.retry:
-            return method
+            return func
 
         # This function wrapper is needed to make the Stamina decorator work.
         def wrapper(*args):
-            return method(*args)
+            return func(*args)
 
         # Stamina uses __qualname__ for retry logging, so let's set it to a
         # recognizable value.
         wrapper.__qualname__ = "DirectoryAPI." + name
 
-        retry = stamina.retry(
-            on=RETRY_EXCEPTIONS, wait_exp_base=10, attempts=2
-        )
+        retry = stamina.retry(on=on, wait_exp_base=10, attempts=2)
         return retry(wrapper)
 
+    def __getattr__(self, name):
+        """Magic method dispatcher from ServerProxy with added retry logic."""
+        return self._with_retry(name, super().__getattr__(name))
+
+    def batch(self, calls, if_none_match=None):
+        """Calls multiple API methods and returns their results in order.
+
+        `calls` is a sequence of (method name, args) pairs. The calls are
+        sent in a single request using `system.multicall`. If the server
+        doesn't support multicall, the calls are made concurrently using
+        separate connections instead.
+
+        The result of a failed call is the exception it raised instead of a
+        return value.
+
+        With `if_none_match`, the multicall request is conditional. If the
+        directory reports that the results for the given ETag are unchanged,
+        NOT_MODIFIED is returned instead of the results. Use `etag` after
+        the call to get the ETag of the new results.
+        """
+        calls = [(name, tuple(args)) for name, args in calls]
+        if not calls:
+            return []
+        if self.multicall_supported is not False:
+            try:
+                results = self._multicall(calls, if_none_match)
+                self.multicall_supported = True
+                return results
+            except (xmlrpc.client.Fault, ScreenedProtocolError):
+                # Faults for the multicall itself mean that the method is
+                # missing, protocol errors may come from proxies rejecting it.
+                if self.multicall_supported:
+                    raise
+                self.multicall_supported = False
+        return self._parallel_calls(calls)
+
+    def _multicall(self, calls, if_none_match):
+        # Bypass our own `__getattr__`, faults are not retried here, see
+        # `batch`.
+        multicall = self._with_retry(
+            "system.multicall",
+            xmlrpc.client.ServerProxy.__getattr__(self, "system.multicall"),
+            on=(ScreenedProtocolError, OSError),
+        )
+        self.transport.if_none_match = if_none_match
+        try:
+            responses = multicall(
+                [{"methodName": name, "params": args} for name, args in calls]
+            )
+        finally:
+            self.transport.if_none_match = None
+        if responses is NOT_MODIFIED:
+            return NOT_MODIFIED
+        etag = self.etag
+        results = []
+        for (name, args), response in zip(calls, responses):
+            if isinstance(response, list):
+                results.append(response[0])
+                continue
+            # Failed calls get the second attempt single calls would get.
+            method = xmlrpc.client.ServerProxy.__getattr__(self, name)
+            try:
+                results.append(method(*args))
+            except Exception as e:
+                results.append(e)
+        # Repeated calls would overwrite the ETag. It still describes the
+        # multicall response, which is what a conditional request compares.
+        self.transport.etag = etag
+        return results
+
+    def _parallel_calls(self, calls):
+        def call(name_and_args):
+            name, args = name_and_args
+            directory = self.clone()
+            try:
+                return getattr(directory, name)(*args)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(
+            max_workers=min(MAX_PARALLEL_CALLS, len(calls))
+        ) as executor:
+            return list(executor.map(call, calls))
+
     def __repr__(self):
         """ServerProxy.__repr__ leaks the directory password, override it."""
         host = self._ServerProxy__host.split("@")[1]
@@ -122,3 +457,65 @@ def directory_cli():
 
 def is_node_in_service(directory, node) -> bool:
     return directory.lookup_node(node)["parameters"]["servicing"]
+
+
+class ServiceCheckResult(NamedTuple):
+    not_in_service: list[str]
+    # Nodes whose check didn't finish before the deadline or the first
+    # node not in service.
+    unknown: list[str]
+
+
+def check_nodes_in_service(directory, nodes, timeout) -> ServiceCheckResult:
+    """Checks concurrently if nodes are in service.
+
+    Stops at the first node that is not in service or when `timeout`
+    seconds have passed. Exceptions from checks are re-raised.
+    """
+    nodes = list(dict.fromkeys(nodes))
+    todo = queue.SimpleQueue()
+    for node in nodes:
+        todo.put(node)
+    results = queue.SimpleQueue()
+    stop = threading.Event()
+
+    def worker():
+        connection = directory.clone()
+        while not stop.is_set():
+            try:
+                node = todo.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results.put((node, is_node_in_service(connection, node), None))
+            except Exception as e:
+                results.put((node, None, e))
+
+    # Daemon threads because hanging checks must not delay exiting after
+    # the deadline.
+    for _ in range(min(MAX_PARALLEL_CALLS, len(nodes))):
+        threading.Thread(target=worker, daemon=True).start()
+
+    deadline = time.monotonic() + timeout
+    pending = set(nodes)
+    not_in_service = []
+    try:
+        while pending and not not_in_service:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                node, in_service, exc = results.get(timeout=remaining)
+            except queue.Empty:
+                break
+            pending.discard(node)
+            if exc is not None:
+                raise exc
+            if not in_service:
+                not_in_service.append(node)
+    finally:
+        stop.set()
+
+    return ServiceCheckResult(
+        not_in_service, [node for node in nodes if node in pending]
+    )
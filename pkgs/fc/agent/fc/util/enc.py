@@ -1,4 +1,5 @@
 import filecmp
+import functools
 import grp
 import hashlib
 import json
@@ -10,12 +11,15 @@ from pathlib import Path
 
 import structlog
 from fc.util import nixos
-from fc.util.directory import connect
 from fc.util.time_date import utcnow
 
 structlog = structlog.get_logger()
 
 STATE_VERSION_FILE = Path("/etc/local/nixos/state_version")
+INVENTORY_DIR = Path("/etc/nixos")
+# ETag of the last complete inventory and the state of the files written
+# from it.
+INVENTORY_CACHE_FILE = "inventory-cache.json"
 
 
 def load_enc(log, enc_path):
@@ -161,22 +165,26 @@ def inplace_update(filename, data):
 
 
 def retrieve(log, func, tgt, mode=0o640):
+    """Returns True if the file has been updated."""
     log.info("retrieve-enc", _replace_msg="Getting: {tgt}", tgt=tgt)
     try:
         data = func()
     except Exception:
         log.error("retrieve-enc-failed", exc_info=True)
-        return
+        return False
     try:
-        conditional_update("/etc/nixos/{}".format(tgt), data, mode)
+        conditional_update(str(INVENTORY_DIR / tgt), data, mode)
     except (IOError, OSError):
-        inplace_update("/etc/nixos/{}".format(tgt), data)
+        inplace_update(str(INVENTORY_DIR / tgt), data)
+    return True
 
 
 def write_json(log, calls):
-    """Writes JSON files from a list of (lambda, filename) pairs."""
-    for call in calls:
-        retrieve(log, *call)
+    """Writes JSON files from a list of (lambda, filename) pairs.
+    Returns True if all files have been updated.
+    """
+    results = [retrieve(log, *call) for call in calls]
+    return all(results)
 
 
 def write_system_state(log):
@@ -236,7 +244,54 @@ def get_release_info(log, enc):
     return releases
 
 
+def _inventory_files_state(filenames):
+    """Returns the modification times of the inventory files or None if one
+    of them is missing.
+    """
+    try:
+        return {
+            name: (INVENTORY_DIR / name).stat().st_mtime_ns
+            for name in filenames
+        }
+    except OSError:
+        return
+
+
+def load_inventory_etag(log, filenames):
+    """Returns the ETag of the cached inventory if the inventory files are
+    unchanged since they have been written.
+    """
+    try:
+        with open(INVENTORY_DIR / INVENTORY_CACHE_FILE) as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError):
+        log.warning("inventory-cache-load-failed", exc_info=True)
+        return
+    if not isinstance(cache, dict):
+        return
+    if cache.get("files") != _inventory_files_state(filenames):
+        log.debug("inventory-cache-stale")
+        return
+    return cache.get("etag")
+
+
+def save_inventory_etag(log, etag, filenames):
+    cache_path = INVENTORY_DIR / INVENTORY_CACHE_FILE
+    files = _inventory_files_state(filenames)
+    try:
+        if etag and files:
+            conditional_update(str(cache_path), {"etag": etag, "files": files})
+        else:
+            cache_path.unlink(missing_ok=True)
+    except OSError:
+        log.warning("inventory-cache-save-failed", exc_info=True)
+
+
 def update_inventory(log, enc):
+    from fc.util.directory import NOT_MODIFIED, connect
+
     if (
         not enc
         or not enc.get("parameters")
@@ -264,23 +319,62 @@ def update_inventory(log, enc):
         _replace_msg="Getting inventory data from directory...",
     )
 
-    write_json(
-        log,
-        [
-            (lambda: directory.lookup_node(enc["name"]), "enc.json"),
+    inventory = [
+        (("lookup_node", (enc["name"],)), "enc.json"),
+        (
             (
-                lambda: directory.list_nodes_addresses(
-                    enc["parameters"]["location"], "srv"
-                ),
-                "addresses_srv.json",
+                "list_nodes_addresses",
+                (enc["parameters"]["location"], "srv"),
             ),
-            (lambda: directory.list_permissions(), "permissions.json"),
-            (lambda: directory.list_service_clients(), "service_clients.json"),
-            (lambda: directory.list_services(), "services.json"),
-            (lambda: directory.list_users(), "users.json"),
-            (lambda: get_release_info(log, enc), "releases.json", 0o644),
+            "addresses_srv.json",
+        ),
+        (("list_permissions", ()), "permissions.json"),
+        (("list_service_clients", ()), "service_clients.json"),
+        (("list_services", ()), "services.json"),
+        (("list_users", ()), "users.json"),
+    ]
+    filenames = [tgt for _, tgt in inventory]
+    etag = load_inventory_etag(log, filenames)
+    try:
+        results = directory.batch(
+            [call for call, _ in inventory], if_none_match=etag
+        )
+    except Exception as e:
+        log.error("update-inventory-batch-failed", exc_info=True)
+        results = [e] * len(inventory)
+
+    log.debug(
+        "update-inventory-fetched",
+        calls=len(inventory),
+        multicall=directory.multicall_supported,
+        unchanged=results is NOT_MODIFIED,
+    )
+
+    release_info = (lambda: get_release_info(log, enc), "releases.json", 0o644)
+
+    if results is NOT_MODIFIED:
+        log.info(
+            "update-inventory-unchanged",
+            _replace_msg="Inventory data is unchanged, keeping files.",
+        )
+        write_json(log, [release_info])
+        return
+
+    def result(value):
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    complete = write_json(
+        log,
+        [
+            (functools.partial(result, value), tgt)
+            for tgt, value in zip(filenames, results)
         ],
     )
+    # Only a complete inventory may be skipped next time.
+    save_inventory_etag(log, directory.etag if complete else None, filenames)
+    write_json(log, [release_info])
 
 
 def update_enc(log, tmpdir, enc_path):
@@ -3,8 +3,7 @@ import subprocess
 from enum import Enum
 from typing import NamedTuple, Optional
 
-from fc.util.directory import is_node_in_service
-from fc.util.subprocess_helper import get_popen_stdout_lines
+from fc.util.subprocess_helper import communicate_lines
 
 MAINT_LABEL_NAME = "fcio.net/maintenance"
 
@@ -184,11 +183,10 @@ def drain(
         text=True,
     )
 
-    stdout_lines = get_popen_stdout_lines(proc, log, "kubectl-drain-out")
-    stdout = "".join(stdout_lines)
-    proc.wait()
+    result = communicate_lines(proc, log, "kubectl-drain-out")
+    stdout = result.stdout
 
-    if proc.returncode == 0:
+    if result.returncode == 0:
         log.info(
             "drain-finished",
         )
@@ -204,7 +202,7 @@ def drain(
         )
         raise NodeDrainTimeout()
     else:
-        log.error("drain-failed", returncode=proc.returncode, stdout=stdout)
+        log.error("drain-failed", returncode=result.returncode, stdout=stdout)
         raise NodeDrainError()
 
 
@@ -252,6 +250,8 @@ def run_ready_pre_checks(
             )
             return ReadyPreCheckResult("drained", action=False)
 
+    from fc.util.directory import is_node_in_service
+
     if skip_in_maintenance and not is_node_in_service(directory, node_name):
         log.info(
             "ready-pre-not-in-service",
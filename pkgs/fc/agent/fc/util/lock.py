@@ -1,52 +1,228 @@
 import contextlib
 import fcntl
 import os
+import time
 from pathlib import Path
+from typing import NamedTuple, Optional
+
+# Upper bound for the delay between attempts when waiting with a timeout.
+MAX_RETRY_INTERVAL = 1.0
+
+
+class LockTimeout(Exception):
+    def __init__(self, lockfile, timeout, holder):
+        self.lockfile = lockfile
+        self.timeout = timeout
+        self.holder = holder
+
+    def __str__(self):
+        return (
+            f"Could not lock {self.lockfile} within {self.timeout}s, "
+            f"held by {self.holder}"
+        )
+
+
+class _Holder(NamedTuple):
+    pid: str
+    locked_at: float
+    purpose: str
+
+    @classmethod
+    def parse(cls, line) -> Optional["_Holder"]:
+        pid, locked_at, purpose = (line.split(" ", 2) + ["", ""])[:3]
+        try:
+            return cls(pid, float(locked_at), purpose)
+        except ValueError:
+            return None
+
+    def __str__(self):
+        return f"{self.pid} {self.locked_at} {self.purpose}"
+
+    @property
+    def alive(self):
+        try:
+            os.kill(int(self.pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+
+def _read_holders(f) -> list[_Holder]:
+    f.seek(0)
+    holders = (_Holder.parse(line) for line in f.read().splitlines())
+    return [h for h in holders if h is not None]
+
+
+def _write_holders(f, holders):
+    f.seek(0)
+    f.truncate(0)
+    f.write("".join(f"{h}\n" for h in holders))
+    f.flush()
 
 
 @contextlib.contextmanager
-def locked(log, lockdir, lockfile_name="fc-agent.lock"):
+def _holders_locked(f, operation):
+    """Serializes changes to the holder lines of the lock file. Uses POSIX
+    record locks which don't interfere with the flock on the same file.
+    """
+    fcntl.lockf(f, operation)
+    try:
+        yield
+    finally:
+        fcntl.lockf(f, fcntl.LOCK_UN)
+
+
+def _add_holder(f, holder, shared):
+    with _holders_locked(f, fcntl.LOCK_EX):
+        # Lines of processes that died while holding the lock are stale.
+        # An exclusive holder is alone anyway.
+        others = [h for h in _read_holders(f) if h.alive] if shared else []
+        _write_holders(f, others + [holder])
+
+
+def _remove_holder(f, holder):
+    with _holders_locked(f, fcntl.LOCK_EX):
+        _write_holders(f, [h for h in _read_holders(f) if h != holder])
+
+
+def _holder(f):
+    """Returns information about the processes that hold the lock, as
+    recorded in the lock file. There may be multiple shared holders.
+    """
+    with _holders_locked(f, fcntl.LOCK_SH):
+        holders = [h for h in _read_holders(f) if h.alive]
+    if not holders:
+        return {
+            "other_pid": "<unknown>",
+            "other_purpose": "<unknown>",
+            "held_for": None,
+        }
+    return {
+        "other_pid": ", ".join(h.pid for h in holders),
+        "other_purpose": ", ".join(h.purpose or "<unknown>" for h in holders),
+        "held_for": round(time.time() - min(h.locked_at for h in holders), 1),
+    }
+
+
+def _flock(f, operation, timeout):
+    """Waits for the lock, at most `timeout` seconds if given. Returns
+    False if the timeout has been reached.
+    """
+    if timeout is None:
+        fcntl.flock(f, operation)
+        return True
+
+    deadline = time.monotonic() + timeout
+    interval = 0.05
+    while True:
+        try:
+            fcntl.flock(f, operation | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, MAX_RETRY_INTERVAL)
+
+
+@contextlib.contextmanager
+def locked(
+    log,
+    lockdir,
+    lockfile_name="fc-agent.lock",
+    *,
+    shared: bool = False,
+    timeout: Optional[float] = None,
+    purpose: Optional[str] = None,
+):
     """Execute the associated with-block exclusively.
 
-    A lockfile will be created as necessary. Once the exclusive lock has
-    been acquired, the current PID is recorded to assist debugging in
-    case of need.
+    A lockfile will be created as necessary. Once the lock has been
+    acquired, the current PID, the time and `purpose` are recorded as a line
+    in the lock file to assist debugging in case of need. The line is
+    removed again when releasing the lock.
+
+    With `shared`, the with-block can run concurrently with other shared
+    holders, but not with an exclusive holder. Use this for operations that
+    don't change anything that exclusive holders work on.
+
+    Raises LockTimeout if the lock couldn't be acquired within `timeout`
+    seconds. Without a timeout, this waits forever.
+
+    Wait and hold times are logged with the lock-locked and lock-released
+    events.
     """
 
     lockfile = Path(lockdir) / lockfile_name
+    mode = "shared" if shared else "exclusive"
+    operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
 
     if not lockfile.exists():
         lockfile.touch()
 
     with open(lockfile, "r+", buffering=1) as f:
+        wait_started = time.monotonic()
         try:
-            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(f, operation | fcntl.LOCK_NB)
         except OSError:
-            other_pid = f.read().strip() or "<unknown>"
+            holder = _holder(f)
             log.info(
                 "lock-try",
                 lockfile=str(lockfile),
-                other_pid=other_pid,
+                mode=mode,
+                purpose=purpose,
+                timeout=timeout,
+                **holder,
                 _replace_msg=(
                     "Looks like another management command is running, waiting "
-                    "for {lockfile} locked by PID {other_pid} (no timeout) ..."
+                    "for {lockfile} locked by PID {other_pid} "
+                    "({other_purpose}, timeout: {timeout}) ..."
                 ),
             )
-            fcntl.flock(f, fcntl.LOCK_EX)
+            if not _flock(f, operation, timeout):
+                holder = _holder(f)
+                log.error(
+                    "lock-timeout",
+                    lockfile=str(lockfile),
+                    mode=mode,
+                    purpose=purpose,
+                    timeout=timeout,
+                    **holder,
+                    _replace_msg=(
+                        "Could not lock {lockfile} within {timeout}s, still "
+                        "locked by PID {other_pid} ({other_purpose})."
+                    ),
+                )
+                raise LockTimeout(
+                    lockfile,
+                    timeout,
+                    f"PID {holder['other_pid']} ({holder['other_purpose']})",
+                )
 
-        f.truncate(0)
-        f.seek(0)
-        print(os.getpid(), file=f)
+        locked_at = time.monotonic()
+        own = _Holder(str(os.getpid()), round(time.time(), 3), purpose or "")
+        _add_holder(f, own, shared)
         log.debug(
             "lock-locked",
-            _replace_msg="Locked {lockfile}",
-            lockfile=lockfile,
-        )
-        yield
-        f.truncate(0)
-        fcntl.flock(f, fcntl.LOCK_UN)
-        log.debug(
-            "lock-released",
-            _replace_msg="Released {lockfile} from PID {pid}",
+            _replace_msg="Locked {lockfile} ({mode}) after {wait_seconds}s",
             lockfile=lockfile,
+            mode=mode,
+            purpose=purpose,
+            wait_seconds=round(locked_at - wait_started, 3),
         )
+        try:
+            yield
+        finally:
+            _remove_holder(f, own)
+            fcntl.flock(f, fcntl.LOCK_UN)
+            log.debug(
+                "lock-released",
+                _replace_msg="Released {lockfile} from PID {pid}",
+                lockfile=lockfile,
+                mode=mode,
+                purpose=purpose,
+                hold_seconds=round(time.monotonic() - locked_at, 3),
+            )
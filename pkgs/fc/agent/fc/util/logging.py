@@ -2,12 +2,16 @@
 # 2.0, and the MIT License.  See the LICENSE file in the root of this
 # repository for complete details.
 
+import atexit
+import functools
 import io
 import json
 import os
+import signal
 import string
 import sys
 import syslog
+import threading
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
@@ -82,14 +86,108 @@ class PartialFormatter(string.Formatter):
             self.bad_format
 
 
+class BufferedLogSink:
+    """
+    Collects messages for outputs that don't have to be written immediately
+    and writes them in batches. Loggers writing to a file (like
+    structlog.PrintLogger) get all their messages with one write and flush,
+    other loggers get their messages one after another.
+
+    Messages are written when `max_messages` are pending, `max_age` seconds
+    after the first pending message, when a message with a level of warning
+    or above arrives and when the process exits. Use `flush_on_sigterm` to
+    also write them when the process is terminated by SIGTERM.
+    """
+
+    FLUSH_LEVELS = {
+        "alert",
+        "critical",
+        "error",
+        "exception",
+        "fatal",
+        "warn",
+        "warning",
+    }
+
+    def __init__(self, max_messages=500, max_age=1.0):
+        self.max_messages = max_messages
+        self.max_age = max_age
+        self.pending = []
+        # Reentrant locks as flush may also be called from a signal handler
+        # interrupting the main thread while it holds them.
+        self.lock = threading.RLock()
+        # Held for a whole flush to keep batches from different threads in
+        # order.
+        self.write_lock = threading.RLock()
+        self.timer = None
+        atexit.register(self.flush)
+
+    def add(self, logger, message, method_name):
+        with self.lock:
+            self.pending.append((logger, message))
+            if len(self.pending) == 1:
+                self.timer = threading.Timer(self.max_age, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+            flush_now = (
+                len(self.pending) >= self.max_messages
+                or method_name in self.FLUSH_LEVELS
+            )
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+
+            files = {}
+            for logger, message in pending:
+                try:
+                    file = getattr(logger, "_file", None)
+                    if file is None:
+                        logger.msg(message)
+                    else:
+                        file.write(message + "\n")
+                        files[id(file)] = file
+                except Exception:
+                    pass
+
+            for file in files.values():
+                try:
+                    file.flush()
+                except Exception:
+                    pass
+
+    def flush_on_sigterm(self):
+        """Writes pending messages before the process is terminated by
+        SIGTERM, which doesn't run atexit handlers. Does nothing if another
+        SIGTERM handler has been installed already.
+        """
+        if signal.getsignal(signal.SIGTERM) is not signal.SIG_DFL:
+            return
+        signal.signal(signal.SIGTERM, self._flush_and_terminate)
+
+    def _flush_and_terminate(self, signum, frame):
+        self.flush()
+        # Terminate like we would have without the handler.
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+
 class MultiOptimisticLoggerFactory:
-    def __init__(self, context, factories):
+    def __init__(self, context, factories, sink=None, buffered_outputs=()):
         self.context = context
         self.factories = factories
+        self.sink = sink
+        self.buffered_outputs = buffered_outputs
 
     def __call__(self, *args):
         loggers = {k: f() for k, f in self.factories.items()}
-        return MultiOptimisticLogger(loggers)
+        return MultiOptimisticLogger(loggers, self.sink, self.buffered_outputs)
 
 
 class MultiOptimisticLogger:
@@ -98,30 +196,45 @@ class MultiOptimisticLogger:
     It's initialized with a logger dict where the keys are the logger names
     which correspond to the keyword arguments given to the msg method.
     If the logger's name is not present in the arguments, the logger is skipped.
+    Messages for loggers named in `buffered_outputs` go through the `sink`,
+    if given.
     Errors in sub loggers are ignored silently.
     """
 
-    def __init__(self, loggers):
+    def __init__(self, loggers, sink=None, buffered_outputs=()):
         self.loggers = loggers
+        self.sink = sink
+        self.buffered_outputs = buffered_outputs
 
     def __repr__(self):
         return "<MultiOptimisticLogger {}>".format(
             [repr(l) for l in self.loggers]
         )
 
-    def msg(self, **messages):
+    def _log(self, method_name, **messages):
         for name, logger in self.loggers.items():
             try:
                 line = messages.get(name)
-                if line:
+                if not line:
+                    continue
+                if self.sink is not None and name in self.buffered_outputs:
+                    self.sink.add(logger, line, method_name)
+                else:
                     logger.msg(line)
             except Exception:
                 # We're being really optimistic: we want the calling program
                 # to continue even if we face huge troubles logging stuff.
                 pass
 
+    def msg(self, **messages):
+        self._log("msg", **messages)
+
+    def flush(self):
+        if self.sink is not None:
+            self.sink.flush()
+
     def __getattr__(self, name):
-        return self.msg
+        return functools.partial(self._log, name)
 
 
 class DummyJournalLogger:
@@ -149,6 +262,8 @@ class JournalLoggerFactory:
 
 
 class CmdOutputFileRenderer:
+    outputs = ("cmd_output_file",)
+
     def __call__(self, logger, method_name, event_dict):
         line = event_dict.pop("cmd_output_line", None)
         if line is not None:
@@ -177,6 +292,8 @@ class ConsoleFileRenderer:
     specific knowledge about fc.agent structures.
     """
 
+    outputs = ("console", "file")
+
     LEVELS = [
         "alert",
         "critical",
@@ -225,11 +342,22 @@ class ConsoleFileRenderer:
         if log_settings.get("console_ignore", False):
             return
 
+        # Filter according to the -v switch when outputting to the
+        # console.
+        active_outputs = getattr(logger, "loggers", self.outputs)
+        render_console = (
+            "console" in active_outputs
+            and self.LEVELS.index(method_name.lower()) <= self.min_level
+        )
+        if not render_console and "file" not in active_outputs:
+            return {}
+
         console_io = io.StringIO()
         log_io = io.StringIO()
 
         def write(line):
-            console_io.write(line)
+            if render_console:
+                console_io.write(line)
             if RESET_ALL:
                 for SYMB in [
                     RESET_ALL,
@@ -330,12 +458,6 @@ class ConsoleFileRenderer:
         if exception_traceback is not None:
             write("\n" + prefix("exception", exception_traceback))
 
-        # Filter according to the -v switch when outputting to the
-        # console.
-        if self.LEVELS.index(method_name.lower()) > self.min_level:
-            console_io.seek(0)
-            console_io.truncate()
-
         message = {"console": console_io.getvalue(), "file": log_io.getvalue()}
         return message
 
@@ -358,7 +480,16 @@ class MultiRenderer:
 
     def __call__(self, logger, method_name, event_dict):
         merged_messages = {}
+        active_outputs = getattr(logger, "loggers", None)
         for renderer in self.renderers.values():
+            outputs = getattr(renderer, "outputs", None)
+            if (
+                active_outputs is not None
+                and outputs is not None
+                and active_outputs.keys().isdisjoint(outputs)
+            ):
+                # Nobody would get the rendered message.
+                continue
             try:
                 messages = renderer(logger, method_name, event_dict.copy())
                 merged_messages.update(messages)
@@ -420,6 +551,8 @@ KEYS_TO_SKIP_IN_JOURNAL_MESSAGE = [
 
 
 class SystemdJournalRenderer:
+    outputs = ("journal",)
+
     def __init__(self, syslog_identifier, syslog_facility=syslog.LOG_LOCAL0):
         self.syslog_identifier = syslog_identifier
         self.syslog_facility = syslog_facility
@@ -486,6 +619,10 @@ class SystemdJournalRenderer:
         """
         if isinstance(obj, str):
             return obj
+        elif obj is None or obj is True or obj is False:
+            return {None: "null", True: "true", False: "false"}[obj]
+        elif type(obj) is int:
+            return str(obj)
         elif isinstance(obj, datetime):
             return datetime.isoformat(obj)
         else:
@@ -609,6 +746,8 @@ def drop_cmd_output_logfile(log):
         raise
 
     cmd_log_file = cmd_output_file_factory._file
+    if logger_factory.sink is not None:
+        logger_factory.sink.flush()
 
     log.debug(
         "logging-cmd-output-drop",
@@ -626,7 +765,12 @@ def init_logging(
     log_to_console: bool = True,
     syslog_identifier="fc-agent",
     show_caller_info: bool = False,
+    buffered: bool = False,
 ):
+    """
+    With `buffered`, messages for the log files and the journal are written
+    in batches by a BufferedLogSink. Console output is never delayed.
+    """
     multi_renderer = MultiRenderer(
         journal=SystemdJournalRenderer(syslog_identifier, syslog.LOG_LOCAL1),
         cmd_output_file=CmdOutputFileRenderer(),
@@ -666,10 +810,20 @@ def init_logging(
     if log_to_console and not (journal and os.environ.get("JOURNAL_STREAM")):
         loggers["console"] = structlog.PrintLoggerFactory(sys.stderr)
 
+    if buffered:
+        sink = BufferedLogSink()
+        sink.flush_on_sigterm()
+        buffered_outputs = ("file", "journal", "cmd_output_file")
+    else:
+        sink = None
+        buffered_outputs = ()
+
     structlog.configure(
         processors=processors,
         wrapper_class=structlog.BoundLogger,
-        logger_factory=MultiOptimisticLoggerFactory(context, loggers),
+        logger_factory=MultiOptimisticLoggerFactory(
+            context, loggers, sink, buffered_outputs
+        ),
     )
 
     log = structlog.get_logger()
@@ -684,3 +838,14 @@ def init_logging(
 def logging_initialized():
     logger_factory = structlog.get_config()["logger_factory"]
     return isinstance(logger_factory, MultiOptimisticLoggerFactory)
+
+
+def flush_buffered_logs():
+    """Writes pending messages of buffered outputs now. Call this before
+    actions that may end the process without running atexit handlers, like
+    rebooting the machine.
+    """
+    logger_factory = structlog.get_config()["logger_factory"]
+    sink = getattr(logger_factory, "sink", None)
+    if sink is not None:
+        sink.flush()
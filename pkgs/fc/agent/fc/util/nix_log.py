@@ -0,0 +1,172 @@
+"""Streaming parser for Nix' internal JSON log format.
+
+With `--log-format internal-json`, Nix writes one message per line to
+stderr, prefixed with `@nix `. Messages start and stop activities (like
+building a derivation or substituting a store path), report results for
+them (like progress) or are plain log messages.
+
+`BuildProgress` consumes these lines as they appear and keeps statistics
+about evaluation, builds, substitutions and transferred bytes. Plain log
+messages are collected as text so errors can still be found like in normal
+Nix output.
+"""
+
+import json
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+import structlog
+
+_log = structlog.get_logger()
+
+PREFIX = "@nix "
+
+# Activity types, see ActivityType in Nix' logging.hh.
+ACT_COPY_PATH = 100
+ACT_FILE_TRANSFER = 101
+ACT_REALISE = 102
+ACT_COPY_PATHS = 103
+ACT_BUILDS = 104
+ACT_BUILD = 105
+ACT_SUBSTITUTE = 108
+
+# Result types, see ResultType in Nix' logging.hh.
+RES_PROGRESS = 105
+
+# Activities which mean that evaluation is finished.
+REALISATION_ACTIVITIES = {
+    ACT_REALISE,
+    ACT_COPY_PATHS,
+    ACT_BUILDS,
+    ACT_BUILD,
+    ACT_SUBSTITUTE,
+}
+
+# Levels of messages which are kept as text (error, warn, notice, info).
+TEXT_LEVELS = 3
+
+RE_ANSI = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+
+
+def _store_path_name(path):
+    """Returns the part after the hash of store paths."""
+    name = path.rsplit("/", 1)[-1]
+    return name.split("-", 1)[-1] if "-" in name else name
+
+
+@dataclass
+class _Activity:
+    type: int
+    name: str
+    started: float
+    done: int = 0
+
+
+@dataclass
+class BuildProgress:
+    log: object = _log
+    started: float = field(default_factory=time.monotonic)
+    finished: Optional[float] = None
+    realisation_started: Optional[float] = None
+    builds: int = 0
+    build_seconds: float = 0.0
+    substitutions: int = 0
+    substitution_seconds: float = 0.0
+    copied_bytes: int = 0
+    downloaded_bytes: int = 0
+    text_lines: list[str] = field(default_factory=list)
+    _activities: dict[int, _Activity] = field(default_factory=dict)
+
+    def feed(self, line: str):
+        """Processes a line of stderr output."""
+        if not line.startswith(PREFIX):
+            # Output which doesn't come from the Nix logger, for example
+            # from builders.
+            self.text_lines.append(line.rstrip("\n"))
+            return
+        try:
+            message = json.loads(line[len(PREFIX) :])
+            handler = getattr(self, "_" + message["action"], None)
+            if handler is not None:
+                handler(message)
+        except (ValueError, KeyError, TypeError, IndexError):
+            self.log.debug("nix-log-unparseable", line=line.strip())
+
+    def _msg(self, message):
+        if message.get("level", 0) <= TEXT_LEVELS:
+            text = RE_ANSI.sub("", message["msg"])
+            self.text_lines.extend(text.splitlines())
+
+    def _start(self, message):
+        now = time.monotonic()
+        type_ = message.get("type", 0)
+        fields = message.get("fields") or []
+        name = _store_path_name(fields[0]) if fields else message.get("text")
+        self._activities[message["id"]] = _Activity(type_, name, now)
+        if (
+            type_ in REALISATION_ACTIVITIES
+            and self.realisation_started is None
+        ):
+            self.realisation_started = now
+
+    def _result(self, message):
+        activity = self._activities.get(message["id"])
+        if activity is not None and message["type"] == RES_PROGRESS:
+            activity.done = message["fields"][0]
+
+    def _stop(self, message):
+        activity = self._activities.pop(message["id"], None)
+        if activity is None:
+            return
+        duration = time.monotonic() - activity.started
+        if activity.type == ACT_BUILD:
+            self.builds += 1
+            self.build_seconds += duration
+            kind = "build"
+        elif activity.type == ACT_SUBSTITUTE:
+            self.substitutions += 1
+            self.substitution_seconds += duration
+            kind = "substitute"
+        elif activity.type == ACT_COPY_PATH:
+            self.copied_bytes += activity.done
+            return
+        elif activity.type == ACT_FILE_TRANSFER:
+            self.downloaded_bytes += activity.done
+            return
+        else:
+            return
+        self.log.debug(
+            "system-build-step",
+            kind=kind,
+            name=activity.name,
+            duration=round(duration, 2),
+        )
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    @property
+    def text(self) -> str:
+        """Log messages and other output as Nix would print them."""
+        return "\n".join(self.text_lines)
+
+    @property
+    def changed(self) -> bool:
+        """True if something had to be built or substituted."""
+        return bool(self.builds or self.substitutions)
+
+    def stats(self) -> dict:
+        finished = self.finished or time.monotonic()
+        realisation_started = self.realisation_started or finished
+        return {
+            "duration": round(finished - self.started, 2),
+            "evaluation_seconds": round(realisation_started - self.started, 2),
+            "builds": self.builds,
+            "build_seconds": round(self.build_seconds, 2),
+            "substitutions": self.substitutions,
+            "substitution_seconds": round(self.substitution_seconds, 2),
+            "copied_bytes": self.copied_bytes,
+            "downloaded_bytes": self.downloaded_bytes,
+        }
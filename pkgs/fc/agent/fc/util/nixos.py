@@ -1,24 +1,31 @@
 """Helpers for interaction with the NixOS system"""
+import functools
 import itertools
+import json
 import os
 import os.path as p
 import re
 import resource
 import subprocess
+from datetime import datetime, timezone
 from pathlib import Path
 from subprocess import PIPE, STDOUT
 from typing import Optional
 
-import requests
 import structlog
-from fc.util.subprocess_helper import (
-    get_popen_stderr_lines,
-    get_popen_stdout_lines,
-)
+from fc.util import channel_cache, closure_cache, nix_log
+from fc.util.subprocess_helper import communicate_lines
 
 _log = structlog.get_logger()
 
-requests_session = requests.session()
+
+@functools.cache
+def get_requests_session():
+    # requests is slow to import and only needed to resolve channel URLs.
+    import requests
+
+    return requests.session()
+
 
 PHRASES = re.compile(r"would (\w+) the following units: (.*)$")
 FC_ENV_FILE = "/etc/fcio_environment_name"
@@ -27,6 +34,14 @@ RE_FC_CHANNEL = re.compile(
 )
 
 
+# Statistics of the last system build with structured log, used for metrics.
+# Only written if the directory exists.
+SYSTEM_BUILD_STATS_FILE = Path("/var/cache/fc-agent/system-build.json")
+
+# Keeps a prepared system alive until it's activated. Unlike the indirect
+# root created by nix-build for an out link in /run, this survives reboots.
+NEXT_SYSTEM_GC_ROOT = Path("/nix/var/nix/gcroots/fc-agent/next-system")
+
 UnitChanges = dict[str, list[str]]
 
 
@@ -99,6 +114,12 @@ def current_fc_environment_name(log=_log):
 
 
 def channel_version(channel_url, log=_log):
+    cache = channel_cache.get_cache()
+    version = cache.version(channel_url)
+    if version is not None:
+        log.debug("channel-version-cached", channel=channel_url)
+        return version
+
     try:
         nixpkgs_path = subprocess.run(
             ["nix-instantiate", "-I", channel_url, "--find-file", "."],
@@ -116,6 +137,7 @@ def channel_version(channel_url, log=_log):
 
     version = Path(nixpkgs_path, ".version").read_text()
     suffix = Path(nixpkgs_path, ".version-suffix").read_text()
+    cache.set_version(channel_url, version + suffix)
 
     return version + suffix
 
@@ -158,7 +180,11 @@ def current_nixos_channel_version():
     return "".join(open(f).read() for f in label_comp)
 
 
+_nix_channels_cache = (None, None)
+
+
 def current_nixos_channel_url(log=_log) -> Optional[str]:
+    global _nix_channels_cache
     if not p.exists("/root/.nix-channels"):
         log.warn(
             "nix-channel-file-missing",
@@ -166,11 +192,18 @@ def current_nixos_channel_url(log=_log) -> Optional[str]:
         )
         return
     try:
+        # nix-channel replaces the file, a new mtime means new content.
+        mtime_ns = os.stat("/root/.nix-channels").st_mtime_ns
+        cached_mtime_ns, url = _nix_channels_cache
+        if mtime_ns == cached_mtime_ns:
+            log.debug("nixos-channel-found", channel=url, cached=True)
+            return url
         with open("/root/.nix-channels") as f:
             for line in f.readlines():
                 url, name = line.strip().split(" ", 1)
                 if name == "nixos":
                     log.debug("nixos-channel-found", channel=url)
+                    _nix_channels_cache = (mtime_ns, url)
                     return url
     except OSError:
         log.error(
@@ -192,8 +225,14 @@ def resolve_url_redirects(url):
     if not url.endswith("nixexprs.tar.xz"):
         url = p.join(url, "nixexprs.tar.xz")
 
-    res = requests_session.head(url, allow_redirects=True)
+    cache = channel_cache.get_cache()
+    resolved_url = cache.redirect(url)
+    if resolved_url is not None:
+        return resolved_url
+
+    res = get_requests_session().head(url, allow_redirects=True)
     res.raise_for_status()
+    cache.set_redirect(url, res.url)
 
     return res.url
 
@@ -277,16 +316,15 @@ def update_system_channel(channel_url, log=_log):
         cmd_pid=proc.pid,
     )
 
-    stdout_lines = get_popen_stdout_lines(
-        proc, log, "system-channel-update-out"
-    )
-    stdout = "".join(stdout_lines)
-    proc.wait()
+    result = communicate_lines(proc, log, "system-channel-update-out")
+    stdout = result.stdout
 
-    if proc.returncode == 0:
+    if result.returncode == 0:
         log.debug("system-channel-update-succeeded")
+        # Channel URLs may point to newer releases now.
+        channel_cache.get_cache().invalidate_redirects()
     else:
-        stderr = proc.stderr.read()
+        stderr = result.stderr
         log.error(
             "system-channel-update-failed",
             _replace_msg="System channel update failed, see command output for details.",
@@ -367,21 +405,53 @@ def get_free_store_disk_space(log):
 
 
 def system_closure_size(log, system_path: Path):
-    args = ["nix", "path-info", "-S", system_path]
+    """Returns the closure size of the system in bytes.
+
+    Results and the sizes of all store paths in the closure are cached, so
+    only the sizes of paths which haven't been seen before are queried.
+    """
+    store_path = os.path.realpath(system_path)
+    cache = closure_cache.get_cache()
+    size = cache.closure_size(store_path)
+    if size is not None:
+        log.debug("system-closure-size-cached", system=store_path, size=size)
+        return size
+
+    args = ["nix-store", "--query", "--requisites", store_path]
     try:
-        result = subprocess.run(
+        requisites = subprocess.run(
             args,
             check=True,
             capture_output=True,
             text=True,
-        )
-        size = result.stdout.split()[1]
+        ).stdout.split()
+        unknown = cache.unknown_paths(requisites)
+        new_path_sizes = {}
+        if unknown:
+            args = ["nix", "path-info", "--size", *unknown]
+            result = subprocess.run(
+                args,
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            for line in result.stdout.splitlines():
+                path, path_size = line.split()
+                new_path_sizes[path] = int(path_size)
 
     except subprocess.CalledProcessError:
         log.error("nix-path-info-failed", args=args, exc_info=True)
         raise
 
-    return int(size)
+    size = cache.add_closure(store_path, requisites, new_path_sizes)
+    log.debug(
+        "system-closure-size",
+        system=store_path,
+        size=size,
+        paths=len(requisites),
+        queried_paths=len(unknown),
+    )
+    return size
 
 
 def _increase_soft_fd_limit():
@@ -404,12 +474,69 @@ def _increase_soft_fd_limit():
     resource.setrlimit(resource.RLIMIT_NOFILE, (soft_limit, hard_limit))
 
 
+def _lower_priority():
+    """Runs the process with the lowest CPU priority. Without an explicit
+    IO priority, the kernel derives the (lowest) best-effort IO priority from
+    it. Also increases the fd limit, see `_increase_soft_fd_limit`.
+
+    To be used with the `preexec_fn` argument of `Popen`.
+    """
+    _increase_soft_fd_limit()
+    os.setpriority(os.PRIO_PROCESS, 0, 19)
+
+
+def save_system_build_stats(stats: dict, success: bool, log=_log):
+    if not SYSTEM_BUILD_STATS_FILE.parent.is_dir():
+        return
+    data = {
+        **stats,
+        "success": success,
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+    }
+    try:
+        SYSTEM_BUILD_STATS_FILE.write_text(json.dumps(data))
+    except OSError:
+        log.warning("system-build-stats-save-failed", exc_info=True)
+
+
+def system_build_metrics() -> dict:
+    """Returns telegraf fields for the last system build with structured
+    log, or an empty dict if there is none.
+    """
+    try:
+        data = json.loads(SYSTEM_BUILD_STATS_FILE.read_text())
+        finished_at = datetime.fromisoformat(data.pop("finished_at"))
+    except (OSError, ValueError, KeyError):
+        return {}
+    metrics = {
+        f"last_system_build_{key}": int(value) if key == "success" else value
+        for key, value in data.items()
+    }
+    metrics["last_system_build_finished_seconds_ago"] = int(
+        (datetime.now(timezone.utc) - finished_at).total_seconds()
+    )
+    return metrics
+
+
 def build_system(
-    channel_url=None, build_options=None, out_link=None, log=_log
+    channel_url=None,
+    build_options=None,
+    out_link=None,
+    log=_log,
+    low_priority=False,
+    structured_log=False,
 ):
     """
     Build system with this channel. Works like nixos-rebuild build.
     Does not modify the running system.
+
+    Builds ahead of time should use `low_priority` to reduce the impact on
+    the running system.
+
+    With `structured_log`, Nix' internal JSON log is parsed while building.
+    Completed builds and substitutions are logged as `system-build-step`
+    and a summary as `system-build-stats`. The summary is also saved for
+    `system_build_metrics`.
     """
     rlimit_nofile = resource.getrlimit(resource.RLIMIT_NOFILE)
 
@@ -418,6 +545,7 @@ def build_system(
         channel=channel_url,
         soft_file_descriptor_limit=rlimit_nofile[0],
         hard_file_descriptor_limit=rlimit_nofile[1],
+        low_priority=low_priority,
     )
 
     cmd = [
@@ -439,6 +567,13 @@ def build_system(
     if build_options is not None:
         cmd.extend(build_options)
 
+    if structured_log:
+        cmd.extend(["--log-format", "internal-json"])
+        progress = nix_log.BuildProgress(log=log)
+        stderr_callback = progress.feed
+    else:
+        stderr_callback = None
+
     log.debug("system-build-command", cmd=" ".join(cmd))
 
     proc = subprocess.Popen(
@@ -446,7 +581,9 @@ def build_system(
         stdout=PIPE,
         stderr=PIPE,
         text=True,
-        preexec_fn=_increase_soft_fd_limit,
+        preexec_fn=_lower_priority
+        if low_priority
+        else _increase_soft_fd_limit,
     )
     log.info(
         "system-build-started",
@@ -454,27 +591,44 @@ def build_system(
         cmd_pid=proc.pid,
     )
 
-    stderr_lines = get_popen_stderr_lines(proc, log, "system-build-out")
-    stderr = "".join(stderr_lines).strip()
-    proc.wait()
+    result = communicate_lines(
+        proc, log, "system-build-out", stderr_callback=stderr_callback
+    )
+
+    if structured_log:
+        progress.finish()
+        stderr = progress.text.strip()
+        stats = progress.stats()
+        log.info(
+            "system-build-stats",
+            _replace_msg=(
+                "Build took {duration}s: evaluation {evaluation_seconds}s, "
+                "{substitutions} substitutions, {builds} builds."
+            ),
+            **stats,
+        )
+        save_system_build_stats(stats, result.returncode == 0, log)
+    else:
+        stderr = result.stderr.strip()
 
-    if stderr:
+    if stderr or (structured_log and progress.changed):
         changed = True
     else:
         stderr = None
         changed = False
 
-    if proc.returncode == 0:
+    if result.returncode == 0:
         if changed:
             msg = "Successfully built new system (closure size {size})."
         else:
             msg = "No building needed, wanted system was already present."
 
-        system_path = proc.stdout.read().strip()
+        system_path = result.stdout.strip()
         try:
             size_bytes = system_closure_size(log, Path(system_path))
             size_humanized = f"{size_bytes/1024**3:.1f} GiB"
         except Exception:
+            size_bytes = None
             size_humanized = None
 
         log.info(
@@ -487,7 +641,7 @@ def build_system(
     else:
         build_error = find_nix_build_error(stderr, log)
         msg = build_error.replace("}", "}}").replace("{", "{{")
-        stdout = proc.stdout.read().strip() or None
+        stdout = result.stdout.strip() or None
         log.error(
             "system-build-failed",
             # we need to escape the curly braces because _replace_msg is
@@ -499,7 +653,11 @@ def build_system(
         raise BuildFailed(msg=msg, stdout=stdout, stderr=stderr)
 
     log.debug(
-        "system-build-finished", system=system_path, size_bytes=size_bytes
+        "system-build-finished",
+        system=system_path,
+        size_bytes=size_bytes,
+        cpu_seconds=result.cpu_seconds,
+        max_rss_kib=result.max_rss_kib,
     )
     assert system_path.startswith(
         "/nix/store/"
@@ -508,6 +666,31 @@ def build_system(
     return system_path
 
 
+def pin_system(system_path, gc_root=NEXT_SYSTEM_GC_ROOT, log=_log):
+    """Protects the system from garbage collection until `unpin_system` is
+    called for it. Replaces a system pinned before.
+    """
+    gc_root = Path(gc_root)
+    gc_root.parent.mkdir(parents=True, exist_ok=True)
+    tmp_link = gc_root.with_name(gc_root.name + ".tmp")
+    tmp_link.unlink(missing_ok=True)
+    tmp_link.symlink_to(system_path)
+    tmp_link.rename(gc_root)
+    log.debug("system-pinned", system=system_path, gc_root=str(gc_root))
+
+
+def unpin_system(system_path, gc_root=NEXT_SYSTEM_GC_ROOT, log=_log):
+    """Removes the GC root if it still points to the given system."""
+    gc_root = Path(gc_root)
+    try:
+        if os.readlink(gc_root) != system_path:
+            return
+        gc_root.unlink()
+    except FileNotFoundError:
+        return
+    log.debug("system-unpinned", system=system_path, gc_root=str(gc_root))
+
+
 def switch_to_system(system_path, lazy, log=_log):
     if lazy and p.realpath("/run/current-system") == system_path:
         log.info(
@@ -534,11 +717,10 @@ def switch_to_system(system_path, lazy, log=_log):
         cmd_pid=proc.pid,
     )
 
-    stdout_lines = get_popen_stdout_lines(proc, log, "system-switch-out")
-    stdout = "".join(stdout_lines)
-    proc.wait()
+    result = communicate_lines(proc, log, "system-switch-out")
+    stdout = result.stdout
 
-    if proc.returncode == 0:
+    if result.returncode == 0:
         log.info(
             "system-switch-succeeded",
             _replace_msg="Completed switch to new system configuration.",
@@ -567,10 +749,10 @@ def dry_activate_system(system_path, log=_log) -> UnitChanges:
     log.debug("system-dry-activate-cmd", cmd=" ".join(cmd))
 
     proc = subprocess.Popen(cmd, stdout=PIPE, stderr=STDOUT, text=True)
-    stdout_lines = get_popen_stdout_lines(proc, log, "system-dry-activate-out")
-    proc.wait()
+    result = communicate_lines(proc, log, "system-dry-activate-out")
+    stdout_lines = result.stdout_lines
 
-    if proc.returncode != 0:
+    if result.returncode != 0:
         log.error(
             "system-dry-activate-failed",
             msg="Dry-activating the new system failed!",
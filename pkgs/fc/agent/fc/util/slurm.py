@@ -1,14 +1,15 @@
+import os
 import socket
 import subprocess
 import time
 from collections import Counter
 from enum import Enum
 from functools import reduce
-from typing import NamedTuple, Optional
+from pathlib import Path
+from typing import NamedTuple, Optional, Protocol
 
 import pyslurm
 from fc.util.checks import CheckResult
-from fc.util.directory import directory_connection, is_node_in_service
 
 
 class NodeStateError(Exception):
@@ -22,6 +23,100 @@ class NodeStateTimeout(Exception):
         self.remaining_node_states = remaining_node_states
 
 
+# Upper bound for the pause between two requests to the controller while
+# waiting for node states.
+MAX_POLL_INTERVAL = 15
+
+# Interval for looking at job steps on this machine. This doesn't talk to
+# the controller.
+LOCAL_CHECK_INTERVAL = 1
+
+
+class NodeEvents(Protocol):
+    def wait(self, seconds: float) -> bool:
+        """Blocks for at most `seconds`. Returns True early if something
+        happened that probably changed the state of waited nodes.
+        """
+
+
+def local_job_steps(proc_dir=Path("/proc")) -> Optional[set[int]]:
+    """Returns the PIDs of slurmstepd processes on this machine. There's at
+    least one for every job that's running here. Returns None if /proc can't
+    be read.
+    """
+    pids = set()
+    try:
+        entries = list(os.scandir(proc_dir))
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(os.path.join(entry.path, "comm")) as f:
+                if f.read().strip() == "slurmstepd":
+                    pids.add(int(entry.name))
+        except OSError:
+            # The process exited in the meantime.
+            continue
+    return pids
+
+
+class LocalJobEvents:
+    """Wakes up the waiter when the last job step on this machine has
+    finished.
+
+    slurmd reports finished jobs to the controller on its own, so the node
+    state will change shortly after that. Jobs that are still running keep
+    the node busy anyway, so finished steps of other jobs are not reported.
+
+    The job steps are looked up once. After that, only their /proc entries
+    are checked, which is cheap and doesn't load the controller. /proc is
+    scanned again when all known job steps are gone to find steps started
+    in the meantime.
+    """
+
+    def __init__(self, proc_dir=Path("/proc")):
+        self.proc_dir = proc_dir
+        self.job_steps = local_job_steps(proc_dir) or set()
+
+    def wait(self, seconds: float) -> bool:
+        deadline = time.monotonic() + seconds
+        while (remaining := deadline - time.monotonic()) > 0:
+            if not self.job_steps:
+                # Nothing running here that we could wait for.
+                time.sleep(remaining)
+                break
+            time.sleep(min(LOCAL_CHECK_INTERVAL, remaining))
+            self.job_steps = {
+                pid
+                for pid in self.job_steps
+                if os.path.exists(os.path.join(self.proc_dir, str(pid)))
+            }
+            if self.job_steps:
+                continue
+            job_steps = local_job_steps(self.proc_dir)
+            if job_steps == set():
+                return True
+            self.job_steps = job_steps or set()
+        return False
+
+
+def _wait_pause(log, event, ii: int, events: Optional[NodeEvents]) -> int:
+    """Pauses before the next request to the controller. The pause grows
+    exponentially and starts again with a short one after an event.
+    Returns the new value for the pause counter `ii`.
+    """
+    pause = min([MAX_POLL_INTERVAL, 2**ii])
+    log.debug(event, sleep=pause)
+    if events is None:
+        time.sleep(pause)
+    elif events.wait(pause):
+        log.debug(event + "-woken-up")
+        return 0
+    return ii + 1
+
+
 class DrainingAction(Enum):
     NO_OP = 0
     DRAIN = 1
@@ -38,6 +133,14 @@ def get_node_info(node_name):
     return pyslurm.node().get_node(node_name)[node_name]
 
 
+def get_node_infos(node_names) -> dict[str, dict]:
+    """Gets the info for all `node_names` with a single request to the
+    controller instead of one request per node.
+    """
+    all_node_infos = pyslurm.node().get()
+    return {node_name: all_node_infos[node_name] for node_name in node_names}
+
+
 def is_node_in_error(node_info):
     state, *flags = node_info["state"].split("+")
     return state == "ERROR"
@@ -104,10 +207,11 @@ def update_nodes(state_change: dict):
     return pyslurm.node().update(state_change)
 
 
-def run_drain_pre_checks(log, node_name, strict_state_check):
+def run_drain_pre_checks(log, node_name, strict_state_check, node_info=None):
     log = log.bind(node=node_name)
 
-    node_info = get_node_info(node_name)
+    if node_info is None:
+        node_info = get_node_info(node_name)
     state, *flags = node_info["state"].split("+")
 
     if is_node_drained(log.bind(op="pre-check"), node_info):
@@ -162,6 +266,7 @@ def drain(
     timeout: int,
     reason: str,
     strict_state_check: bool = False,
+    events: Optional[NodeEvents] = None,
 ):
     log.debug(
         "drain-start",
@@ -206,10 +311,7 @@ def drain(
             )
             return
 
-        pause = min([15, 2**ii])
-        log.debug("drain-wait", sleep=pause)
-        time.sleep(pause)
-        ii += 1
+        ii = _wait_pause(log, "drain-wait", ii, events)
         elapsed = time.time() - start_time
 
     state_str = get_node_info(node_name)["state"]
@@ -233,14 +335,18 @@ def drain_many(
     timeout: int,
     reason: str,
     strict_state_check: bool = False,
+    events: Optional[NodeEvents] = None,
 ):
     log.debug("drain-many-start", nodes=node_names)
 
     nodes_to_drain = set()
     nodes_to_wait_for = set()
+    node_infos = get_node_infos(node_names)
 
     for node_name in node_names:
-        check_result = run_drain_pre_checks(log, node_name, strict_state_check)
+        check_result = run_drain_pre_checks(
+            log, node_name, strict_state_check, node_infos[node_name]
+        )
 
         match check_result.draining_action:
             case DrainingAction.NO_OP:
@@ -279,9 +385,8 @@ def drain_many(
 
     while elapsed < timeout:
         drained_nodes = set()
-        for node_name in nodes_to_wait_for:
-            node_info = get_node_info(node_name)
-
+        node_infos = get_node_infos(nodes_to_wait_for)
+        for node_name, node_info in node_infos.items():
             drain_log = log.bind(
                 op="drain-wait", elapsed=int(elapsed), timeout=timeout
             )
@@ -313,16 +418,14 @@ def drain_many(
             num_waiting_nodes=len(nodes_to_wait_for),
         )
 
-        pause = min([15, 2**ii])
-        log.debug("drain-wait", sleep=pause)
-        time.sleep(pause)
-        ii += 1
+        ii = _wait_pause(log, "drain-wait", ii, events)
         elapsed = time.time() - start_time
 
     # Loop finished => time limit reached
 
     remaining_node_states = {
-        o: get_node_info(o)["state"] for o in nodes_to_wait_for
+        node_name: node_info["state"]
+        for node_name, node_info in get_node_infos(nodes_to_wait_for).items()
     }
 
     log.error(
@@ -384,9 +487,11 @@ def run_ready_pre_checks(
     reason_must_match,
     skip_in_maintenance,
     directory,
+    node_info=None,
 ):
     log = log.bind(node=node_name)
-    node_info = get_node_info(node_name)
+    if node_info is None:
+        node_info = get_node_info(node_name)
     state, *flags = node_info["state"].split("+")
     log.debug("ready-pre-node-state", state=state, flags=flags)
 
@@ -431,6 +536,8 @@ def run_ready_pre_checks(
         )
         return ReadyPreCheckResult(state, flags, action=False)
 
+    from fc.util.directory import is_node_in_service
+
     if skip_in_maintenance and not is_node_in_service(directory, node_name):
         log.info(
             "ready-pre-not-in-service",
@@ -503,10 +610,12 @@ def ready_many(
     reason_must_match: Optional[str] = None,
     skip_in_maintenance=False,
     directory=None,
+    events: Optional[NodeEvents] = None,
 ):
     log.debug("ready-many-start", nodes=node_names)
 
     nodes_to_wait_for = set()
+    node_infos = get_node_infos(node_names)
 
     for node_name in node_names:
         check_result = run_ready_pre_checks(
@@ -516,6 +625,7 @@ def ready_many(
             reason_must_match,
             skip_in_maintenance,
             directory,
+            node_infos[node_name],
         )
         if check_result.action:
             nodes_to_wait_for.add(node_name)
@@ -546,9 +656,8 @@ def ready_many(
 
     while elapsed < timeout:
         ready_nodes = set()
-        for node_name in nodes_to_wait_for:
-            node_info = get_node_info(node_name)
-
+        node_infos = get_node_infos(nodes_to_wait_for)
+        for node_name, node_info in node_infos.items():
             if is_node_ready(node_info):
                 log.info(
                     "node-ready",
@@ -576,16 +685,14 @@ def ready_many(
             num_waiting_nodes=len(nodes_to_wait_for),
         )
 
-        pause = min([15, 2**ii])
-        log.debug("ready-wait", sleep=pause)
-        time.sleep(pause)
-        ii += 1
+        ii = _wait_pause(log, "ready-wait", ii, events)
         elapsed = time.time() - start_time
 
     # Loop finished => time limit reached
 
     remaining_node_states = {
-        o: get_node_info(o)["state"] for o in nodes_to_wait_for
+        node_name: node_info["state"]
+        for node_name, node_info in get_node_infos(nodes_to_wait_for).items()
     }
 
     log.error(
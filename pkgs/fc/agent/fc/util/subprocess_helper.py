@@ -1,48 +1,178 @@
 """Helpers for dealing with subprocesses"""
 
+import codecs
+import collections
+import os
+import selectors
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
 
-def get_popen_stdout_lines(popen, log=None, log_event=None):
-    """Reads stdout line-by-line from a Popen object until the stream ends
-    and returns a list of all received lines.
-    Every line logged at trace level as it appears.
+# Lines longer than this are split to bound memory use for the line buffer.
+MAX_LINE_LENGTH = 64 * 1024
 
-    WARNING: this is intended for (Nix) commands that return their main output
-    on stdout and not much on stderr.
+# Interval for checking timeouts and cancellation while waiting for output.
+POLL_INTERVAL = 0.5
 
-    Using it for a command that has a lot of output on stderr, too, may lead to
-    deadlocks due to OS pipe buffers filling up! Use Popen.communicate() or
-    something similar for such cases.
-    """
-    stdout_lines = []
-    line = popen.stdout.readline()
-    while line:
-        if log is None:
+
+@dataclass
+class CommandResult:
+    returncode: int
+    stdout_lines: list[str] = field(default_factory=list)
+    stderr_lines: list[str] = field(default_factory=list)
+    timed_out: bool = False
+    cancelled: bool = False
+    # From the rusage of the child, None if not available.
+    cpu_seconds: Optional[float] = None
+    max_rss_kib: Optional[int] = None
+
+    @property
+    def stdout(self) -> str:
+        return "".join(self.stdout_lines)
+
+    @property
+    def stderr(self) -> str:
+        return "".join(self.stderr_lines)
+
+
+class _LineStream:
+    """Splits raw output of a pipe into decoded lines."""
+
+    def __init__(self, name, log, log_event, line_callback, max_lines):
+        self.name = name
+        self.log = log
+        self.log_event = log_event
+        self.line_callback = line_callback
+        self.lines = collections.deque(maxlen=max_lines)
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.partial = ""
+
+    def feed(self, data: bytes):
+        text = self.partial + self.decoder.decode(data, final=not data)
+        *complete, self.partial = text.split("\n")
+        for line in complete:
+            self._emit(line + "\n")
+        while len(self.partial) > MAX_LINE_LENGTH:
+            self._emit(self.partial[:MAX_LINE_LENGTH])
+            self.partial = self.partial[MAX_LINE_LENGTH:]
+        if not data and self.partial:
+            self._emit(self.partial)
+            self.partial = ""
+
+    def _emit(self, line):
+        if self.log is None:
             print(line, end="")
         else:
-            log.trace(log_event, cmd_output_line=line.strip("\n"))
-        stdout_lines.append(line)
-        line = popen.stdout.readline()
+            self.log.trace(
+                self.log_event,
+                stream=self.name,
+                cmd_output_line=line.strip("\n"),
+            )
+        self.lines.append(line)
+        if self.line_callback is not None:
+            self.line_callback(line)
 
-    return stdout_lines
 
+def _wait_with_rusage(popen, result: CommandResult):
+    """Waits for the process, recording its rusage if it is our child."""
+    try:
+        _, status, rusage = os.wait4(popen.pid, 0)
+    except ChildProcessError:
+        # Already reaped (or not a real process).
+        popen.wait()
+    else:
+        popen.returncode = os.waitstatus_to_exitcode(status)
+        result.cpu_seconds = round(rusage.ru_utime + rusage.ru_stime, 3)
+        result.max_rss_kib = rusage.ru_maxrss
+    result.returncode = popen.returncode
 
-def get_popen_stderr_lines(popen, log, log_event):
-    """Reads stderr line-by-line from a Popen object until the stream ends
-    and returns a list of all received lines.
-    Every line logged at trace level as it appears.
 
-    WARNING: this is intended for (Nix) commands that return their main output
-    on stderr and not much on stdout.
+def poll_with_rusage(popen):
+    """Like Popen.poll, but also returns the rusage of the child when it has
+    finished. The rusage is None while it's running or if it isn't
+    available.
+    """
+    if popen.returncode is not None:
+        return popen.returncode, None
+    try:
+        pid, status, rusage = os.wait4(popen.pid, os.WNOHANG)
+    except ChildProcessError:
+        # Already reaped (or not a real process).
+        return popen.poll(), None
+    if pid == 0:
+        return None, None
+    popen.returncode = os.waitstatus_to_exitcode(status)
+    return popen.returncode, rusage
 
-    Using it for a command that has a lot of output on stdout, too, may lead to
-    deadlocks due to OS pipe buffers filling up! Use Popen.communicate() or
-    something similar for such cases.
+
+def communicate_lines(
+    popen,
+    log=None,
+    log_event=None,
+    *,
+    stdout_callback: Optional[Callable[[str], None]] = None,
+    stderr_callback: Optional[Callable[[str], None]] = None,
+    timeout: Optional[float] = None,
+    cancel: Optional[threading.Event] = None,
+    kill: Optional[Callable[[], None]] = None,
+    max_lines: Optional[int] = None,
+) -> CommandResult:
+    """Reads stdout and stderr of a Popen object concurrently until both
+    streams end, waits for the process and returns a CommandResult.
+
+    Every line is logged at trace level as it appears (or printed if `log`
+    is None) and passed to the callback for its stream. Pipes which are not
+    captured are ignored. Unlike reading one pipe after the other, this
+    can't deadlock when the process writes a lot to both.
+
+    `max_lines` keeps only that many last lines per stream in the result.
+
+    The process is killed if `timeout` seconds pass or `cancel` is set,
+    using `kill` if given, `popen.kill` otherwise. The result reports this
+    as `timed_out` or `cancelled`.
     """
-    stderr_lines = []
-    line = popen.stderr.readline()
-    while line:
-        log.trace(log_event, cmd_output_line=line.strip("\n"))
-        stderr_lines.append(line)
-        line = popen.stderr.readline()
-
-    return stderr_lines
+    deadline = None if timeout is None else time.monotonic() + timeout
+    result = CommandResult(returncode=None)
+    streams = {}
+
+    with selectors.DefaultSelector() as selector:
+        for name, pipe, callback in (
+            ("stdout", popen.stdout, stdout_callback),
+            ("stderr", popen.stderr, stderr_callback),
+        ):
+            if pipe is None:
+                continue
+            stream = _LineStream(name, log, log_event, callback, max_lines)
+            streams[name] = stream
+            selector.register(pipe.fileno(), selectors.EVENT_READ, stream)
+
+        while selector.get_map():
+            if cancel is not None and cancel.is_set():
+                result.cancelled = True
+            elif deadline is not None and time.monotonic() >= deadline:
+                result.timed_out = True
+            if result.cancelled or result.timed_out:
+                (kill or popen.kill)()
+                break
+
+            wait = POLL_INTERVAL
+            if deadline is not None:
+                wait = max(0, min(wait, deadline - time.monotonic()))
+            for key, _ in selector.select(wait):
+                data = os.read(key.fd, 65536)
+                key.data.feed(data)
+                if not data:
+                    selector.unregister(key.fd)
+
+    for stream in streams.values():
+        stream.feed(b"")
+
+    _wait_with_rusage(popen, result)
+    result.stdout_lines = (
+        list(streams["stdout"].lines) if "stdout" in streams else []
+    )
+    result.stderr_lines = (
+        list(streams["stderr"].lines) if "stderr" in streams else []
+    )
+    return result
@@ -1,13 +1,27 @@
+import os
+import threading
+
+
 class FakeCmdStream:
+    """Pipe which delivers `content`, like a stream of a real Popen."""
+
     def __init__(self, content):
         self.content = content
-        self.line_gen = (l for l in content.splitlines(keepends=True))
+        read_fd, write_fd = os.pipe()
+        self._file = os.fdopen(read_fd)
+        threading.Thread(
+            target=self._write, args=(write_fd,), daemon=True
+        ).start()
+
+    def _write(self, write_fd):
+        with os.fdopen(write_fd, "w") as f:
+            f.write(self.content)
+
+    def fileno(self):
+        return self._file.fileno()
 
     def readline(self):
-        try:
-            return next(self.line_gen)
-        except StopIteration:
-            return ""
+        return self._file.readline()
 
     def read(self):
         return self.content
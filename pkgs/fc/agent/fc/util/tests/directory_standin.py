@@ -0,0 +1,124 @@
+"""In-process stand-in for the directory XML-RPC API.
+
+Runs a real XML-RPC server on localhost in a background thread so code under
+test talks to it through `fc.util.directory.connect` like it would in
+production, including HTTP and XML marshalling overhead.
+"""
+
+import collections
+import hashlib
+import socketserver
+import threading
+from datetime import datetime, timedelta, timezone
+from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+
+class _RequestHandler(SimpleXMLRPCRequestHandler):
+    # The directory URL includes a path like /v2/api/rg-test, accept all.
+    rpc_paths = ()
+    # Keep connections alive like the real directory does.
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        """Like SimpleXMLRPCRequestHandler.do_POST, with ETag support."""
+        data = self.rfile.read(int(self.headers["content-length"]))
+        response = self.server._marshaled_dispatch(data, None, self.path)
+        headers = {"Content-type": "text/xml"}
+        status = 200
+        if self.server.etags:
+            etag = '"{}"'.format(hashlib.sha256(response).hexdigest())
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                status = 304
+                response = b""
+        with self.server.lock:
+            self.server.responses[status] += 1
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if status != 304:
+            self.send_header("Content-length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+
+class _Server(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+    # Don't wait for idle keep-alive connections on shutdown.
+    block_on_close = False
+
+
+class DirectoryStandIn:
+    """Implements the directory methods used by the agent.
+
+    Calls are counted per method name in `calls`. Methods can be added or
+    replaced with `register`. `system.multicall` is only available if
+    `multicall` is true.
+
+    With `etags`, responses carry an ETag computed from their content and
+    conditional requests for unchanged content are answered with "304 Not
+    Modified". HTTP status codes sent are counted in `responses`.
+    """
+
+    def __init__(self, multicall=True, etags=False):
+        self.calls = collections.Counter()
+        self.lock = threading.Lock()
+        self.server = _Server(
+            ("127.0.0.1", 0),
+            requestHandler=_RequestHandler,
+            allow_none=True,
+            logRequests=False,
+        )
+        self.server.etags = etags
+        self.server.lock = self.lock
+        self.server.responses = self.responses = collections.Counter()
+        self.port = self.server.server_address[1]
+        self.thread = None
+        self.register("schedule_maintenance", self.schedule_maintenance)
+        self.register("end_maintenance", lambda requests: None)
+        self.register("postpone_maintenance", lambda requests: "")
+        self.register(
+            "mark_node_service_status", lambda node, in_service: None
+        )
+        if multicall:
+            self.register("system.multicall", self.server.system_multicall)
+
+    def register(self, name, func):
+        def counted(*args):
+            with self.lock:
+                self.calls[name] += 1
+            return func(*args)
+
+        self.server.register_function(counted, name)
+
+    def schedule_maintenance(self, requests):
+        """Schedules all requests to start immediately."""
+        due = datetime.now(timezone.utc) - timedelta(seconds=1)
+        return {reqid: {"time": due.isoformat()} for reqid in requests}
+
+    def enc(self, name="test", resource_group="test") -> dict:
+        """ENC data that makes `fc.util.directory.connect` use this server."""
+        return {
+            "name": name,
+            "parameters": {
+                "directory_url": f"http://127.0.0.1:{self.port}/v2/api",
+                "directory_password": "secret",
+                "directory_ring": 1,
+                "resource_group": resource_group,
+            },
+        }
+
+    def __enter__(self):
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
@@ -0,0 +1,59 @@
+import threading
+import time
+import xmlrpc.client
+
+import pytest
+from fc.util.directory import check_nodes_in_service, connect
+from fc.util.tests.directory_standin import DirectoryStandIn
+
+
+@pytest.fixture
+def directory(monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    servicing = {"in01": True, "in02": True, "in03": True, "out01": False}
+    release = threading.Event()
+
+    def lookup_node(name):
+        if name == "slow01":
+            release.wait(5)
+        if name not in servicing and name != "slow01":
+            raise ValueError(name)
+        return {"parameters": {"servicing": servicing.get(name, True)}}
+
+    with DirectoryStandIn() as standin:
+        standin.register("lookup_node", lookup_node)
+        standin.release = release
+        yield standin
+        release.set()
+
+
+def test_check_nodes_in_service(directory):
+    result = check_nodes_in_service(
+        connect(directory.enc()), ["in01", "in02", "in03", "in01"], 5
+    )
+    assert result == ([], [])
+    assert directory.calls["lookup_node"] == 3
+
+
+def test_check_nodes_in_service_stops_at_first_failure(directory):
+    started = time.monotonic()
+    result = check_nodes_in_service(
+        connect(directory.enc()), ["slow01", "out01", "in01"], 5
+    )
+    assert time.monotonic() - started < 2
+    assert result.not_in_service == ["out01"]
+    assert "slow01" in result.unknown
+
+
+def test_check_nodes_in_service_deadline(directory):
+    started = time.monotonic()
+    result = check_nodes_in_service(
+        connect(directory.enc()), ["in01", "slow01"], 0.5
+    )
+    assert time.monotonic() - started < 2
+    assert result == ([], ["slow01"])
+
+
+def test_check_nodes_in_service_raises_errors(directory):
+    with pytest.raises(xmlrpc.client.Fault):
+        check_nodes_in_service(connect(directory.enc()), ["unknown01"], 5)
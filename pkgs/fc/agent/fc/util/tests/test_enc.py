@@ -1,8 +1,20 @@
 import json
 import unittest.mock
+import xmlrpc.client
 from pathlib import Path
 
-from fc.util.enc import initialize_enc, update_enc
+import pytest
+from fc.util.directory import DirectoryConnectionPool, connect
+from fc.util.enc import initialize_enc, update_enc, update_inventory
+from fc.util.tests.directory_standin import DirectoryStandIn
+
+INVENTORY_METHODS = {
+    "list_nodes_addresses": lambda location, net: [location, net],
+    "list_permissions": lambda: ["sudo-srv"],
+    "list_service_clients": lambda: [],
+    "list_services": lambda: [],
+    "list_users": lambda: [{"uid": "test"}],
+}
 
 
 def test_initialize_enc_should_do_nothing_when_enc_present(
@@ -67,3 +79,148 @@ def test_update_enc(
     update_inventory.assert_called_with(logger, enc_data)
     update_enc_nixos_config.assert_called_with(logger, enc_data, enc_path)
     write_system_state.assert_called_with(logger)
+
+
+def serve_inventory(directory):
+    for name, func in INVENTORY_METHODS.items():
+        directory.register(name, func)
+    directory.register("lookup_node", lambda name: {"name": name})
+
+
+@pytest.fixture
+def inventory_directory(request):
+    with DirectoryStandIn(multicall=request.param) as directory:
+        serve_inventory(directory)
+        yield directory
+
+
+@pytest.fixture
+def inventory_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr("fc.util.enc.INVENTORY_DIR", tmp_path)
+    monkeypatch.setattr("fc.util.enc.get_release_info", lambda log, enc: {})
+    return tmp_path
+
+
+def inventory_enc(directory):
+    enc = directory.enc()
+    enc["parameters"]["location"] = "test"
+    return enc
+
+
+@pytest.mark.parametrize("inventory_directory", [True, False], indirect=True)
+def test_update_inventory(inventory_directory, inventory_dir, log, logger):
+    update_inventory(logger, inventory_enc(inventory_directory))
+
+    written = {
+        path.name: json.loads(path.read_text())
+        for path in inventory_dir.glob("*.json")
+    }
+    assert written == {
+        "enc.json": {"name": "test"},
+        "addresses_srv.json": ["test", "srv"],
+        "permissions.json": ["sudo-srv"],
+        "service_clients.json": [],
+        "services.json": [],
+        "users.json": [{"uid": "test"}],
+        "releases.json": {},
+    }
+    calls = inventory_directory.calls
+    assert all(calls[name] == 1 for name in INVENTORY_METHODS)
+    multicall = "system.multicall" in inventory_directory.server.funcs
+    assert calls["system.multicall"] == int(multicall)
+    assert log.has("update-inventory-fetched", multicall=multicall)
+
+
+def test_update_inventory_skips_unchanged_inventory(
+    inventory_dir, log, logger
+):
+    users = [{"uid": "test"}]
+    with DirectoryStandIn(etags=True) as directory:
+        serve_inventory(directory)
+        directory.register("list_users", lambda: users)
+        enc = inventory_enc(directory)
+
+        update_inventory(logger, enc)
+        cache = json.loads(
+            (inventory_dir / "inventory-cache.json").read_text()
+        )
+        assert cache["etag"]
+        users_mtime = (inventory_dir / "users.json").stat().st_mtime_ns
+
+        update_inventory(logger, enc)
+        assert directory.responses == {200: 1, 304: 1}
+        assert log.has("update-inventory-unchanged")
+        assert (inventory_dir / "users.json").stat().st_mtime_ns == users_mtime
+
+        users.append({"uid": "new"})
+        update_inventory(logger, enc)
+        assert directory.responses == {200: 2, 304: 1}
+        assert json.loads((inventory_dir / "users.json").read_text()) == users
+
+        # Local changes to inventory files invalidate the cache.
+        (inventory_dir / "users.json").write_text("[]")
+        update_inventory(logger, enc)
+        assert directory.responses == {200: 3, 304: 1}
+        assert json.loads((inventory_dir / "users.json").read_text()) == users
+
+
+def test_update_inventory_does_not_cache_incomplete_inventory(
+    inventory_dir, log, logger, monkeypatch
+):
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+
+    def broken():
+        raise ValueError("broken")
+
+    with DirectoryStandIn(etags=True) as directory:
+        serve_inventory(directory)
+        directory.register("list_services", broken)
+        enc = inventory_enc(directory)
+
+        update_inventory(logger, enc)
+        update_inventory(logger, enc)
+
+    assert not (inventory_dir / "inventory-cache.json").exists()
+    assert directory.responses == {200: 4}
+    assert not log.has("update-inventory-unchanged")
+
+
+@pytest.mark.parametrize("inventory_directory", [True, False], indirect=True)
+def test_directory_batch_returns_exceptions_for_failed_calls(
+    inventory_directory, monkeypatch
+):
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+
+    def broken():
+        raise ValueError("broken")
+
+    inventory_directory.register("broken", broken)
+    directory = connect(inventory_directory.enc())
+
+    results = directory.batch([("list_users", ()), ("broken", ())])
+
+    assert results[0] == [{"uid": "test"}]
+    assert isinstance(results[1], xmlrpc.client.Fault)
+    # Failed calls are retried once.
+    assert inventory_directory.calls["broken"] == 2
+
+
+@pytest.mark.parametrize("inventory_directory", [False], indirect=True)
+def test_directory_connections_are_pooled(inventory_directory, monkeypatch):
+    pool = DirectoryConnectionPool(max_idle=2)
+    monkeypatch.setattr("fc.util.directory.POOL", pool)
+    enc = inventory_directory.enc()
+
+    for _ in range(3):
+        assert connect(enc).list_users() == [{"uid": "test"}]
+    # Falls back to parallel calls on separate proxies.
+    results = connect(enc).batch([("list_services", ())] * 4)
+    assert results == [[]] * 4
+
+    metrics = pool.metrics()
+    assert metrics["connections_opened"] <= 4
+    assert metrics["connections_opened"] + metrics["connections_reused"] == 8
+    assert metrics["calls"]["list_users"]["count"] == 3
+    assert metrics["calls"]["list_services"]["count"] == 4
+    assert metrics["calls"]["system.multicall"]["errors"] == 1
+    pool.clear()
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+
+import pytest
+from fc.util.lock import LockTimeout, locked
+
+
+def test_locked_records_holder(tmp_path, log, logger):
+    lockfile = tmp_path / "fc-agent.lock"
+    with locked(logger, tmp_path, purpose="test"):
+        pid, locked_at, purpose = lockfile.read_text().split(" ")
+        assert pid == str(os.getpid())
+        assert time.time() - float(locked_at) < 5
+        assert purpose == "test\n"
+
+    assert lockfile.read_text() == ""
+    assert log.has("lock-locked", mode="exclusive", purpose="test")
+    assert log.has("lock-released", mode="exclusive", purpose="test")
+
+
+def test_shared_locks_dont_block_each_other(tmp_path, log, logger):
+    lockfile = tmp_path / "fc-agent.lock"
+    with locked(logger, tmp_path, shared=True, purpose="first"):
+        with locked(
+            logger, tmp_path, shared=True, timeout=0, purpose="second"
+        ):
+            purposes = [
+                line.split(" ", 2)[2]
+                for line in lockfile.read_text().splitlines()
+            ]
+            assert purposes == ["first", "second"]
+        # Only the own line is removed on release.
+        assert lockfile.read_text().splitlines()[0].endswith(" first")
+        assert len(lockfile.read_text().splitlines()) == 1
+    assert lockfile.read_text() == ""
+    assert not log.has("lock-try")
+
+
+def test_exclusive_lock_times_out_on_shared_holder(tmp_path, log, logger):
+    with locked(logger, tmp_path, shared=True, purpose="reader"):
+        with pytest.raises(LockTimeout) as e:
+            with locked(logger, tmp_path, timeout=0.1, purpose="writer"):
+                pass
+
+    assert f"PID {os.getpid()} (reader)" in str(e.value)
+    assert log.has(
+        "lock-timeout",
+        mode="exclusive",
+        other_pid=str(os.getpid()),
+        other_purpose="reader",
+    )
+
+
+def test_stale_holders_are_ignored(tmp_path, log, logger):
+    lockfile = tmp_path / "fc-agent.lock"
+    # PID of a process that crashed while holding the lock.
+    lockfile.write_text(f"{2**22 + 1} 0 crashed\n")
+    with locked(logger, tmp_path, shared=True, purpose="reader"):
+        assert "crashed" not in lockfile.read_text()
+
+
+def test_exclusive_lock_times_out(tmp_path, log, logger):
+    with locked(logger, tmp_path, purpose="long build"):
+        with pytest.raises(LockTimeout) as e:
+            with locked(logger, tmp_path, shared=True, timeout=0.1):
+                pass
+
+    assert "long build" in str(e.value)
+    assert log.has(
+        "lock-timeout",
+        mode="shared",
+        other_pid=str(os.getpid()),
+        other_purpose="long build",
+    )
+
+
+def test_waits_for_lock_and_reports_wait_time(tmp_path, log, logger):
+    locked_event = threading.Event()
+
+    def hold():
+        with locked(logger, tmp_path, purpose="holder"):
+            locked_event.set()
+            time.sleep(0.2)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    locked_event.wait()
+    with locked(logger, tmp_path, timeout=5, purpose="waiter"):
+        pass
+    holder.join()
+
+    assert log.has("lock-try", purpose="waiter", other_purpose="holder")
+    waited = [
+        e
+        for e in log.events
+        if e.get("event") == "lock-locked" and e.get("purpose") == "waiter"
+    ]
+    assert waited[0]["wait_seconds"] > 0.1
+    held = [
+        e
+        for e in log.events
+        if e.get("event") == "lock-released" and e.get("purpose") == "holder"
+    ]
+    assert held[0]["hold_seconds"] >= 0.2
@@ -1,6 +1,15 @@
+import io
+import json
+import signal
+import subprocess
+import sys
 import syslog
+import textwrap
+import threading
+import unittest.mock
 
 import pytest
+import structlog
 
 try:
     from systemd import journal
@@ -8,8 +17,11 @@ except ImportError:
     journal = None
 
 from fc.util.logging import (
+    BufferedLogSink,
     JournalLogger,
     JournalLoggerFactory,
+    MultiOptimisticLoggerFactory,
+    MultiRenderer,
     SystemdJournalRenderer,
 )
 
@@ -89,3 +101,129 @@ def test_journal_renderer_replace_msg(journald_renderer):
     assert (
         rendered["journal"]["MESSAGE"] == "test-event: test msg with pid 123"
     )
+
+
+@pytest.mark.parametrize("value", [None, True, False, 0, 42, -3, 1.5, [1]])
+def test_journal_renderer_dump_matches_json(journald_renderer, value):
+    assert journald_renderer.dump_for_journal(value) == json.dumps(value)
+
+
+def test_multi_renderer_skips_renderers_without_active_output():
+    journal_renderer = unittest.mock.Mock(
+        outputs=("journal",), return_value={"journal": {}}
+    )
+    text_renderer = unittest.mock.Mock(
+        outputs=("console", "file"), return_value={"file": "line"}
+    )
+    renderer = MultiRenderer(journal=journal_renderer, text=text_renderer)
+    logger = MultiOptimisticLoggerFactory({}, {"file": unittest.mock.Mock})()
+
+    assert renderer(logger, "info", {"event": "test"}) == {"file": "line"}
+    journal_renderer.assert_not_called()
+
+
+def test_buffered_log_sink_batches_file_writes():
+    log_file = io.StringIO()
+    console = io.StringIO()
+    sink = BufferedLogSink(max_messages=3, max_age=60)
+    factory = MultiOptimisticLoggerFactory(
+        {},
+        {
+            "file": structlog.PrintLoggerFactory(log_file),
+            "console": structlog.PrintLoggerFactory(console),
+        },
+        sink,
+        buffered_outputs=("file",),
+    )
+
+    factory().info(file="first", console="first")
+    factory().debug(file="second", console="")
+    assert log_file.getvalue() == ""
+    assert console.getvalue() == "first\n"
+
+    factory().warning(file="third")
+    assert log_file.getvalue() == "first\nsecond\nthird\n"
+
+    for i in range(3):
+        factory().info(file=str(i))
+    assert log_file.getvalue().endswith("third\n0\n1\n2\n")
+    assert not sink.pending
+
+
+def test_buffered_log_sink_flushes_after_max_age():
+    log_file = io.StringIO()
+    sink = BufferedLogSink(max_age=0.01)
+    logger = MultiOptimisticLoggerFactory(
+        {}, {"file": structlog.PrintLoggerFactory(log_file)}, sink, ("file",)
+    )()
+
+    logger.info(file="line")
+    timer = sink.timer
+    if timer is not None:
+        timer.join()
+
+    assert log_file.getvalue() == "line\n"
+
+
+def test_buffered_log_sink_flushes_batches_in_order():
+    written = []
+    writing = threading.Event()
+    proceed = threading.Event()
+
+    class SlowFile:
+        def write(self, s):
+            if s == "first\n":
+                writing.set()
+                proceed.wait(5)
+            written.append(s)
+
+        def flush(self):
+            pass
+
+    sink = BufferedLogSink(max_age=60)
+    logger = MultiOptimisticLoggerFactory(
+        {}, {"file": structlog.PrintLoggerFactory(SlowFile())}, sink, ("file",)
+    )()
+
+    logger.info(file="first")
+    first = threading.Thread(target=sink.flush)
+    first.start()
+    assert writing.wait(5)
+    logger.info(file="second")
+    second = threading.Thread(target=sink.flush)
+    second.start()
+    # The second batch must wait until the first one has been written.
+    second.join(0.1)
+    assert written == []
+
+    proceed.set()
+    first.join()
+    second.join()
+    assert written == ["first\n", "second\n"]
+
+
+def test_buffered_log_sink_flushes_on_sigterm(tmp_path):
+    log_path = tmp_path / "test.log"
+    script = textwrap.dedent(
+        f"""
+        import os, signal, time
+        import structlog
+        from fc.util.logging import BufferedLogSink, MultiOptimisticLoggerFactory
+
+        sink = BufferedLogSink(max_age=60)
+        sink.flush_on_sigterm()
+        log_file = open({str(log_path)!r}, "a")
+        logger = MultiOptimisticLoggerFactory(
+            {{}}, {{"file": structlog.PrintLoggerFactory(log_file)}}, sink, ("file",)
+        )()
+        logger.info(file="line")
+        os.kill(os.getpid(), signal.SIGTERM)
+        time.sleep(5)
+        """
+    )
+
+    proc = subprocess.run([sys.executable, "-c", script], timeout=10)
+
+    # Still terminated by the signal.
+    assert proc.returncode == -signal.SIGTERM
+    assert log_path.read_text() == "line\n"
@@ -0,0 +1,63 @@
+import json
+
+from fc.util.nix_log import BuildProgress
+
+
+def nix_line(**message):
+    return "@nix " + json.dumps(message) + "\n"
+
+
+def test_build_progress_counts_builds_and_substitutions(log):
+    progress = BuildProgress()
+    lines = [
+        nix_line(action="msg", level=0, msg="\x1b[31;1merror:\x1b[0m boom"),
+        nix_line(action="start", id=1, level=0, type=104, text="", fields=[]),
+        nix_line(
+            action="start",
+            id=2,
+            level=3,
+            type=105,
+            text="building",
+            fields=["/nix/store/abc-hello-1.0.drv", "", 1, 1],
+        ),
+        nix_line(action="stop", id=2),
+        nix_line(
+            action="start",
+            id=3,
+            level=4,
+            type=108,
+            text="",
+            fields=["/nix/store/def-glibc-2.37", "https://cache"],
+        ),
+        nix_line(action="start", id=4, level=4, type=100, text="", fields=[]),
+        nix_line(action="result", id=4, type=105, fields=[4096, 8192, 0, 0]),
+        nix_line(action="stop", id=4),
+        nix_line(action="stop", id=3),
+        nix_line(action="msg", level=5, msg="debug noise"),
+        "output without prefix\n",
+        "@nix {invalid json\n",
+    ]
+    for line in lines:
+        progress.feed(line)
+    progress.finish()
+
+    assert progress.changed
+    assert progress.text == "error: boom\noutput without prefix"
+    stats = progress.stats()
+    assert stats["builds"] == 1
+    assert stats["substitutions"] == 1
+    assert stats["copied_bytes"] == 4096
+    assert stats["duration"] >= stats["evaluation_seconds"] >= 0
+    assert log.has("system-build-step", kind="build", name="hello-1.0.drv")
+    assert log.has("system-build-step", kind="substitute", name="glibc-2.37")
+    assert log.has("nix-log-unparseable")
+
+
+def test_build_progress_nothing_to_do():
+    progress = BuildProgress()
+    progress.feed(nix_line(action="msg", level=1, msg="warning: something"))
+    progress.finish()
+
+    assert not progress.changed
+    assert progress.text == "warning: something"
+    assert progress.stats()["builds"] == 0
@@ -1,6 +1,8 @@
+import os
 import shlex
 import textwrap
 import unittest.mock
+from pathlib import Path
 from unittest import mock
 
 import pytest
@@ -143,6 +145,84 @@ def test_build_system_fail(log, monkeypatch):
     assert log.has("system-build-failed", stderr=build_output.strip())
 
 
+def test_build_system_low_priority(log, monkeypatch):
+    system_path = "/nix/store/v49jzgwblcn9vkrmpz92kzw5pkbsn0vz-nixos-system"
+    popen_mock = mock.Mock(
+        side_effect=lambda cmd, **kw: PollingFakePopen(
+            cmd, stdout=system_path, stderr="\n", poll="stderr"
+        )
+    )
+    monkeypatch.setattr("subprocess.Popen", popen_mock)
+    monkeypatch.setattr(
+        "fc.util.nixos.system_closure_size", lambda *args: 2_000_000
+    )
+
+    nixos.build_system(low_priority=True)
+
+    assert popen_mock.call_args.kwargs["preexec_fn"] == nixos._lower_priority
+
+    # Channel.build passes the logger as positional argument.
+    nixos.build_system(None, [], None, structlog.get_logger())
+    assert popen_mock.call_args.kwargs["preexec_fn"] == (
+        nixos._increase_soft_fd_limit
+    )
+
+
+def test_build_system_structured_log(log, monkeypatch, tmp_path):
+    system_path = "/nix/store/v49jzgwblcn9vkrmpz92kzw5pkbsn0vz-nixos-system"
+    build_output = "\n".join(
+        [
+            '@nix {"action":"msg","level":3,"msg":"these 1 derivations will be built:"}',
+            '@nix {"action":"start","id":7,"level":3,"type":105,"text":"","fields":["/nix/store/a-etc.drv"]}',
+            '@nix {"action":"stop","id":7}',
+        ]
+    )
+    popen_mock = mock.Mock(
+        side_effect=lambda cmd, **kw: PollingFakePopen(
+            cmd, stdout=system_path, stderr=build_output, poll="stderr"
+        )
+    )
+    monkeypatch.setattr("subprocess.Popen", popen_mock)
+    monkeypatch.setattr(
+        "fc.util.nixos.system_closure_size", lambda *args: 2_000_000
+    )
+    stats_file = tmp_path / "system-build.json"
+    monkeypatch.setattr("fc.util.nixos.SYSTEM_BUILD_STATS_FILE", stats_file)
+
+    assert nixos.system_build_metrics() == {}
+
+    nixos.build_system(structured_log=True)
+
+    cmd = popen_mock.call_args.args[0]
+    assert cmd[-2:] == ["--log-format", "internal-json"]
+    assert log.has("system-build-step", kind="build", name="etc.drv")
+    assert log.has("system-build-stats", builds=1, substitutions=0)
+    assert log.has(
+        "system-build-succeeded",
+        changed=True,
+        build_output="these 1 derivations will be built:",
+    )
+    metrics = nixos.system_build_metrics()
+    assert metrics["last_system_build_builds"] == 1
+    assert metrics["last_system_build_success"] == 1
+    assert metrics["last_system_build_finished_seconds_ago"] >= 0
+
+
+def test_pin_and_unpin_system(log, tmp_path):
+    gc_root = tmp_path / "gcroots" / "next-system"
+    nixos.pin_system("/nix/store/old-system", gc_root)
+    nixos.pin_system("/nix/store/new-system", gc_root)
+    assert gc_root.readlink() == Path("/nix/store/new-system")
+
+    # Another system has been pinned meanwhile, keep it.
+    nixos.unpin_system("/nix/store/old-system", gc_root)
+    assert gc_root.is_symlink()
+
+    nixos.unpin_system("/nix/store/new-system", gc_root)
+    assert not gc_root.is_symlink()
+    nixos.unpin_system("/nix/store/new-system", gc_root)
+
+
 def test_switch_to_system(log, monkeypatch):
     system_path = "/nix/store/v49jzgwblcn9vkrmpz92kzw5pkbsn0vz-nixos-system-test-21.05.1367.817a5b0"
     switch_output = textwrap.dedent(
@@ -209,6 +289,131 @@ def test_update_system_channel(log, monkeypatch):
     ]
 
 
+@pytest.fixture
+def channel_cache_file(tmp_path, monkeypatch):
+    path = tmp_path / "channels.json"
+    monkeypatch.setattr("fc.util.channel_cache.CACHE_FILE", path)
+    return path
+
+
+def test_channel_version_is_cached_for_immutable_urls(
+    log, channel_cache_file, tmp_path, monkeypatch
+):
+    nixpkgs = tmp_path / "nixpkgs"
+    nixpkgs.mkdir()
+    (nixpkgs / ".version").write_text("23.11")
+    (nixpkgs / ".version-suffix").write_text(".1234.abcdef")
+    run_mock = mock.Mock()
+    run_mock.return_value.stdout = f"{nixpkgs}\n"
+    monkeypatch.setattr("subprocess.run", run_mock)
+
+    assert nixos.channel_version(FC_CHANNEL) == "23.11.1234.abcdef"
+    assert nixos.channel_version(FC_CHANNEL) == "23.11.1234.abcdef"
+    assert run_mock.call_count == 1
+    assert log.has("channel-version-cached", channel=FC_CHANNEL)
+
+    # Channel URLs which may change their content are not cached.
+    other_channel = "https://example.com/channel/nixexprs.tar.xz"
+    nixos.channel_version(other_channel)
+    nixos.channel_version(other_channel)
+    assert run_mock.call_count == 3
+
+
+def test_resolve_url_redirects_is_cached_until_channel_update(
+    log, channel_cache_file, monkeypatch
+):
+    head = mock.Mock()
+    head.return_value.url = FC_CHANNEL
+    monkeypatch.setattr(nixos.get_requests_session(), "head", head)
+    channel_url = "https://hydra.flyingcircus.io/channel/fc-23.11-production"
+
+    assert nixos.resolve_url_redirects(channel_url) == FC_CHANNEL
+    assert nixos.resolve_url_redirects(channel_url) == FC_CHANNEL
+    assert head.call_count == 1
+
+    monkeypatch.setattr(
+        "fc.util.nixos.current_nixos_channel_url", lambda log: FC_CHANNEL
+    )
+    monkeypatch.setattr(
+        "subprocess.Popen",
+        mock.Mock(
+            return_value=PollingFakePopen(
+                "nix-channel --update nixos", stdout="", poll="stdout"
+            )
+        ),
+    )
+    nixos.update_system_channel(FC_CHANNEL)
+
+    assert nixos.resolve_url_redirects(channel_url) == FC_CHANNEL
+    assert head.call_count == 2
+
+
+def test_channel_cache_is_disabled_without_cache_dir(
+    log, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(
+        "fc.util.channel_cache.CACHE_FILE", tmp_path / "missing" / "c.json"
+    )
+    head = mock.Mock()
+    head.return_value.url = FC_CHANNEL
+    monkeypatch.setattr(nixos.get_requests_session(), "head", head)
+
+    nixos.resolve_url_redirects("https://example.com/channel")
+    nixos.resolve_url_redirects("https://example.com/channel")
+
+    assert head.call_count == 2
+    assert not (tmp_path / "missing").exists()
+
+
+def test_system_closure_size_reuses_cached_path_sizes(
+    log, logger, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(
+        "fc.util.closure_cache.CACHE_FILE", tmp_path / "closure-sizes.json"
+    )
+    store = tmp_path / "store"
+    # Entries for missing store paths are dropped, so create them.
+    sizes = {}
+    for name, size in [("glibc", 30), ("kernel-1", 100), ("kernel-2", 120)]:
+        sizes[str(store / name)] = size
+    for system in ("system-1", "system-2"):
+        sizes[str(store / system)] = 1
+    for path in sizes:
+        os.makedirs(path)
+    closures = {
+        str(store / f"system-{v}"): [
+            str(store / "glibc"),
+            str(store / f"kernel-{v}"),
+            str(store / f"system-{v}"),
+        ]
+        for v in (1, 2)
+    }
+
+    def run(args, **kwargs):
+        if args[:2] == ["nix-store", "--query"]:
+            stdout = "\n".join(closures[args[-1]])
+        else:
+            stdout = "\n".join(f"{p}\t{sizes[p]}" for p in args[3:])
+        return mock.Mock(stdout=stdout + "\n")
+
+    run_mock = mock.Mock(side_effect=run)
+    monkeypatch.setattr("subprocess.run", run_mock)
+    current = tmp_path / "current-system"
+    current.symlink_to(store / "system-1")
+
+    assert nixos.system_closure_size(logger, current) == 131
+    assert nixos.system_closure_size(logger, store / "system-1") == 131
+    assert run_mock.call_count == 2
+
+    assert nixos.system_closure_size(logger, store / "system-2") == 151
+    # Only the new kernel and system have been queried.
+    assert run_mock.call_args.args[0][3:] == [
+        str(store / "kernel-2"),
+        str(store / "system-2"),
+    ]
+    assert run_mock.call_count == 4
+
+
 def test_find_nix_build_error_missing_option():
     stderr = textwrap.dedent(
         """
@@ -1,3 +1,4 @@
+import shutil
 import sys
 import unittest.mock
 from itertools import chain, repeat
@@ -29,6 +30,21 @@ import fc.util.slurm
 from fc.util.slurm import NodeStateError, NodeStateTimeout, drain
 
 
+def patch_get_node_infos(monkeypatch, fake_get_node_info):
+    """Serves snapshots from a fake for single nodes. Fails if single nodes
+    are requested from the controller.
+    """
+
+    def fake_get_node_infos(node_names):
+        return {name: fake_get_node_info(name) for name in node_names}
+
+    def fail(node_name):
+        raise AssertionError(f"Requested single node {node_name}")
+
+    monkeypatch.setattr(fc.util.slurm, "get_node_infos", fake_get_node_infos)
+    monkeypatch.setattr(fc.util.slurm, "get_node_info", fail)
+
+
 @pytest.mark.parametrize(
     "state",
     ["IDLE+DRAIN", "ALLOCATED+DRAIN", "MIXED+DRAIN", "DOWN+DRAIN", "DOWN"],
@@ -148,7 +164,7 @@ def test_drain_many_noop(logger, monkeypatch):
     def fake_get_node_info(node_name):
         return {"name": node_name, "state": "IDLE+DRAIN"}
 
-    monkeypatch.setattr(fc.util.slurm, "get_node_info", fake_get_node_info)
+    patch_get_node_infos(monkeypatch, fake_get_node_info)
 
     fc.util.slurm.drain_many(
         logger, ["test20", "test21"], 3, "test drain noop"
@@ -265,7 +281,7 @@ def test_drain_many(logger, monkeypatch):
             "state": next(iter_states[node_name]),
         }
 
-    monkeypatch.setattr(fc.util.slurm, "get_node_info", fake_get_node_info)
+    patch_get_node_infos(monkeypatch, fake_get_node_info)
     fc.util.slurm.drain_many(
         logger, list(iter_states.keys()), 3, "test drain many"
     )
@@ -298,7 +314,7 @@ def test_drain_many_timeout(logger, log, monkeypatch):
             "state": next(iter_states[node_name]),
         }
 
-    monkeypatch.setattr(fc.util.slurm, "get_node_info", fake_get_node_info)
+    patch_get_node_infos(monkeypatch, fake_get_node_info)
 
     with raises(NodeStateTimeout) as e:
         fc.util.slurm.drain_many(
@@ -361,7 +377,7 @@ def test_ready_many(logger, monkeypatch):
             "reason": "other" if node_name == "test25" else "test ready many",
         }
 
-    monkeypatch.setattr(fc.util.slurm, "get_node_info", fake_get_node_info)
+    patch_get_node_infos(monkeypatch, fake_get_node_info)
     fc.util.slurm.ready_many(
         logger,
         list(iter_states.keys()),
@@ -394,7 +410,7 @@ def test_ready_many_timeout(logger, log, monkeypatch):
             "reason": "test ready many timeout",
         }
 
-    monkeypatch.setattr(fc.util.slurm, "get_node_info", fake_get_node_info)
+    patch_get_node_infos(monkeypatch, fake_get_node_info)
 
     with raises(NodeStateTimeout) as e:
         fc.util.slurm.ready_many(
@@ -413,3 +429,109 @@ def test_ready_many_timeout(logger, log, monkeypatch):
         timeout=3,
         remaining_node_states=remaining_node_states,
     )
+
+
+def test_get_node_infos_uses_one_request():
+    pyslurm.node.reset_mock()
+    pyslurm.node.return_value.get.return_value = {
+        "test20": {"name": "test20", "state": "IDLE"},
+        "test21": {"name": "test21", "state": "MIXED"},
+        "test22": {"name": "test22", "state": "DOWN"},
+    }
+
+    node_infos = fc.util.slurm.get_node_infos(["test20", "test22"])
+
+    assert node_infos == {
+        "test20": {"name": "test20", "state": "IDLE"},
+        "test22": {"name": "test22", "state": "DOWN"},
+    }
+    pyslurm.node.return_value.get.assert_called_once_with()
+    pyslurm.node.return_value.get_node.assert_not_called()
+
+
+def make_proc_dir(proc_dir, comms):
+    for pid, comm in enumerate(comms, start=1):
+        (proc_dir / str(pid)).mkdir()
+        (proc_dir / str(pid) / "comm").write_text(comm + "\n")
+    (proc_dir / "self").mkdir()
+
+
+def test_local_job_steps(tmp_path):
+    make_proc_dir(tmp_path, ["slurmstepd", "bash", "slurmstepd", "slurmd"])
+    assert fc.util.slurm.local_job_steps(tmp_path) == {1, 3}
+    assert fc.util.slurm.local_job_steps(tmp_path / "missing") is None
+
+
+def test_local_job_events_wake_up_when_all_steps_finished(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setattr(fc.util.slurm, "LOCAL_CHECK_INTERVAL", 0.01)
+    make_proc_dir(tmp_path, ["slurmstepd", "slurmstepd"])
+    events = fc.util.slurm.LocalJobEvents(tmp_path)
+
+    assert not events.wait(0.05)
+
+    # Other job steps still keep the node busy.
+    shutil.rmtree(tmp_path / "2")
+    assert not events.wait(0.05)
+    assert events.job_steps == {1}
+
+    # Started after the last scan, found by scanning again.
+    (tmp_path / "3").mkdir()
+    (tmp_path / "3" / "comm").write_text("slurmstepd\n")
+    shutil.rmtree(tmp_path / "1")
+    assert not events.wait(0.05)
+    assert events.job_steps == {3}
+
+    shutil.rmtree(tmp_path / "3")
+    assert events.wait(5)
+    assert events.job_steps == set()
+    # Nothing is running anymore, no further events.
+    assert not events.wait(0.05)
+
+
+def test_local_job_events_only_check_known_steps(tmp_path, monkeypatch):
+    monkeypatch.setattr(fc.util.slurm, "LOCAL_CHECK_INTERVAL", 0.01)
+    make_proc_dir(tmp_path, ["slurmstepd", "bash"])
+    events = fc.util.slurm.LocalJobEvents(tmp_path)
+    scan = MagicMock(wraps=fc.util.slurm.local_job_steps)
+    monkeypatch.setattr(fc.util.slurm, "local_job_steps", scan)
+
+    assert not events.wait(0.05)
+
+    scan.assert_not_called()
+
+
+class FakeNodeEvents:
+    def __init__(self):
+        self.pauses = []
+
+    def wait(self, seconds):
+        self.pauses.append(seconds)
+        return True
+
+
+def test_drain_wakes_up_on_events(logger, log, monkeypatch):
+    iter_states = iter(
+        [
+            "ALLOCATED",
+            "MIXED+DRAIN",
+            "MIXED+DRAIN",
+            "MIXED+DRAIN",
+            "IDLE+DRAIN",
+        ]
+    )
+
+    def fake_get_node_info(node_name):
+        return {"name": "test20", "state": next(iter_states)}
+
+    monkeypatch.setattr(fc.util.slurm, "get_node_info", fake_get_node_info)
+    monkeypatch.setattr(fc.util.slurm, "update_nodes", MagicMock())
+    events = FakeNodeEvents()
+
+    drain(logger, "test20", 10, "test drain", events=events)
+
+    # Every event means that the next pause starts short again.
+    assert events.pauses == [1, 1, 1]
+    assert log.has("drain-wait-woken-up")
+    assert log.has("drain-finished")
@@ -0,0 +1,89 @@
+"""Startup cost of the agent CLIs.
+
+Commands like `fc-maintenance metrics` or `fc-manage check` run every
+minute on every machine, so the CLI modules must not import heavy
+dependencies which are only needed by some subcommands. Those are imported
+where they are used.
+
+`test_cli_doesnt_import` fails when one of them is imported at startup
+again. The benchmark measures import times with `python -X importtime`:
+
+    pytest --with-benchmarks -s fc/util/tests/test_startup.py
+"""
+
+import json
+import re
+import subprocess
+import sys
+
+import pytest
+
+# Modules which must not be imported when loading the CLI module.
+LAZY_MODULES = {
+    "fc.maintenance.cli": [
+        "fc.maintenance.maintenance",
+        "fc.util.directory",
+        "requests",
+        "yaml",
+    ],
+    "fc.manage.cli": ["fc.util.directory", "requests", "yaml"],
+    "fc.manage.kubernetes": [
+        "fc.maintenance.reqmanager",
+        "fc.util.directory",
+        "requests",
+    ],
+    "fc.manage.collect_garbage": [
+        "fc.maintenance.reqmanager",
+        "fc.util.nixos",
+        "requests",
+    ],
+    "fc.manage.slurm": ["fc.util.directory", "requests"],
+}
+
+# Cumulative import time budget in milliseconds. Most of it is spent by
+# structlog, typer and rich which every CLI needs.
+IMPORT_TIME_BUDGET_MS = 400
+
+RE_IMPORTTIME = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| (\S+)$")
+
+
+def run_python(*args):
+    proc = subprocess.run(
+        [sys.executable, *args], capture_output=True, text=True
+    )
+    if "No module named 'pyslurm'" in proc.stderr:
+        pytest.skip("pyslurm not available")
+    assert proc.returncode == 0, proc.stderr
+    return proc
+
+
+def imported_modules(module):
+    out = run_python(
+        "-c",
+        f"import json, sys, {module}; print(json.dumps(list(sys.modules)))",
+    ).stdout
+    return set(json.loads(out))
+
+
+def import_time_ms(module):
+    stderr = run_python("-X", "importtime", "-c", f"import {module}").stderr
+    for line in stderr.splitlines():
+        match = RE_IMPORTTIME.match(line)
+        if match and match[2] == module:
+            return int(match[1]) / 1000
+
+
+@pytest.mark.parametrize("module", LAZY_MODULES)
+def test_cli_doesnt_import(module):
+    imported = imported_modules(module)
+    assert module in imported
+    assert not imported & set(LAZY_MODULES[module])
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("module", LAZY_MODULES)
+def test_benchmark_cli_import_time(module):
+    # The best of some runs, the first one may have to compile bytecode.
+    best = min(import_time_ms(module) for _ in range(5))
+    print(f"{module}: {best:.1f} ms")
+    assert best < IMPORT_TIME_BUDGET_MS
@@ -0,0 +1,83 @@
+import subprocess
+import sys
+import threading
+import time
+
+from fc.util.subprocess_helper import communicate_lines, poll_with_rusage
+
+
+def popen(script):
+    return subprocess.Popen(
+        [sys.executable, "-c", script],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+
+def test_communicate_lines_reads_both_pipes(log, logger):
+    # Much more than fits into pipe buffers on both streams.
+    proc = popen(
+        "import sys\n"
+        "for i in range(20000):\n"
+        "    print('out', i)\n"
+        "    print('err', i, file=sys.stderr)\n"
+    )
+    stderr_lines = []
+
+    result = communicate_lines(
+        proc, logger, "test-out", stderr_callback=stderr_lines.append
+    )
+
+    assert result.returncode == 0
+    assert len(result.stdout_lines) == 20000
+    assert result.stdout_lines[-1] == "out 19999\n"
+    assert stderr_lines == result.stderr_lines
+    assert result.stderr_lines[0] == "err 0\n"
+    assert result.cpu_seconds is not None
+    assert result.max_rss_kib > 0
+    assert log.has("test-out", stream="stderr", cmd_output_line="err 1")
+
+
+def test_communicate_lines_last_line_without_newline_and_max_lines(
+    log, logger
+):
+    proc = popen("print('a\\nb\\nc', end='')")
+
+    result = communicate_lines(proc, logger, "test-out", max_lines=2)
+
+    assert result.stdout_lines == ["b\n", "c"]
+
+
+def test_communicate_lines_timeout(log, logger):
+    proc = popen("import time; print('started', flush=True); time.sleep(10)")
+
+    result = communicate_lines(proc, logger, "test-out", timeout=0.2)
+
+    assert result.timed_out
+    assert result.returncode == -9
+    assert result.stdout == "started\n"
+
+
+def test_communicate_lines_cancel(log, logger):
+    proc = popen("import time; time.sleep(10)")
+    cancel = threading.Event()
+    threading.Timer(0.1, cancel.set).start()
+
+    result = communicate_lines(proc, logger, "test-out", cancel=cancel)
+
+    assert result.cancelled
+    assert not result.timed_out
+    assert result.returncode == -9
+
+
+def test_poll_with_rusage():
+    proc = subprocess.Popen([sys.executable, "-c", "import sys; sys.exit(3)"])
+    while (result := poll_with_rusage(proc)) == (None, None):
+        time.sleep(0.01)
+
+    returncode, rusage = result
+    assert returncode == 3
+    assert rusage.ru_utime >= 0
+    assert proc.returncode == 3
+    assert poll_with_rusage(proc) == (3, None)